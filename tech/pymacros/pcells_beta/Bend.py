@@ -15,53 +15,16 @@ Version history:
 """
 
 import pya
+from prl_tools.pcell_cache import cached_produce
 
 from math import pi, cos, sin
-from SiEPIC.utils import arc, points_per_circle, arc_wg, get_technology_by_name, angle_vector
-
-
-# Debug Juan: This is a modified version of the same fucntions, here until we can push this to update SiEPIC tools origin
-
-# Take a list of points and create a polygon of width 'width'. Explicitly decides to make the ends Manhattan
-def arc_to_waveguide(pts, width, manhattan = True):
-    return pya.Polygon( translate_from_normal(pts, -width / 2.0, manhattan) + translate_from_normal(pts[::-1], -width / 2.0, manhattan))
-
-# Translate each point by its normal a distance 'trans' and explicitly make ends manhattan
-def translate_from_normal(pts, trans,  manhattan = True):
-    #  pts = [pya.DPoint(pt) for pt in pts]
-    pts = [pt.to_dtype(1) for pt in pts]
-    if len(pts) < 2:
-        return pts    
-    from math import cos, sin, pi
-    d = 1. / (len(pts) - 1)
-    a = angle_vector(pts[1] - pts[0]) * pi / 180 + (pi / 2 if trans > 0 else -pi / 2)
-    tpts = [pts[0] + pya.DPoint(abs(trans) * cos(a), abs(trans) * sin(a))]
-
-    for i in range(1, len(pts) - 1):
-        dpt = (pts[i + 1] - pts[i - 1]) * (2 / d)
-        tpts.append(pts[i] + pya.DPoint(-dpt.y, dpt.x) * (trans / 1 / dpt.abs()))
-
-    a = angle_vector(pts[-1] - pts[-2]) * pi / 180 + (pi / 2 if trans > 0 else -pi / 2)
-    tpts.append(pts[-1] + pya.DPoint(abs(trans) * cos(a), abs(trans) * sin(a)))
-
-    # Make ends manhattan
-    if manhattan:
-      if abs(tpts[0].x - pts[0].x) > abs(tpts[0].y - pts[0].y):
-          tpts[0].y = pts[0].y
-      else:
-          tpts[0].x = pts[0].x
-      if abs(tpts[-1].x - pts[-1].x) > abs(tpts[-1].y - pts[-1].y):
-          tpts[-1].y = pts[-1].y
-      else:
-          tpts[-1].x = pts[-1].x
-    return [pt.to_itype(1) for pt in tpts]
+from prl_tools.tech import technology, layer_index, arc_tolerance
+
 
-    
 class Bend(pya.PCellDeclarationHelper):
   def __init__(self):
     super(Bend, self).__init__()
-    from SiEPIC.utils import get_technology_by_name
-    TECHNOLOGY = get_technology_by_name('PRL_PDK')
+    TECHNOLOGY = technology('PRL_PDK')
 
     # declare the parameters
     self.param("waveguide", self.TypeLayer, "Waveguide Layer", default = TECHNOLOGY['Si'])
@@ -85,14 +48,11 @@ class Bend(pya.PCellDeclarationHelper):
     return False
 
 
-  def produce(self, layout, layers, parameters, cell):
-    
-    TECHNOLOGY = get_technology_by_name('PRL_PDK')
+  @cached_produce
+  def produce_impl(self):
     
-    self._layers = layers
-    self.cell = cell
-    self._param_values = parameters
-    self.layout = layout
+    TECHNOLOGY = technology('PRL_PDK')
+    from prl_tools.geometry import arc_to_waveguide, arc_points
 
     # cell: layout cell to place the layout
     # LayerSiN: which layer to use
@@ -105,9 +65,9 @@ class Bend(pya.PCellDeclarationHelper):
     ly = self.layout
     shapes = self.cell.shapes
 
-    LayerWg = self.layout.layer(self.waveguide)
-    LayerPinRecN = self.layout.layer(self.pinrec)
-    LayerDevRecN = self.layout.layer(self.devrec)
+    LayerWg = layer_index(self.layout, self.waveguide)
+    LayerPinRecN = layer_index(self.layout, self.pinrec)
+    LayerDevRecN = layer_index(self.layout, self.devrec)
       
     w = int(round(self.wg_width/dbu))
     r = int(round(self.radius/dbu))
@@ -123,7 +83,8 @@ class Bend(pya.PCellDeclarationHelper):
     y = r
       
     t_shape = pya.Trans(pya.Trans.R0,x, y)
-    arc_shape = arc_to_waveguide(arc(r, 270, 270+angle), w, manhattan = False)
+    centerline = arc_points(r, 270, 270+angle, arc_tolerance(ly.technology_name))
+    arc_shape = arc_to_waveguide(centerline, w, manhattan = False)
     shapes(LayerWg).insert(arc_shape.transformed(t_shape))
     
     # Create the pins on the waveguides, as short paths:
@@ -161,7 +122,7 @@ class Bend(pya.PCellDeclarationHelper):
     shape.text_size = 0.4/dbu
 
     # Create the device recognition layer, wg_width away from the waveguides.
-    self.cell.shapes(LayerDevRecN).insert(arc_to_waveguide(arc(r, 270, 270+angle), w*3, manhattan = False).transformed(t_shape))
+    self.cell.shapes(LayerDevRecN).insert(arc_to_waveguide(centerline, w*3, manhattan = False).transformed(t_shape))
     
     TextSize = 500
     # Compact model information
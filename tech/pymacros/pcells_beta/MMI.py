@@ -18,13 +18,14 @@ from SiEPIC.utils import get_technology_by_name
   
 """
 import pya
-from SiEPIC .utils import get_technology_by_name
+from prl_tools.pcell_cache import cached_produce
+from prl_tools.tech import technology, layer_index
 
 class MMI(pya.PCellDeclarationHelper):
   def __init__(self):
     super(MMI, self).__init__()
     self.technology_name = 'PRL_PDK'
-    TECHNOLOGY = get_technology_by_name(self.technology_name)
+    TECHNOLOGY = technology(self.technology_name)
     
     # Load waveguide types as parameters
     #from SiEPIC.utils import load_Waveguides_by_Tech
@@ -66,14 +67,15 @@ class MMI(pya.PCellDeclarationHelper):
   def can_create_from_shape(self, layout, shape, layer):
     return False
     
+  @cached_produce
   def produce_impl(self):
     ly = self.layout
     dbu = self.layout.dbu
     shapes = self.cell.shapes
-    TECHNOLOGY = get_technology_by_name('PRL_PDK')
-    Layer = ly.layer(self.layer_wg)
-    LayerPinRecN = ly.layer(self.pinrec)
-    LayerDevRecN = ly.layer(self.devrec)
+    TECHNOLOGY = technology('PRL_PDK')
+    Layer = layer_index(ly, self.layer_wg)
+    LayerPinRecN = layer_index(ly, self.pinrec)
+    LayerDevRecN = layer_index(ly, self.devrec)
     
     # Create port tapers
     p1 = pya.Point(0, self.wg_width/dbu/2)
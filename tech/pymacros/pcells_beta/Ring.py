@@ -12,18 +12,23 @@ Parameters:
 
 Version history:  
   Juan Villegas 2022/08/15: Initial Release
+  2026/10/17: P1P is looked up in the PRL_PDK technology instead of Ligentec_AN800. Intended
+              change: the layers are the PRL_PDK ones the parameters default to, and the cell
+              draws without the Ligentec PDK installed.
 """
 
 import pya
+from prl_tools.pcell_cache import cached_produce, shared_cell, pcell_tag
 
-from SiEPIC.utils import arc_to_waveguide, arc_wg, get_technology_by_name
+from prl_tools.tech import technology, layer_index, arc_tolerance
      
 class Ring(pya.PCellDeclarationHelper):
   def __init__(self):
     # Important: initialize the super class
     super(Ring, self).__init__()
+    self.technology_name = 'PRL_PDK'
     # declare the parameters
-    TECHNOLOGY = get_technology_by_name('PRL_PDK')
+    TECHNOLOGY = technology(self.technology_name)
 
     # declare the parameters
     self.param("layer", self.TypeLayer, "Waveguide Layer", default = TECHNOLOGY['Si'])
@@ -57,27 +62,20 @@ class Ring(pya.PCellDeclarationHelper):
   def coerce_parameters_impl(self):
     pass
         
+  @cached_produce
   def produce_impl(self):
-    from SiEPIC.utils import arc
     from SiEPIC.extend import to_itype
+    from prl_tools.geometry import annulus_region
+    from prl_tools.length import arc_length
     from numpy import pi
-    TECHNOLOGY = get_technology_by_name('Ligentec_AN800')
-    
-    if self.layout.technology_name == '':
-        lv = pya.Application.instance().main_window().current_view()
-        if lv == None:
-          self.layout.technology_name = self.technology_name
-          self.layout.dbu = 0.005
-        else:
-          self.layout.technology_name = lv.active_cellview().layout().technology_name
-          self.layout.dbu = lv.active_cellview().layout().dbu
+    TECHNOLOGY = technology(self.technology_name)
     ly = self.layout
     dbu = ly.dbu
 
-    LayerWG = ly.layer(self.layer)
-    LayerPinRecN = ly.layer(self.pinrec)
-    LayerPinRecMN = ly.layer(self.pinrecm)
-    LayerDevRecN = ly.layer(self.devrec)
+    LayerWG = layer_index(ly, self.layer)
+    LayerPinRecN = layer_index(ly, self.pinrec)
+    LayerPinRecMN = layer_index(ly, self.pinrecm)
+    LayerDevRecN = layer_index(ly, self.devrec)
     
     radius = to_itype(self.radius,dbu)
     width = to_itype(self.width_bus,dbu)
@@ -88,27 +86,31 @@ class Ring(pya.PCellDeclarationHelper):
 
     wg_length = (radius + width)*2
     
-    self.length = 2*pi*self.radius
+    self.length = arc_length(self.radius, 360)
     
     shapes = self.cell.shapes
+    tolerance = arc_tolerance(ly.technology_name)
+    
+    # Annulus, bus and heater are child cells shared by all the rings of the layout
+    version = pcell_tag(Ring)
     
-    poly = pya.Polygon(arc(radius+width_ring/2, 0, 360))
-    hole = pya.Polygon(arc(radius-width_ring/2, 0, 360))
-    poly.insert_hole(hole.get_points())
+    def build_annulus(cell):
+      cell.shapes(LayerWG).insert(annulus_region(radius+width_ring/2, radius-width_ring/2, tolerance))
+    
+    annulus = shared_cell(ly, 'Ring_annulus_r%g_w%g' % (radius*dbu, width_ring*dbu),
+                          (radius, width_ring, str(self.layer), tolerance, version), build_annulus)
     t = pya.Trans(pya.Trans.R0, wg_length/2, radius+gap+(width_ring+width)/2)
-    self.cell.shapes(LayerWG).insert(poly.transformed(t))
+    self.cell.insert(pya.CellInstArray(annulus.cell_index(), t))
     
     # Waveguide clearance 
-    poly = pya.Polygon(arc(radius+clearance, 0, 360))
-    hole = pya.Polygon(arc(radius-clearance, 0, 360))
-    poly.insert_hole(hole.get_points())
     t = pya.Trans(pya.Trans.R0, wg_length/2, radius+gap+(width_ring+width)/2)
-    clear_shapes = [poly.transformed(t)]
+    clear_shapes = list(annulus_region(radius+clearance, radius-clearance, tolerance).transformed(t).each())
     
     # bus waveguides
-    waveguide = pya.Box(0, -width/2, wg_length, width/2 ) 
-    t = pya.Trans(pya.Trans.R0, 0, 0) 
-    shapes(LayerWG).insert(waveguide.transformed(t))
+    bus = shared_cell(ly, 'Ring_bus_l%g_w%g' % (wg_length*dbu, width*dbu),
+                      (wg_length, width, str(self.layer), version),
+                      lambda cell: cell.shapes(LayerWG).insert(pya.Box(0, -width/2, wg_length, width/2)))
+    self.cell.insert(pya.CellInstArray(bus.cell_index(), pya.Trans(pya.Trans.R0, 0, 0)))
     
     poly = pya.Box(0, -clearance, wg_length, clearance) 
     t = pya.Trans(pya.Trans.R0, 0, 0)
@@ -117,8 +119,7 @@ class Ring(pya.PCellDeclarationHelper):
     y_drop = 2*radius+(width_ring+width)+gap+gap_drop
     
     if self.use_drop:
-      t1 = pya.Trans(pya.Trans.R0, 0, y_drop)
-      shapes(LayerWG).insert(waveguide.transformed(t1))
+      self.cell.insert(pya.CellInstArray(bus.cell_index(), pya.Trans(pya.Trans.R0, 0, y_drop)))
       clear_shapes += [poly.transformed(t)]
       
     proc = pya.EdgeProcessor()
@@ -136,7 +137,7 @@ class Ring(pya.PCellDeclarationHelper):
     if self.use_heater:
       from numpy import pi, cos, sin, tan, arccos, linspace, flip
       m_angle = 60;
-      LayerM = ly.layer(self.layerM)
+      LayerM = layer_index(ly, self.layerM)
       #shape = arc_wg(radius, to_itype(self.widthM,dbu), -m_angle, 180+m_angle, DevRec=None)
       #metal_shapes = [shape]
       m_width = to_itype(self.widthM,dbu);
@@ -167,13 +168,15 @@ class Ring(pya.PCellDeclarationHelper):
           for i in range(1,npoints):
             arr.append(arr0[npoints-i])
           
-          #Heater path
-          npoints = 361
-          ang_v = linspace(-m_angle,360-2*m_angle,npoints);
-          for a  in ang_v:
-             arr.append (pya.Point(radius*cos(a/180*pi), radius*sin(a/180*pi)))
+          #Heater path: the arc is a ring sector, ending radially where the connections join it
+          metal_shapes = list(annulus_region(radius+m_width/2, radius-m_width/2, tolerance, -m_angle, 360-2*m_angle).each())
+          # each connection path continues one degree along the arc, so their joint is filled as in a single path
+          x_in = int(radius*cos((1-m_angle)/180*pi))
+          y_in = int(radius*sin((1-m_angle)/180*pi))
+          metal_shapes += [pya.Path(arr + [pya.Point(x0,y0), pya.Point(x_in,y_in)], m_width).polygon()]
           
           #Connection in the output
+          arr_out = [pya.Point(-x_in,y_in), pya.Point(-x0,y0)]
           npoints = 31
           ang_v = linspace(90-m_angle,e_angle,npoints);  
           xa = -x0;
@@ -183,15 +186,15 @@ class Ring(pya.PCellDeclarationHelper):
             dy = dh*sin(ang_v[i]/180*pi)
             xa += dx;
             ya -= dy;
-            arr.append(pya.Point(int(xa),int(ya) ))
-          metal_shapes = [pya.Path(arr, m_width).polygon()]   
+            arr_out.append(pya.Point(int(xa),int(ya) ))
+          metal_shapes += [pya.Path(arr_out, m_width).polygon()]
           
-          x_pin =    arr[-1].x 
-          y_pin =    arr[-1].y-int(pin_width/2)+int(m_width/2)
+          x_pin =    arr_out[-1].x 
+          y_pin =    arr_out[-1].y-int(pin_width/2)+int(m_width/2)
           #Taper
           metal_shapes += [pya.Polygon([  
-            pya.Point(arr[-1].x+int(m_width/2),arr[0].y), pya.Point(arr[-1].x-int(m_width/2),arr[0].y),  
-            pya.Point(arr[-1].x-int(pin_width/2),y_pin), pya.Point(arr[-1].x+int(pin_width/2),y_pin) ])]
+            pya.Point(arr_out[-1].x+int(m_width/2),arr[0].y), pya.Point(arr_out[-1].x-int(m_width/2),arr[0].y),  
+            pya.Point(arr_out[-1].x-int(pin_width/2),y_pin), pya.Point(arr_out[-1].x+int(pin_width/2),y_pin) ])]
           metal_shapes += [pya.Polygon([  
             pya.Point(arr[0].x+int(m_width/2),arr[0].y), pya.Point(arr[0].x-int(m_width/2),arr[0].y),  
             pya.Point(arr[0].x-int(pin_width/2),y_pin), pya.Point(arr[0].x+int(pin_width/2),y_pin) ])]
@@ -207,8 +210,7 @@ class Ring(pya.PCellDeclarationHelper):
           y1 = -int(radius*(sin(b_angle)))-m_width/2
           y2 = y0-to_itype(3.0,dbu)
           
-          shape = arc_wg(radius, to_itype(self.widthM,dbu), -m_angle, 180+m_angle, DevRec=None)
-          metal_shapes = [shape]
+          metal_shapes = list(annulus_region(radius+m_width/2, radius-m_width/2, tolerance, -m_angle, 180+m_angle).each())
           
           metal_shapes += [pya.Polygon([ pya.Point(-x0,y0),  pya.Point(-x1,y0),pya.Point(-x1,y1) ])]
           metal_shapes += [pya.Polygon([ pya.Point(-x0,y0),  pya.Point(-x1,y0),pya.Point(-x1,y2), pya.Point(-x0,y2) ]), ]
@@ -218,12 +220,17 @@ class Ring(pya.PCellDeclarationHelper):
           x_pin =    x0+int(pin_width/2)
           y_pin =    y2
        
-      merged = proc.merge_to_polygon(metal_shapes,0, True,True)
-      shapes(LayerM).insert(merged[0].transformed(t))
+      def build_heater(cell):
+        merged = proc.merge_to_polygon(metal_shapes,0, True,True)
+        cell.shapes(LayerM).insert(merged[0])
+      
+      heater = shared_cell(ly, 'Ring_heater_r%g_w%g_%s' % (radius*dbu, m_width*dbu, 'round' if self.round_end else 'flat'),
+                           (radius, m_width, bool(self.round_end), str(self.layerM), tolerance, version), build_heater)
+      self.cell.insert(pya.CellInstArray(heater.cell_index(), t))
       
       #Electrical pins
       t_pin = pya.Trans(t, -x_pin,y_pin)
-      if LayerM == ly.layer(TECHNOLOGY['P1P']):
+      if LayerM == layer_index(ly, TECHNOLOGY['P1P']):
           #Draw connection to P1R and VIAS, and PINS for P1R
           pass
       else:
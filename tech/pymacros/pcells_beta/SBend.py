@@ -17,8 +17,9 @@ Version history:
 from . import *
 from pya import *
 import pya
+from prl_tools.pcell_cache import cached_produce
 
-from SiEPIC.utils import get_technology_by_name
+from prl_tools.tech import technology, layer_index
 
 
 class SBend(pya.PCellDeclarationHelper):
@@ -30,7 +31,7 @@ class SBend(pya.PCellDeclarationHelper):
 
     # Important: initialize the super class
     super(SBend, self).__init__()
-    TECHNOLOGY = get_technology_by_name('PRL_PDK')
+    TECHNOLOGY = technology('PRL_PDK')
 
     # declare the parameters
     self.param("length", self.TypeDouble, "Waveguide length", default = 20.0)     
@@ -53,6 +54,7 @@ class SBend(pya.PCellDeclarationHelper):
   def can_create_from_shape(self, layout, shape, layer):
     return False
     
+  @cached_produce
   def produce_impl(self):
   
     # fetch the parameters
@@ -60,19 +62,22 @@ class SBend(pya.PCellDeclarationHelper):
     ly = self.layout
     shapes = self.cell.shapes
 
-    from SiEPIC.utils.layout import layout_waveguide_sbend, layout_waveguide_sbend_bezier
+    from SiEPIC.utils.geometry import bezier_parallel
+    from prl_tools.geometry import as_array, arc_to_waveguide
 
     LayerSi = self.layer
-    LayerSiN = ly.layer(LayerSi)
-    LayerPinRecN = ly.layer(self.pinrec)
-    LayerDevRecN = ly.layer(self.devrec)
+    LayerSiN = layer_index(ly, LayerSi)
+    LayerPinRecN = layer_index(ly, self.pinrec)
+    LayerDevRecN = layer_index(ly, self.devrec)
 
     length = self.length / dbu
     w = self.wg_width / dbu
     h = self.height / dbu
    
 #    waveguide_length = layout_waveguide_sbend(self.cell, LayerSiN, pya.Trans(Trans.R0, 0,0), w, r, h, length)
-    waveguide_length = layout_waveguide_sbend_bezier(self.cell, LayerSiN, Trans(), w*dbu, w*dbu, h*dbu, length*dbu) / dbu
+    pts = as_array(bezier_parallel(DPoint(0, 0), DPoint(length*dbu, h*dbu), 0)) / dbu
+    wg_polygon = arc_to_waveguide(pts, w)
+    shapes(LayerSiN).insert(wg_polygon)
     
     from SiEPIC._globals import PIN_LENGTH as pin_length
 
@@ -12,19 +12,24 @@ Parameters:
 
 Version history:  
   Juan Villegas 2022/08/15: Initial Release
+  2026/10/17: The waveguide layers are looked up in the PRL_PDK technology, which also holds the
+              waveguide types, instead of Ligentec_AN800. Intended change: the layer names of the
+              PRL_PDK waveguide types map to PRL_PDK layer numbers (e.g. Si 1/0) and the cell draws
+              without the Ligentec PDK installed.
 """
 
 import pya
-from SiEPIC.utils import get_technology_by_name
+from prl_tools.pcell_cache import cached_produce
+from prl_tools import instrument
+from prl_tools.tech import technology, waveguide_types, waveguide_type, layer_index, arc_tolerance
 from pya import *
 
 class Spiral(pya.PCellDeclarationHelper):
   def __init__(self):
     super(Spiral, self).__init__()
     self.technology_name = 'PRL_PDK'
-    TECHNOLOGY = get_technology_by_name(self.technology_name)
-    from SiEPIC.utils import load_Waveguides_by_Tech
-    self.waveguide_types = load_Waveguides_by_Tech(self.technology_name)
+    TECHNOLOGY = technology(self.technology_name)
+    self.waveguide_types = waveguide_types(self.technology_name)
     
     p = self.param("waveguide_type", self.TypeList, "Waveguide Type", default = self.waveguide_types[0]['name'])
     for wa in self.waveguide_types:
@@ -52,175 +57,69 @@ class Spiral(pya.PCellDeclarationHelper):
   def can_create_from_shape(self, layout, shape, layer):
     return False
     
+  @cached_produce
   def produce_impl(self):
-    if self.layout.technology_name == '':
-        lv = pya.Application.instance().main_window().current_view()
-        if lv == None:
-          self.layout.technology_name = self.technology_name
-          self.layout.dbu = 0.005
-        else:
-          self.layout.technology_name = lv.active_cellview().layout().technology_name
-          self.layout.dbu = lv.active_cellview().layout().dbu
     ly = self.layout
     
-    TECHNOLOGY = get_technology_by_name('Ligentec_AN800') 
+    TECHNOLOGY = technology(self.technology_name) 
     shapes = self.cell.shapes
     dbu = self.layout.dbu
     
     
     # Load parameters for the chosen waveguide type
-    params = [t for t in self.waveguide_types if t['name'] == self.waveguide_type]
-    if type(params) == type([]) and len(params) > 0:
-        params = params[0]
-    else:
-        print('Error: waveguide type not found in PDK waveguides')
-        raise Exception('error: waveguide type (%s) not found in PDK waveguides'%waveguide_type)
+    params = waveguide_type(self.waveguide_type, self.technology_name)
     
     # Load layer information
     layers = []
     for c in params['component']:
       layers.append(c)
 
-    from SiEPIC.utils import points_per_circle, translate_from_normal
-    from SiEPIC.extend import to_itype, to_dtype
-    from numpy import sin, cos
+    from SiEPIC.extend import to_itype
+    from prl_tools.geometry import waveguide_polygons
     # Load other parameters
     self.min_radius = float(params['radius'])
     self.wg_width =  float(layers[0]['width'])
     spacing = self.wg_spacing+self.wg_width;
     
-    layerWaveguides = ly.layer(TECHNOLOGY[layers[0]['layer']])
-    layerPinRecN = ly.layer(self.pinrec)
-    layerDevRecN = ly.layer(self.devrec)
+    layerPinRecN = layer_index(ly, self.pinrec)
+    layerDevRecN = layer_index(ly, self.devrec)
   
-    from scipy import pi
-    import numpy as np
-   
-    def ph_spiral_length(r, spacing, N):
-      d = 2*(2*r)
-      D = d+spacing*4*N
-      lspiral1 = spiral_length(d,D, N)
-      lspiral2 = spiral_length(d+spacing,D+spacing, N)
-      if self.spiral_ports: 
-        lspiral2  += spiral_length(D,D+4*spacing, N)/2
-      slength = 2*pi*r 
-      return slength + lspiral1 + lspiral2 
-    
-    def spiral_length(d, D, N):
-      return pi*N*(d+D)/2
-    
-    #Find parameters for approximate length of spiral
-    r = self.min_radius
-    d = 2*r
-    D = d+2*(spacing*2)
-    
-    # Initial guess for the number of turns
-    L_spiral = (self.length- 2*(2*pi* r))
-    N = np.floor(L_spiral/(pi*(d+D)/2  +  pi*(d+spacing+D+spacing)/2  )   )       +1
-    
-    
-    # Closer guess 
-    L_spiral2 = self.length+1
-    while L_spiral2 > self.length:
-      N-= 1
-      L_spiral2= ph_spiral_length(r, spacing ,N)
-    N = 1 if N <=0 else N
-    
-    #Find exact radius
-    from scipy import optimize
-    new_r = 0
-    new_r = optimize.newton(lambda r: ph_spiral_length(r, spacing, N) - self.length, r)
-    self.radius = new_r if new_r>= self.min_radius else self.min_radius
+    from math import pi
+    from prl_tools.spiral import solve_spiral, spiral_centerline
+    from prl_tools.length import spiral_centerline_length
+    
+    # Find the number of turns and the exact radius for the target length (cached per geometry)
+    solution = solve_spiral(self.length, self.wg_spacing, self.wg_width, self.min_radius, self.spiral_ports, self.waveguide_type)
+    N = solution.turns
+    self.radius = solution.radius
 
-    print('Corrected radius:%s, L=%s'%( self.radius,ph_spiral_length(new_r, spacing, N) ))
-    
-    # Get a full turn of points from a spiral
-    def get_spiral_points(a, r, angle = 2*pi, start_angle = 0):
-      wg_pts = []
-      npoints = int(points_per_circle(r)*(angle/(2*pi))) # number of points per circle.
-      dtetha = angle / npoints  # increment, in radians, for each point:   
-      for i in range(0, npoints+1):
-        t = i*dtetha + start_angle
-        xa = to_itype((a*t + r) * cos(t),dbu);
-        ya = to_itype((a*t + r) * sin(t),dbu);
-        #wg_pts.append(pya.Point.from_dpoint(pya.DPoint(xa/dbu, ya/dbu)))
-        wg_pts.append(pya.Point(xa,ya))
-      return wg_pts
+    instrument.log('Corrected radius:%s, L=%s', self.radius, solution.length)
     
-    def get_s_points(r, angle = 2*pi, trans = pya.Trans.R0):
-      wg_pts = []
-      npoints = int(points_per_circle(r)) # number of points per circle.
-      dtetha = angle / npoints  # increment, in radians, for each point:   
-      for i in range(0, npoints+1):
-        t = i*dtetha
-        if abs(t)<pi :
-          xa = r * cos(t)
-        else: 
-          xa = - r * cos(t)-2*r
-        ya = r * sin(t);
-        #wg_pts.append(pya.Point.from_dpoint(pya.DPoint(xa/dbu, ya/dbu))*trans)
-        wg_pts.append(pya.Point(to_itype(xa,dbu), to_itype(ya,dbu))*trans)
-      return wg_pts
-    
-    
-    # Draw waveguide from a polyline
+    # Draw waveguide from a polyline, all layers share the same centerline
     def draw_poly_wg(pts,layers, t = pya.Trans(0,0)):
       turn = 0
-      for c in layers:
-        layer = ly.layer(TECHNOLOGY[c['layer']])
-        width = to_itype(c['width'], dbu)
-        offset = to_itype(c['offset'], dbu)
-        
-        wg_polygon = pya.Polygon(translate_from_normal(pts, width/2 + (offset if turn > 0 else - offset)) +
-                               translate_from_normal(pts, -width/2 + (offset if turn > 0 else - offset))[::-1])
-        shapes(layer).insert(wg_polygon.transformed(t))
-        if layer == layerWaveguides:
-          area = wg_polygon.area()
-          length = to_dtype(area,dbu)/width
-      return length
+      widths = [to_itype(c['width'], dbu) for c in layers]
+      offsets = [(to_itype(c['offset'], dbu) if turn > 0 else - to_itype(c['offset'], dbu)) for c in layers]
+      wg_polygons = waveguide_polygons(pts, widths, offsets)
+      for c, wg_polygon in zip(layers, wg_polygons):
+        shapes(layer_index(ly, TECHNOLOGY[c['layer']])).insert(wg_polygon.transformed(t))
     
     #Draw  Archimedes Spiral
-    # r = b + a * theta
-    b = self.radius
-    a = 2*spacing/(2*pi)
-    
-    drawn_length = 0 
-    drawn_length2 = 0   
-
-    # Centre S-shape connecting waveguide        
-    t = pya.Trans(pya.Trans.R0,to_itype(b,dbu),0)
-    r = b
-    pts = (get_s_points(r , -2*pi, t))
-    
-    def reverse(arg):
-      return [arg[len(arg) - i] for i in range(1, len(arg)+1)]
-      
-    # Inner Spiral
-    r = 2* b
-    d = 2*r
-    D = d+2*spacing*N
-    pts = reverse(pts) + (get_spiral_points(a, r, angle = 2*pi*N))
-    
-    # Outer Spiral
-    if not self.spiral_ports:
-      pts2 = get_spiral_points(a, r+spacing, angle = 2*pi*N, start_angle = -pi) 
-    else:
-      pts2 = get_spiral_points(a, r+spacing, angle = 2*pi*N+pi, start_angle = -pi) 
-
-    pts = reverse(pts) + (pts2)
-    
-    path = pya.Path(pts,0.0).unique_points()
+    # r = b + a * theta, the inner spiral, S-section and outer spiral are generated as one int32 buffer
+    pts = spiral_centerline(self.radius, spacing, N, self.spiral_ports, dbu, arc_tolerance(ly.technology_name))
+    draw_poly_wg(pts, layers, t = pya.Trans.R0)
     
-    drawn_length += draw_poly_wg(path.get_points(), layers, t = pya.Trans.R0)
+    # length of the ideal curve, for the compact model
+    drawn_length = spiral_centerline_length(self.radius, spacing, N, self.spiral_ports)
     
-    print("spiral length: %s microns" % drawn_length)     
+    instrument.log("spiral length: %s microns", drawn_length)
     
     # Pins on the waveguide:
     from SiEPIC._globals import PIN_LENGTH as pin_length
     
    
     
-    x = pts[0].x 
+    x = int(pts[0, 0])
     w = to_itype(self.wg_width,dbu)
     t = Trans(Trans.R0, x,0)
     pin = Path([Point(0,-pin_length/2), Point(0,pin_length/2)], w)
@@ -231,7 +130,7 @@ class Spiral(pya.PCellDeclarationHelper):
     shape.text_size = to_itype(0.4,dbu)
 
 
-    x = pts[-1].x 
+    x = int(pts[-1, 0])
     if self.spiral_ports:
       pin = Path([Point(0,-pin_length/2), Point(0,pin_length/2)], w)
     else:
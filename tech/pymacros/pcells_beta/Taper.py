@@ -15,13 +15,14 @@ Version history:
 """
 
 import pya
-from SiEPIC.utils import get_technology_by_name
+from prl_tools.pcell_cache import cached_produce
+from prl_tools.tech import technology, layer_index
     
 class Taper(pya.PCellDeclarationHelper):
 
   def __init__(self):
     super(Taper, self).__init__()
-    TECHNOLOGY = get_technology_by_name('PRL_PDK')
+    TECHNOLOGY = technology('PRL_PDK')
     self.param("waveguide", self.TypeLayer, "Waveguide Layer", default = TECHNOLOGY['X1P'])
     self.param("w_01", self.TypeDouble, "Input Width", default = 1.0)
     self.param("w_02", self.TypeDouble, "Output Width", default = 2.0)
@@ -39,17 +40,18 @@ class Taper(pya.PCellDeclarationHelper):
     pass
     # TODO: use x to access parameter x and set_x to modify it's value 
   
+  @cached_produce
   def produce_impl(self):
     from SiEPIC.extend import to_itype
-    TECHNOLOGY = get_technology_by_name('PRL_PDK')
+    TECHNOLOGY = technology('PRL_PDK')
     dbu = self.layout.dbu
     shapes = self.cell.shapes
     w1 =  to_itype(self.w_01,dbu)
     w2 =  to_itype(self.w_02,dbu)
     
-    Layer = self.layout.layer(self.waveguide)
-    LayerPinRecN = self.layout.layer(self.pinrec)
-    LayerDevRecN = self.layout.layer(self.devrec)
+    Layer = layer_index(self.layout, self.waveguide)
+    LayerPinRecN = layer_index(self.layout, self.pinrec)
+    LayerDevRecN = layer_index(self.layout, self.devrec)
     
     y0 = to_itype(self.w_01/2,dbu)
     x1 = to_itype(self.length,dbu)
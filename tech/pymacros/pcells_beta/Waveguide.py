@@ -15,15 +15,17 @@ Version history:
 """
 
 import pya
+from prl_tools.instrument import timed_produce
+
 class Waveguide(pya.PCellDeclarationHelper):
 
   def __init__(self):
     super(Waveguide, self).__init__()
     
-    from SiEPIC.utils import get_technology, get_technology_by_name, load_Waveguides_by_Tech
+    from prl_tools.tech import waveguide_types
     self.technology_name = 'PRL_PDK'
     
-    self.waveguide_types = load_Waveguides_by_Tech(self.technology_name)   
+    self.waveguide_types = waveguide_types(self.technology_name)   
     
     # declare the parameters
     p = self.param("waveguide_type", self.TypeList, "Waveguide Type", default = self.waveguide_types[0]['name'])
@@ -44,39 +46,52 @@ class Waveguide(pya.PCellDeclarationHelper):
     return self.shape.is_path()
   
   def transformation_from_shape_impl(self):
-    return Trans(Trans.R0,0,0)
+    return pya.Trans(pya.Trans.R0,0,0)
   
   def parameters_from_shape_impl(self):
     self.path = self.shape.path
   
+  @timed_produce
   def produce_impl(self):
     
-    from SiEPIC.utils.layout import layout_waveguide4
+    from SiEPIC.utils.layout import layout_waveguide3, layout_waveguide4
     
-    if self.layout.technology_name == '':
-        lv = pya.Application.instance().main_window().current_view()
-        if lv == None:
-          self.layout.technology_name = self.technology_name
-          self.layout.dbu = 0.005
-        else:
-          ly = lv.active_cellview().layout()
-          self.layout.technology_name = ly.technology_name
-          self.layout.dbu = ly.dbu
-              
-    self.waveguide_length = layout_waveguide4(self.cell, self.path, self.waveguide_type, debug=True)*1e-6;
+    from prl_tools.tech import layout_technology
+    layout_technology(self.layout, self.technology_name)
     
+    from prl_tools.tech import technology, waveguide_type, waveguide_params, layer_index
+    from prl_tools.length import route_length
+    from SiEPIC.extend import to_itype
+    TECHNOLOGY = technology(self.technology_name)
+    spec = waveguide_type(self.waveguide_type, self.technology_name)
     
-    #Modify SPICE parameters
-    from SiEPIC.utils import get_technology_by_name, load_Waveguides_by_Tech
-    component = self.cell.find_components()[0];
-    component.TECHNOLOGY = get_technology_by_name(self.technology_name)
+    if 'compound_waveguide' in spec:
+      # tapers and multimode sections, SiEPIC reads the waveguide types itself
+      drawn_length = layout_waveguide4(self.cell, self.path, self.waveguide_type, debug=True)
+    else:
+      # same as layout_waveguide4 for a primitive type, with the specs of the PRL_PDK WAVEGUIDES
+      # files (SiEPIC only finds them next to a PRL_PDK.lyt file, which does not exist)
+      path = self.path.to_itype(self.layout.dbu)
+      path.unique_points()
+      drawn_length = layout_waveguide3(self.cell, path.get_points(), waveguide_params(self.waveguide_type, self.technology_name))
     
-    waveguide_types = load_Waveguides_by_Tech(self.technology_name)   
-    width = 0
-    for wg_type in self.waveguide_types:
-       width = float(wg_type['width'])*1e-6 if wg_type['name'] == self.waveguide_type else width
+    # Centerline length of the ideal curve; SiEPIC only rounds the 90 degree corners.
+    # Compound waveguides (tapers, multimode sections) and S-bends keep the length measured by SiEPIC
+    sbends = str(spec.get('sbends', '')).lower() in ['true', '1', 't', 'y', 'yes']
+    if 'compound_waveguide' in spec or sbends:
+      self.waveguide_length = drawn_length*1e-6
+    else:
+      dbu = self.layout.dbu
+      path = self.path.to_itype(dbu)
+      path.unique_points()
+      corners = 'bezier' if spec['adiabatic'] else 'arc'
+      self.waveguide_length = route_length(path.get_points(), to_itype(float(spec['radius']), dbu), corners,
+                                           spec['bezier'] or 0.2, right_angles_only = True)*dbu*1e-6
+    
+    #Modify SPICE parameters
+    from prl_tools import spice
+    width = float(spec['width'])*1e-6
     
-    std_param = component.params_dict()
     params = {}
     
     # In SiEPIC version 0.3.92, to measure waveguide length the first SPICE param needs to be the length
@@ -84,59 +99,24 @@ class Waveguide(pya.PCellDeclarationHelper):
     params['width'] = ('%2.4E'%width)
     params['delay compensation'] = 0
     
-    #from . import tii_tools
-    #tii_tools.set_SPICE_params(component, params) 
-    set_SPICE_params(component, params) 
+    spice.set_params(self.cell, layer_index(self.layout, TECHNOLOGY['DevRec']), params)
     
-    print("PRL_PDK.%s: length %s um, complete" % (self.cellName, self.waveguide_length*1e6))
+    from prl_tools import instrument
+    instrument.log("PRL_PDK.%s: length %s um, complete", self.cellName, self.waveguide_length*1e6)
 
 def set_SPICE_params(component, arg, verbose = False):
-      def pdic2str(arg): #A Dictionary of SPICE parameters to a string
-        str_ = ''
-        keys = list(arg.keys())
-        for i in range(0, len(arg)):
-              if keys[i].find(' ',0)==-1:
-                str_ += keys[i] + '=' + str(arg[keys[i]])
-              else:
-                str_ += '"'+ keys[i] +'"'+ '=' + str(arg[keys[i]])
-                
-              if i < len(arg) - 1: str_ +=  ' '
-        return str_
-      
+      """Replace the SPICE parameters of a SiEPIC component (dict, or 'Spice_param:...' string), see prl_tools.spice."""
+      from prl_tools import spice
       if isinstance(arg, str):
-          spice_str = arg.replace('Spice_param:', '', 1)
-      elif isinstance(arg, dict):
-          spice_str = pdic2str(arg)
-      else:
+          arg = spice.parse_params(arg)
+      elif not isinstance(arg, dict):
         return False
-      newSPICE_text =  "Spice_param:" + spice_str;  
       
       cell = component.cell
-      cell_idx = cell.cell_index()
+      if cell._is_const_object():
+          cell = cell.layout().cell(cell.cell_index()) # Need to do this to avoid error (See KLayout issue #235)
       
       ly = cell.layout()
-      LayerDevRecN  = ly.layer(component.TECHNOLOGY['DevRec']) 
-      iter_sh = cell.begin_shapes_rec(LayerDevRecN)
-
-      while not(iter_sh.at_end()): # Find cell where SPICE params are stored
-          if iter_sh.shape().is_text():
-            shape = iter_sh.shape();
-            text = shape.text
-            if text.string.find("Spice_param:") > -1:
-                new_text = pya.Text(newSPICE_text, shape.text_trans,shape.text_size ,-1);
-                new_text.halign = text.halign
-                shape.text = new_text
-                component.params = spice_str
-                return True
-          iter_sh.next()
-          
-      if cell._is_const_object():
-          cell_inst = cell.layout().cell(cell_idx) # Need to do this to avoid error (See KLayout issue #235)
-      else:
-          cell_inst = cell
-
-      t = pya.Trans(pya.Trans.R0,pya.Point(0,0)) # Coordinates are with respect to the cell center
-      new_text  = pya.Text(newSPICE_text, t,0.1/ly.dbu ,-1);
-      cell_inst.shapes(LayerDevRecN).insert(new_text)
-      component.params = spice_str
-      return True
\ No newline at end of file
+      store = spice.set_params(cell, ly.layer(component.TECHNOLOGY['DevRec']), arg)
+      component.params = spice.format_params(store)
+      return True
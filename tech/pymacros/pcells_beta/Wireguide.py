@@ -1,4 +1,6 @@
 import pya
+from prl_tools.pcell_cache import cached_produce
+from prl_tools import instrument
 import SiEPIC
 # PCell template
 # This macro template provides the framework for a PCell library
@@ -39,21 +41,23 @@ class Wireguide(pya.PCellDeclarationHelper):
     return self.shape.is_path()
 
   def transformation_from_shape_impl(self):
-    return Trans(Trans.R0,0,0)
+    return pya.Trans(pya.Trans.R0,0,0)
 
   def parameters_from_shape_impl(self):
     self.path = self.shape.dpath
     return
         
+  @cached_produce
   def produce_impl(self):
-    from SiEPIC.utils import arc_xy, arc_bezier, angle_vector, angle_b_vectors, inner_angle_b_vectors, translate_from_normal, get_technology_by_name
-    from math import cos, sin, pi, sqrt
+    from SiEPIC.utils import angle_vector
+    from prl_tools.tech import technology, layer_index
     import pya
     from SiEPIC.extend import to_itype
+    from prl_tools.geometry import corner_centerline, waveguide_polygons
     
-    print("Wireguide")
+    instrument.log("Wireguide")
     
-    TECHNOLOGY = get_technology_by_name('PRL_PDK')
+    TECHNOLOGY = technology('PRL_PDK')
     
     dbu = self.layout.dbu
     wg_width = to_itype(self.width,dbu)
@@ -63,80 +67,28 @@ class Wireguide(pya.PCellDeclarationHelper):
     if not (len(self.layers)==len(self.widths) and len(self.layers)==len(self.offsets) and len(self.offsets)==len(self.widths)):
       raise Exception("There must be an equal number of layers, widths and offsets")
     path.unique_points()
-    turn=0
+    pts = path.get_points()
     
+    layers = [layer_index(self.layout, TECHNOLOGY[name]) for name in self.layers]
+    widths = [to_itype(w,dbu) for w in self.widths]
+    offsets = [to_itype(o,dbu) for o in self.offsets]
     
-    def chamfer_xy(x, y, length, theta_start, theta_stop):
-        # function to create a symmetric chamfer (45 deg)
-        # length: chamfer length
-        # w: waveguide width
-        # length units in dbu
-        # theta_start, theta_stop: angles for the of the start and end of the chamfer (in degrees)
+    # The centerline (chamfered or curved corners) is computed once and shared by all layers;
+    # only curved DevRec layers get their own, coarser, centerline
+    groups = {}
+    for lr in range(0, len(self.layers)):
+      groups.setdefault(bool(bezier) and 'DevRec' in self.layers[lr], []).append(lr)
     
-        from math import pi, cos, sin
-        pts = []
-        turn = (theta_stop - theta_start)*pi/180.0   
-        angle = (theta_stop - theta_start)*pi/2 / 180.0        
-        
-        pts.append(pya.Point.from_dpoint(pya.DPoint(
-                  -length *(cos(angle)/ 1), 0)))
-        pts.append(pya.Point.from_dpoint(pya.DPoint(
-                  0, length * sin(angle)/ 1)))
-                  
-        return pya.Path(pts,0).transformed(pya.Trans((theta_start/90)/1,False, x,y)).get_points()
+    for devrec, indexes in groups.items():
+      wg_pts = corner_centerline(pts, to_itype(self.radius, dbu), bezier, devrec)
+      wg_polygons = waveguide_polygons(wg_pts, [widths[lr] for lr in indexes], [offsets[lr] for lr in indexes],
+                                       manhattan = False, miter = True)
+      for lr, wg_polygon in zip(indexes, wg_polygons):
+        self.cell.shapes(layers[lr]).insert(wg_polygon) # insert the wireguide
     
-    for lr in range(0, len(self.layers)):
-      layer = self.layout.layer(TECHNOLOGY[self.layers[lr]])
-      width = to_itype(self.widths[lr],dbu)
-      offset = to_itype(self.offsets[lr],dbu)
-
-      pts = path.get_points()
-      wg_pts = [pts[0]]
-      for i in range(1,len(pts)-1):
-        turn = ((angle_b_vectors(pts[i]-pts[i-1],pts[i+1]-pts[i])+90)%360-90)/90
-        dis1 = pts[i].distance(pts[i-1])
-        dis2 = pts[i].distance(pts[i+1])
-        angle = angle_vector(pts[i]-pts[i-1])/90
-        pt_radius = to_itype(self.radius, dbu)
-        
-        # determine the radius, based on how much space is available
-        if len(pts)==3:
-          pt_radius = min (dis1, dis2, pt_radius)
-        else:
-          if i==1:
-            if dis1 <= pt_radius:
-              pt_radius = dis1
-          elif dis1 < 2*pt_radius:
-            pt_radius = dis1/2
-          if i==len(pts)-2:
-            if dis2 <= pt_radius:
-              pt_radius = dis2
-          elif dis2 < 2*pt_radius:
-            pt_radius = dis2/2
-            
-        # wireguide bends:
-        if(not bezier):
-          def angle_origin(p0,p1):
-            return angle_b_vectors(pya.Point(1,0),p1-p0)
-          
-          start_angle = angle_origin(pts[i-1],pts[i])
-          stop_angle  = angle_origin(pts[i],pts[i+1]) 
-          turn_pts = chamfer_xy(pts[i].x, pts[i].y, pt_radius, start_angle, stop_angle)
-          wg_pts += turn_pts
-        else:
-          wg_pts += pya.Path(arc_xy(-pt_radius, pt_radius, pt_radius, 270, 270 + inner_angle_b_vectors(pts[i-1]-pts[i], pts[i+1]-pts[i]),DevRec='DevRec' in self.layers[lr]), 0).transformed(Trans(angle, turn < 0, pts[i])).get_points()
-      
-      wg_pts += [pts[-1]]
-      wg_pts = pya.Path(wg_pts, 0).unique_points().get_points()
-      wg_polygon = pya.Path(wg_pts, width)
-      self.cell.shapes(layer).insert(wg_polygon) # insert the wireguide
-       
-      if layer == self.layout.layer(TECHNOLOGY['P1P']) or  layer == self.layout.layer(TECHNOLOGY['M1P']):
-        waveguide_length = wg_polygon.area() / width * dbu
-
     #Generate Pins
     pts = path.get_points()
-    LayerPinRecN = self.layout.layer(TECHNOLOGY['PinRecM'])
+    LayerPinRecN = layer_index(self.layout, TECHNOLOGY['PinRecM'])
     
     # insert pins to wireguide
     t1 = pya.Trans(angle_vector(pts[0]-pts[1])/90, False, pts[0])
@@ -147,7 +99,7 @@ class Wireguide(pya.PCellDeclarationHelper):
     self.cell.shapes(LayerPinRecN).insert(pya.Path([pya.Point(-50, 0), pya.Point(50, 0)], wg_width).transformed(t))
     self.cell.shapes(LayerPinRecN).insert(pya.Text("pin2", t, 0.3/dbu, -1))
 	
-    LayerDevRecN = self.layout.layer(TECHNOLOGY['DevRec'])
+    LayerDevRecN = layer_index(self.layout, TECHNOLOGY['DevRec'])
     
     # Compact model information
     angle_vec = angle_vector(pts[0]-pts[1])/90
@@ -0,0 +1,34 @@
+"""
+PRL PDK Tools (Compatible with SiEPIC tools)
+Notice: Information in this file is confidential.
+
+Description:
+Helper package shared by the parametric cells in pcells_beta and the PRL_PDK macros.
+Modules are imported on demand so that loading the package stays cheap:
+  - geometry: vectorized offset-curve kernel used to draw waveguide outlines.
+  - spiral: cached turn count / radius solver for the Spiral PCell.
+  - pcell_cache: content-addressed cache of produced PCell geometry (cached_produce decorator).
+  - disk_cache: persistent OASIS cache of produced PCells, second level of pcell_cache.
+  - registry: static PCell manifest and lazy registration of the pcells_beta declarations.
+  - tech: cached technology layer table, waveguide specs and layer indexes (mtime invalidated).
+  - fixed_cells: manifest of the fixed GDS/OASIS cells, read as static cells of the fixed-cell libraries.
+  - batch: headless generation of a layout from a JSON/CSV list of PCell placements (python -m prl_tools.batch).
+  - sweep: parameter sweeps produced by a process pool and merged into one hierarchical layout.
+  - bench: produce benchmarks of the PCells (time, memory, polygons/vertices) with baseline regression gates.
+  - instrument: opt-in produce timers, shape counters, slow-call traces and log messages (PRLPDK_INSTRUMENT=1).
+  - spice: indexed store of the compact-model (Spice_param) parameters of a cell, label written once.
+  - length: analytic centerline length of routes (chamfer, arc, bezier corners), arcs and Archimedean spirals.
+  - export: static OASIS export for fabrication, skipped when the layout file did not change (python -m prl_tools.export).
+  - drc: SiEPIC_EBeam DRC rule set in flat, deep (hierarchical), tiled multi-threaded or incremental mode,
+    one report (python -m prl_tools.drc).
+  - sparams: Touchstone (.sNp) and Lumerical .dat (streamed) S-parameters as complex arrays, cached as
+    memory-mapped binary sidecars (python -m prl_tools.sparams).
+  - circuit: batched S-matrix circuit solver (waveguide, ring, splitter and S-parameter
+    models) and circuits of layout cells.
+  - ring_model: analytical Ring spectra, resonances, FSR, Q and extinction over grids of radii and gaps
+    (python -m prl_tools.ring_model).
+  - montecarlo: MONTECARLO.xml variability, spatially correlated over the placement of the components,
+    chunked and threaded trials with yield statistics (python -m prl_tools.montecarlo).
+
+(C) NYUAD 2023
+"""
@@ -0,0 +1,232 @@
+"""
+PRL PDK Tools - Headless batch generation
+Notice: Information in this file is confidential.
+
+Description:
+Generates a layout from a list of PCell placements without the KLayout GUI (klayout -b, or the
+standalone klayout Python module). The pcells_beta declarations are registered directly in the
+output layout, with the technology and dbu given explicitly.
+
+Job files:
+  JSON: a list of placements, or {"cells": [...]}, each placement being
+    {"pcell": "Ring", "params": {"radius": 20.0, "gap": 0.3}, "x": 0, "y": 100, "rot": 0, "mirror": false}
+  CSV: one placement per row, columns pcell, x, y, rot, mirror; all other columns are PCell
+    parameters (empty cells keep the default). Values are read as JSON when possible.
+Positions are in microns, rotations in degrees. Layer parameters accept "layer/datatype" strings,
+shape parameters a list of [x, y] points or {"points": [...], "width": w}.
+
+Usage:
+  PYTHONPATH=tech/pymacros python -m prl_tools.batch jobs.json -o chip.oas
+  PYTHONPATH=tech/pymacros python -m prl_tools.batch jobs.csv -o chip.gds --dbu 0.001 --static
+  PYTHONPATH=tech/pymacros python -m prl_tools.batch jobs.json -o chip.oas --layer X1P=3/0 --layer M1P=14/0
+Taper, Wireguide and the Ring heater use the X1P, M1P and P1P layers, which PRLPDK_EBeam.lyp does
+not define: their jobs fail unless the layers are given with --layer.
+
+(C) NYUAD 2023
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import pya
+
+from .registry import PCELL_MANIFEST, LazyPCellDeclaration
+from .tech import register_technology, technology
+
+
+# The Waveguide PCell is not part of the library manifest but can be placed in batch mode
+BATCH_MANIFEST = PCELL_MANIFEST + (('Waveguide', 'pcells_beta.Waveguide', 'Waveguide'),)
+
+PLACEMENT_KEYS = ('pcell', 'x', 'y', 'rot', 'mirror')
+
+
+class BatchPCellDeclaration(LazyPCellDeclaration):
+    '''Lazy declaration that keeps the produce errors, which KLayout only prints.'''
+
+    def __init__(self, name, module, class_name):
+        super(BatchPCellDeclaration, self).__init__(name, module, class_name)
+        self.error = None
+
+    def produce(self, layout, layers, parameters, cell):
+        try:
+            return super(BatchPCellDeclaration, self).produce(layout, layers, parameters, cell)
+        except Exception as e:
+            self.error = e
+            raise
+
+
+def _value(text):
+    '''CSV cell to a Python value: JSON if possible, else the text.'''
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def load_jobs(path):
+    '''Read the placements of a JSON or CSV job file.'''
+    if os.path.splitext(path)[1].lower() == '.csv':
+        jobs = []
+        with open(path, newline = '') as f:
+            for row in csv.DictReader(f):
+                job = {'params': {}}
+                for key, text in row.items():
+                    if key is None or text is None or text.strip() == '':
+                        continue
+                    key = key.strip()
+                    if key == 'pcell':
+                        job[key] = text.strip()
+                    elif key in PLACEMENT_KEYS:
+                        job[key] = _value(text)
+                    else:
+                        job['params'][key] = _value(text)
+                jobs.append(job)
+        return jobs
+    with open(path) as f:
+        jobs = json.load(f)
+    return jobs['cells'] if isinstance(jobs, dict) else jobs
+
+
+def _bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+def coerce_params(decl, params):
+    '''Convert job parameter values to the types declared by the PCell.
+
+    Raises:
+        ValueError: on a parameter the PCell does not declare
+    '''
+    declared = {p.name: p for p in decl.get_parameters()}
+    T = pya.PCellParameterDeclaration
+    values = {}
+    for name, value in params.items():
+        p = declared.get(name)
+        if p is None:
+            raise ValueError('unknown parameter %s (expected one of %s)' % (name, ', '.join(declared)))
+        if p.type == T.TypeLayer and not isinstance(value, pya.LayerInfo):
+            value = pya.LayerInfo(*value) if isinstance(value, (list, tuple)) else pya.LayerInfo.from_string(str(value))
+        elif p.type == T.TypeShape and isinstance(value, (list, dict)):
+            pts = value['points'] if isinstance(value, dict) else value
+            width = value.get('width', 0) if isinstance(value, dict) else 0
+            value = pya.DPath([pya.DPoint(x, y) for x, y in pts], width)
+        elif p.type == T.TypeDouble:
+            value = float(value)
+        elif p.type == T.TypeInt:
+            value = int(round(float(value)))
+        elif p.type == T.TypeBoolean:
+            value = _bool(value)
+        elif p.type == T.TypeList and isinstance(value, str) and p.choice_values():
+            # a choice (e.g. waveguide_type), whose names may contain commas
+            if value not in p.choice_values():
+                raise ValueError('%s: %s is not one of: %s' % (name, value, '; '.join(map(str, p.choice_values()))))
+        elif p.type == T.TypeList and isinstance(value, str):
+            value = _value(value) if value.startswith('[') else value.split(',')
+        elif p.type == T.TypeString:
+            value = str(value)
+        values[name] = value
+    return values
+
+
+def new_layout(technology = 'PRL_PDK', dbu = 0.001, manifest = BATCH_MANIFEST, layers = ()):
+    '''Empty layout with the given technology and dbu, and the PCells of manifest registered.
+
+    layers: (name, 'layer/datatype') of layers missing from the technology, see
+    tech.register_technology (only used when the technology is not declared yet).
+    '''
+    register_technology(technology, dbu = dbu, layers = layers)
+    ly = pya.Layout()
+    ly.dbu = dbu
+    ly.technology_name = technology
+    for name, module, class_name in manifest:
+        ly.register_pcell(name, BatchPCellDeclaration(name, module, class_name))
+    return ly
+
+
+def place(ly, top, job):
+    '''Produce one job in ly and place it in top. Returns the PCell variant cell.'''
+    name = job['pcell']
+    decl = ly.pcell_declaration(name)
+    if decl is None:
+        raise ValueError('unknown PCell %s' % name)
+    decl.error = None
+    try:
+        cell = ly.create_cell(name, coerce_params(decl.declaration(), job.get('params', {})))
+        if decl.error is not None:
+            raise decl.error
+    except KeyError as e:
+        # Taper, Wireguide and the Ring heater use layers PRLPDK_EBeam.lyp does not define
+        layer = e.args[0] if e.args else None
+        if isinstance(layer, str) and layer not in technology(ly.technology_name):
+            raise ValueError('layer %s is not defined by technology %s (define it with --layer %s=layer/datatype)' %
+                             (layer, ly.technology_name, layer)) from e
+        raise
+    trans = pya.DCplxTrans(1, float(job.get('rot', 0)), _bool(job.get('mirror', False)),
+                           float(job.get('x', 0)), float(job.get('y', 0)))
+    top.insert(pya.DCellInstArray(cell.cell_index(), trans))
+    return cell
+
+
+def build(jobs, technology = 'PRL_PDK', dbu = 0.001, top_name = 'TOP', layers = ()):
+    '''Layout with one instance per job under a top cell (layers: see new_layout).
+
+    Returns:
+        (pya.Layout, top cell)
+    '''
+    ly = new_layout(technology, dbu, layers = layers)
+    top = ly.create_cell(top_name)
+    for i, job in enumerate(jobs):
+        try:
+            place(ly, top, job)
+        except Exception as e:
+            raise RuntimeError('job %s (%s): %s' % (i, job.get('pcell'), e)) from e
+    return ly, top
+
+
+def parse_layers(definitions):
+    '''(name, 'layer/datatype') pairs of 'NAME=layer/datatype' strings, see register_technology.'''
+    layers = []
+    for definition in definitions or ():
+        layer, sep, source = definition.partition('=')
+        if not sep or not layer.strip() or pya.LayerInfo.from_string(source.strip()).layer < 0:
+            raise ValueError('layer definition %s is not NAME=layer/datatype' % definition)
+        layers.append((layer.strip(), source.strip()))
+    return tuple(layers)
+
+
+def write_layout(ly, path, static = False):
+    '''Write ly, format from the file extension. static=True drops the PCell context (plain geometry).'''
+    opt = pya.SaveLayoutOptions()
+    opt.set_format_from_filename(path)
+    opt.write_context_info = not static
+    ly.write(path, opt)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Generate a PRL_PDK layout from a JSON/CSV list of PCell placements.')
+    parser.add_argument('jobs', help = 'JSON or CSV job file')
+    parser.add_argument('-o', '--output', required = True, help = 'output layout (.gds, .oas)')
+    parser.add_argument('--technology', default = 'PRL_PDK')
+    parser.add_argument('--dbu', type = float, default = 0.001)
+    parser.add_argument('--top', default = 'TOP', help = 'name of the top cell')
+    parser.add_argument('--static', action = 'store_true', help = 'write without PCell context information')
+    parser.add_argument('--layer', action = 'append', metavar = 'NAME=L/D',
+                        help = 'define a layer missing from the technology, e.g. X1P=3/0 for Taper')
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    jobs = load_jobs(args.jobs)
+    ly, top = build(jobs, args.technology, args.dbu, args.top, parse_layers(args.layer))
+    write_layout(ly, args.output, args.static)
+    print('%s cells placed in %s in %.2f s' % (len(jobs), args.output, time.perf_counter() - t0))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,249 @@
+"""
+PRL PDK Tools - PCell produce benchmarks
+Notice: Information in this file is confidential.
+
+Description:
+Benchmark suite for the pcells_beta PCells. Every case (PCell, parameters, dbu) is produced in
+a fresh layout, with the geometry caches disabled, and records:
+  - wall time of the produce (best of the repeats, all repeats are kept),
+  - peak Python memory during the produce (tracemalloc, KLayout's own allocations are not seen),
+  - polygon and vertex count per layer, and their totals.
+Results are written as JSON. Compared with a stored baseline, a case regresses when its vertex or
+polygon count grows, or when it fails while the baseline did not. Time and memory depend on the
+machine: they are only compared (growth by more than the threshold, relative, with a small
+absolute floor against timer noise) when the baseline was recorded on the same host, Python and
+KLayout (--timing on/off overrides this).
+BASELINE (bench_baseline.json, next to this file) was recorded on the tree that added this suite:
+after the first PCell optimizations (offset-curve kernel, closed-form Spiral, geometry caches,
+lazy registration, technology cache, batch), before the ones that followed (arc discretization,
+shared Ring cells, Wireguide centerline, analytic lengths). Its timings come from one machine,
+so elsewhere they only give rough speedup figures. Wireguide_adiab failed on that tree (a NameError
+fixed later), so its entry is an error and the case is not gated.
+
+The Taper, Wireguide and Ring heater PCells use the X1P, M1P and P1P layers, which are not in
+PRLPDK_EBeam.lyp. Run outside KLayout, the suite declares PRL_PDK itself, with a copy of the layer
+properties that adds these layers (BENCH_LAYERS, on layer numbers the PDK does not use).
+
+Usage:
+  PYTHONPATH=tech/pymacros python -m prl_tools.bench -o bench.json
+  PYTHONPATH=tech/pymacros python -m prl_tools.bench -o bench.json --baseline tech/pymacros/prl_tools/bench_baseline.json
+  PYTHONPATH=tech/pymacros python -m prl_tools.bench -o baseline.json
+  PYTHONPATH=tech/pymacros python -m prl_tools.bench -o bench.json --baseline baseline.json --time-threshold 0.2
+  PYTHONPATH=tech/pymacros python -m prl_tools.bench -o baseline.json -k Ring -k Spiral
+The exit status is 1 when a case regressed.
+
+(C) NYUAD 2023
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import pya
+
+
+# (case name, PCell, parameters); each case runs for every dbu of DBUS
+BENCH_CASES = (
+  ('Bend_r5',            'Bend',      {'radius': 5.0}),
+  ('Bend_r20',           'Bend',      {'radius': 20.0}),
+  ('Bend_r100',          'Bend',      {'radius': 100.0}),
+  ('SBend_l20',          'SBend',     {'length': 20.0, 'height': 4.0}),
+  ('SBend_l200',         'SBend',     {'length': 200.0, 'height': 40.0}),
+  ('Taper_l20',          'Taper',     {'length': 20.0}),
+  ('Taper_l200',         'Taper',     {'length': 200.0}),
+  ('MMI_2x2',            'MMI',       {}),
+  ('MMI_4x4',            'MMI',       {'num_inp': 4, 'num_out': 4, 'mmi_width': 12.0, 'mmi_length': 80.0}),
+  ('Ring_r10',           'Ring',      {'radius': 10.0, 'use_drop': False}),
+  ('Ring_r50_drop',      'Ring',      {'radius': 50.0, 'use_drop': True}),
+  ('Ring_r50_heater',    'Ring',      {'radius': 50.0, 'use_drop': True, 'use_heater': True}),
+  ('Ring_r200_drop',     'Ring',      {'radius': 200.0, 'use_drop': True}),
+  ('Spiral_l1000',       'Spiral',    {'length': 1000.0}),
+  ('Spiral_l10000',      'Spiral',    {'length': 10000.0}),
+  ('Spiral_l10000_same', 'Spiral',    {'length': 10000.0, 'spiral_ports': True}),
+  ('Wireguide',          'Wireguide', {}),
+  ('Wireguide_adiab',    'Wireguide', {'adiab': True}),
+)
+
+DBUS = (0.001, 0.0005)
+
+BASELINE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'bench_baseline.json')
+
+# layers used by the PCells but missing from PRLPDK_EBeam.lyp: (name, layer/datatype)
+BENCH_LAYERS = (
+  ('X1P', '3/0'),
+  ('M1P', '14/0'),
+  ('P1P', '15/0'),
+)
+
+
+def case_id(name, dbu):
+    return '%s@%g' % (name, dbu)
+
+
+def bench_technology(technology = 'PRL_PDK', dbu = 0.001, layers = BENCH_LAYERS):
+    '''Declare technology with the PDK layers and the extra layers, unless it already exists.'''
+    from .tech import register_technology
+    return register_technology(technology, dbu = dbu, layers = layers)
+
+
+def count_geometry(ly, cell):
+    '''{layer: {'polygons': n, 'vertices': n}} of the shapes of cell and its children.'''
+    counts = {}
+    for li in ly.layer_indexes():
+        polygons = vertices = 0
+        it = cell.begin_shapes_rec(li)
+        while not it.at_end():
+            shape = it.shape()
+            if shape.is_polygon() or shape.is_path() or shape.is_box():
+                polygons += 1
+                vertices += shape.polygon.num_points()
+            it.next()
+        if polygons:
+            counts[str(ly.get_info(li))] = {'polygons': polygons, 'vertices': vertices}
+    return counts
+
+
+def run_case(pcell, params, dbu, repeat = 5, technology = 'PRL_PDK'):
+    '''Produce one case repeat times, each in a new layout. Returns the result dict.
+
+    A first, untimed run does the imports done inside produce_impl, a second one measures the
+    memory (tracemalloc slows Python code down, so it is off during the timed runs).
+    '''
+    from . import batch
+    job = {'pcell': pcell, 'params': params}
+    times = []
+    peak = 0
+    for i in range(repeat + 2):
+        ly = batch.new_layout(technology, dbu)
+        top = ly.create_cell('TOP')
+        # parameter conversion and module import are not part of the produce
+        batch.coerce_params(ly.pcell_declaration(pcell).declaration(), params)
+        if i == 0:
+            cell = batch.place(ly, top, job)
+        elif i == 1:
+            tracemalloc.start()
+            cell = batch.place(ly, top, job)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            t0 = time.perf_counter()
+            cell = batch.place(ly, top, job)
+            times.append(time.perf_counter() - t0)
+    layers = count_geometry(ly, cell)
+    return {'pcell': pcell, 'params': params, 'dbu': dbu,
+            'time_s': min(times), 'times': times, 'peak_kb': peak/1024.0, 'layers': layers,
+            'polygons': sum(c['polygons'] for c in layers.values()),
+            'vertices': sum(c['vertices'] for c in layers.values())}
+
+
+def run(cases = BENCH_CASES, dbus = DBUS, repeat = 5, select = None, log = print):
+    '''Run the suite. select: list of substrings of the case names to run (all by default).'''
+    from .pcell_cache import geometry_cache
+    from . import pcell_cache
+    enabled, disk = geometry_cache.enabled, pcell_cache.disk_cache
+    geometry_cache.enabled, pcell_cache.disk_cache = False, None
+    bench_technology()
+    results = {}
+    try:
+        for name, pcell, params in cases:
+            if select and not any(s in name for s in select):
+                continue
+            for dbu in dbus:
+                cid = case_id(name, dbu)
+                try:
+                    results[cid] = run_case(pcell, params, dbu, repeat)
+                    if log:
+                        r = results[cid]
+                        log('%-28s %9.2f ms %9.1f kB %7d polygons %9d vertices' %
+                            (cid, r['time_s']*1e3, r['peak_kb'], r['polygons'], r['vertices']))
+                except Exception as e:
+                    results[cid] = {'pcell': pcell, 'params': params, 'dbu': dbu, 'error': str(e)}
+                    if log:
+                        log('%-28s error: %s' % (cid, e))
+    finally:
+        geometry_cache.enabled, pcell_cache.disk_cache = enabled, disk
+    return {'meta': {'klayout': pya.Application.version() if hasattr(pya, 'Application') else getattr(pya, '__version__', ''),
+                     'python': platform.python_version(), 'machine': platform.machine(),
+                     'node': platform.node(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'repeat': repeat},
+            'cases': results}
+
+
+def same_host(results, baseline):
+    '''True if baseline was recorded on the host, Python and KLayout of results.'''
+    keys = ('node', 'machine', 'python', 'klayout')
+    return all(results['meta'].get(k) == baseline.get('meta', {}).get(k) for k in keys)
+
+
+def compare(results, baseline, time_threshold = 0.25, memory_threshold = 0.25, min_time_s = 0.002, min_kb = 64.0,
+            timing = None):
+    '''Regressions of results against baseline.
+
+    timing: compare time and memory too; by default only if same_host(results, baseline).
+    Returns:
+        list of (case, metric, baseline value, new value)
+    '''
+    if timing is None:
+        timing = same_host(results, baseline)
+    regressions = []
+    for cid, new in results['cases'].items():
+        old = baseline['cases'].get(cid)
+        if old is None or 'error' in old:
+            continue
+        if 'error' in new:
+            regressions.append((cid, 'error', None, new['error']))
+            continue
+        if timing and new['time_s'] > old['time_s']*(1 + time_threshold) + min_time_s:
+            regressions.append((cid, 'time_s', old['time_s'], new['time_s']))
+        if timing and new['peak_kb'] > old['peak_kb']*(1 + memory_threshold) + min_kb:
+            regressions.append((cid, 'peak_kb', old['peak_kb'], new['peak_kb']))
+        for metric in ('polygons', 'vertices'):
+            if new[metric] > old[metric]:
+                regressions.append((cid, metric, old[metric], new[metric]))
+    return regressions
+
+
+def speedups(results, baseline):
+    '''{case: baseline time / new time} of the cases present in both.'''
+    return {cid: baseline['cases'][cid]['time_s']/new['time_s'] for cid, new in results['cases'].items()
+            if 'time_s' in new and 'time_s' in baseline['cases'].get(cid, {}) and new['time_s'] > 0}
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark the produce of the PRL_PDK PCells.')
+    parser.add_argument('-o', '--output', help = 'JSON result file')
+    parser.add_argument('--baseline', help = 'JSON result file to compare with')
+    parser.add_argument('-k', dest = 'select', action = 'append', help = 'only run cases whose name contains this text')
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('--dbu', type = float, action = 'append', help = 'dbu values (default: %s)' % (DBUS,))
+    parser.add_argument('--time-threshold', type = float, default = 0.25)
+    parser.add_argument('--memory-threshold', type = float, default = 0.25)
+    parser.add_argument('--timing', choices = ('auto', 'on', 'off'), default = 'auto',
+                        help = 'gate on time and memory (auto: only against a baseline of this host)')
+    args = parser.parse_args(argv)
+
+    results = run(dbus = args.dbu or DBUS, repeat = args.repeat, select = args.select)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 1, sort_keys = True)
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    ratios = speedups(results, baseline)
+    if ratios:
+        print('speedup vs baseline: min %.2fx, max %.2fx' % (min(ratios.values()), max(ratios.values())))
+    timing = {'auto': None, 'on': True, 'off': False}[args.timing]
+    if timing is None and not same_host(results, baseline):
+        print('baseline recorded on another host: time and memory are not gated')
+    regressions = compare(results, baseline, args.time_threshold, args.memory_threshold, timing = timing)
+    for cid, metric, old, new in regressions:
+        print('REGRESSION %-28s %-9s %s -> %s' % (cid, metric, old, new))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,385 @@
+"""
+PRL PDK Tools - Circuit solver
+Notice: Information in this file is confidential.
+
+Description:
+Frequency-domain S-matrix solver of photonic circuits, evaluated for all the wavelengths at once
+with batched NumPy linear algebra (no loop over the wavelengths):
+  - component models: waveguide, coupler, ring (all-pass / add-drop), y_branch, mmi, and
+    from_sparams (S-parameter files of the released devices, see sparams),
+  - Circuit: instances, connections and external ports; a circuit is itself a component,
+  - netlist(cell): circuit of the PCell instances of a layout cell, with the compact-model
+    parameters of their Spice_param labels (see spice) and their pins.
+Wavelengths and lengths are in m, losses in dB/cm, dispersion in ps/(nm km).
+
+Usage:
+  from prl_tools import circuit
+  c = circuit.Circuit()
+  c.add('split', circuit.y_branch()); c.add('join', circuit.y_branch())
+  c.add('arm1', circuit.waveguide(100e-6)); c.add('arm2', circuit.waveguide(110e-6))
+  c.connect('split', 'opt2', 'arm1', 'pin1'); c.connect('arm1', 'pin2', 'join', 'opt2')
+  c.connect('split', 'opt3', 'arm2', 'pin1'); c.connect('arm2', 'pin2', 'join', 'opt3')
+  c.port('in', 'split', 'opt1'); c.port('out', 'join', 'opt1')
+  s = c.smatrix(np.linspace(1.5e-6, 1.6e-6, 5000))   # shape (5000, 2, 2)
+
+(C) NYUAD 2023
+"""
+
+import re
+from collections import OrderedDict
+
+import numpy as np
+
+
+C0 = 299792458.0   # m/s
+WL0 = 1.55e-6   # m, reference wavelength of the compact models
+
+# compact model of the PDK waveguides (default values of the Ring PCell)
+WAVEGUIDE = {'ne': 2.253075, 'ng': 2.635705, 'loss': 11.262, 'dispersion': 0.0}
+
+RING_KAPPA = 0.2   # field cross-coupling of the ring couplers when it is not given
+
+
+def effective_index(wavelength, ne, ng, dispersion = 0.0, wl0 = WL0):
+    '''Effective index at the wavelengths, from its value, the group index and the dispersion at wl0.
+
+    n(wl) = ne + (ne - ng)/wl0*dwl - c*D/(2*wl0)*dwl**2, so that ng(wl) = ng + c*D*dwl.
+    '''
+    dwl = np.asarray(wavelength) - wl0
+    d = dispersion * 1e-6   # ps/(nm km) -> s/m^2
+    return ne + (ne - ng) / wl0 * dwl - C0 * d / (2 * wl0) * dwl ** 2
+
+
+class Component(object):
+    '''Model of a circuit element: pin names and S-matrix function of the wavelength.'''
+
+    def __init__(self, pins, smatrix, name = None):
+        self.pins = list(pins)
+        self._smatrix = smatrix
+        self.name = name
+
+    def smatrix(self, wavelength):
+        '''S-matrix at the wavelengths (m), shape (W, N, N); s[w, i, j] is the transmission from pin j to pin i.'''
+        return self._smatrix(np.atleast_1d(np.asarray(wavelength, dtype = float)))
+
+    def __repr__(self):
+        return '<%s %s: %s>' % (type(self).__name__, self.name or '', ', '.join(self.pins))
+
+
+def _reciprocal(n, wavelength, elements):
+    '''(W, n, n) S-matrix with s[i, j] = s[j, i] = t for every (i, j, t) of elements.'''
+    s = np.zeros((len(wavelength), n, n), dtype = complex)
+    for i, j, t in elements:
+        s[:, i, j] = s[:, j, i] = t
+    return s
+
+
+def waveguide(length, ne = WAVEGUIDE['ne'], ng = WAVEGUIDE['ng'], loss = WAVEGUIDE['loss'],
+              dispersion = WAVEGUIDE['dispersion'], wl0 = WL0, pins = ('pin1', 'pin2')):
+    '''Straight (or bent) waveguide of a given length (m), kept in its length attribute.'''
+    def smatrix(wl):
+        n = effective_index(wl, ne, ng, dispersion, wl0)
+        t = 10 ** (-loss * length * 100 / 20) * np.exp(-2j * np.pi * n * length / wl)
+        return _reciprocal(2, wl, [(0, 1, t)])
+    component = Component(pins, smatrix, 'waveguide %.6g um' % (length * 1e6))
+    component.length = length
+    return component
+
+
+def coupler(kappa, pins = ('in1', 'in2', 'out1', 'out2')):
+    '''Lossless directional coupler, field cross-coupling kappa (in1 -> out2).'''
+    t = np.sqrt(1 - kappa ** 2)
+    def smatrix(wl):
+        return _reciprocal(4, wl, [(2, 0, t), (3, 1, t), (3, 0, -1j * kappa), (2, 1, -1j * kappa)])
+    return Component(pins, smatrix, 'coupler %.3g' % kappa)
+
+
+def y_branch(pins = ('opt1', 'opt2', 'opt3')):
+    '''Ideal 1x2 splitter.'''
+    def smatrix(wl):
+        t = np.full(len(wl), 2 ** -0.5)
+        return _reciprocal(3, wl, [(1, 0, t), (2, 0, t)])
+    return Component(pins, smatrix, 'y_branch')
+
+
+def mmi(num_inp, num_out):
+    '''Ideal 1xN or 2x2 MMI, pins opt1..opt<num_inp> (inputs) then the outputs, as in the MMI PCell.'''
+    pins = ['opt%d' % (i + 1) for i in range(num_inp + num_out)]
+    if num_inp == 1:
+        elements = [(1 + j, 0, 1 / np.sqrt(num_out)) for j in range(num_out)]
+    elif num_inp == 2 and num_out == 2:
+        elements = [(2, 0, 2 ** -0.5), (3, 1, 2 ** -0.5), (3, 0, -1j * 2 ** -0.5), (2, 1, -1j * 2 ** -0.5)]
+    else:
+        raise ValueError('no ideal model of a %dx%d MMI' % (num_inp, num_out))
+    def smatrix(wl):
+        return _reciprocal(len(pins), wl, [(i, j, np.full(len(wl), t)) for i, j, t in elements])
+    return Component(pins, smatrix, 'mmi %dx%d' % (num_inp, num_out))
+
+
+def ring(length, kappa = RING_KAPPA, kappa_drop = None, drop = True, ne = WAVEGUIDE['ne'], ng = WAVEGUIDE['ng'],
+         loss = WAVEGUIDE['loss'], dispersion = WAVEGUIDE['dispersion'], wl0 = WL0):
+    '''Ring resonator of circumference length (m), pins as in the Ring PCell.
+
+    opt1 -> opt2 is the through bus; with drop, opt3 is the drop port and opt4 the add port.
+    kappa, kappa_drop: field cross-coupling of the through and drop couplers (kappa_drop defaults to kappa).
+    '''
+    c = Circuit('ring')
+    c.add('through', coupler(kappa))
+    c.port('opt1', 'through', 'in1')
+    c.port('opt2', 'through', 'out1')
+    model = dict(ne = ne, ng = ng, loss = loss, dispersion = dispersion, wl0 = wl0)
+    if not drop:
+        c.add('arc', waveguide(length, **model))
+        c.connect('through', 'out2', 'arc', 'pin1')
+        c.connect('arc', 'pin2', 'through', 'in2')
+        return c
+    c.add('drop', coupler(kappa if kappa_drop is None else kappa_drop))
+    c.add('arc1', waveguide(length / 2, **model))
+    c.add('arc2', waveguide(length / 2, **model))
+    c.connect('through', 'out2', 'arc1', 'pin1')
+    c.connect('arc1', 'pin2', 'drop', 'in2')
+    c.connect('drop', 'out2', 'arc2', 'pin1')
+    c.connect('arc2', 'pin2', 'through', 'in2')
+    c.port('opt3', 'drop', 'out1')
+    c.port('opt4', 'drop', 'in1')
+    return c
+
+
+def from_sparams(sp, pins = None):
+    '''Component of S-parameter data (a sparams.SParameters or a file), interpolated on the wavelengths.
+
+    The pins are the port names, with the mode ('port 1 TE1') when a port has several modes.
+    Outside the frequency range of the data the first or last value is used.
+    '''
+    from . import sparams
+    if isinstance(sp, str):
+        sp = sparams.load(sp)
+    names = [p['name'] for p in sp.ports]
+    if pins is None:
+        pins = [p['name'] if names.count(p['name']) == 1 else '%s %s' % (p['name'], p.get('mode', ''))
+                for p in sp.ports]
+    freq = np.asarray(sp.freq)
+    order = np.argsort(freq)
+    freq = freq[order]
+    data = np.asarray(sp.s)[order].reshape(len(freq), -1)
+    n = sp.num_ports
+    def smatrix(wl):
+        f = C0 / wl
+        s = np.empty((len(wl), n * n), dtype = complex)
+        for k in range(n * n):
+            s[:, k] = np.interp(f, freq, data[:, k].real) + 1j * np.interp(f, freq, data[:, k].imag)
+        return s.reshape(len(wl), n, n)
+    return Component(pins, smatrix, sp.source)
+
+
+def _connect_pins(s, k, l):
+    '''S-matrix (W, n-2, n-2) of a network (W, n, n) whose pins k and l are connected to each other.'''
+    skk, sll, skl, slk = s[:, k, k], s[:, l, l], s[:, k, l], s[:, l, k]
+    keep = [m for m in range(s.shape[1]) if m not in (k, l)]
+    det = (1 - skl) * (1 - slk) - skk * sll
+    ik, il = s[:, keep, k], s[:, keep, l]   # from pins k, l to the others, (W, n-2)
+    # rank-2 update: waves leaving to k (l) come back through l (k), including the round trips
+    left = np.stack(((il * (1 - slk)[:, None] + ik * sll[:, None]) / det[:, None],
+                     (ik * (1 - skl)[:, None] + il * skk[:, None]) / det[:, None]), axis = 2)
+    right = s[:, [k, l]][:, :, keep]   # from the others to pins k, l, (W, 2, n-2)
+    return s[:, keep][:, :, keep] + np.matmul(left, right)
+
+
+class Circuit(Component):
+    '''Instances of components, connected pin to pin; the external ports are the pins of the circuit.
+
+    Pins that are neither connected nor external are terminated (no reflection).
+    '''
+
+    def __init__(self, name = None):
+        self.name = name
+        self.instances = OrderedDict()   # name -> component
+        self.connections = []   # ((instance, pin), (instance, pin))
+        self.ports = OrderedDict()   # external name -> (instance, pin)
+        self._used = set()
+
+    @property
+    def pins(self):
+        return list(self.ports)
+
+    def add(self, name, component):
+        if name in self.instances:
+            raise ValueError('instance %s already in the circuit' % name)
+        self.instances[name] = component
+        return component
+
+    def _use(self, instance, pin):
+        if instance not in self.instances:
+            raise KeyError('no instance %s in the circuit' % instance)
+        if pin not in self.instances[instance].pins:
+            raise KeyError('%s has no pin %s (pins: %s)' % (instance, pin, ', '.join(self.instances[instance].pins)))
+        if (instance, pin) in self._used:
+            raise ValueError('pin %s of %s is already used' % (pin, instance))
+        self._used.add((instance, pin))
+
+    def connect(self, instance1, pin1, instance2, pin2):
+        self._use(instance1, pin1)
+        self._use(instance2, pin2)
+        self.connections.append(((instance1, pin1), (instance2, pin2)))
+
+    def port(self, name, instance, pin):
+        '''Make the pin of an instance an external port of the circuit.'''
+        if name in self.ports:
+            raise ValueError('port %s already in the circuit' % name)
+        self._use(instance, pin)
+        self.ports[name] = (instance, pin)
+
+    def _smatrix(self, wl):
+        # one network per instance, restricted to its used pins (the others are terminated), each
+        # distinct component evaluated once; the connections are then made one at a time, which
+        # only costs W*n^2 for a network of n pins
+        evaluated = {}
+        owner = {}   # (instance, pin) -> network [s, pins]
+        for name, component in self.instances.items():
+            block = evaluated.get(id(component))
+            if block is None:
+                block = evaluated[id(component)] = component.smatrix(wl)
+            keep = [k for k, pin in enumerate(component.pins) if (name, pin) in self._used]
+            network = [block[:, keep][:, :, keep], [(name, component.pins[k]) for k in keep]]
+            for pin in network[1]:
+                owner[pin] = network
+        pending = list(self.connections)
+        while pending:
+            # next: the connection giving the smallest network, so the matrices stay small
+            sizes = [len(owner[p][1]) + (len(owner[q][1]) if owner[p] is not owner[q] else 0) for p, q in pending]
+            p, q = pending.pop(int(np.argmin(sizes)))
+            a, b = owner[p], owner[q]
+            if a is not b:
+                n = len(a[1]) + len(b[1])
+                s = np.zeros((len(wl), n, n), dtype = complex)
+                s[:, :len(a[1]), :len(a[1])] = a[0]
+                s[:, len(a[1]):, len(a[1]):] = b[0]
+                a[0], a[1] = s, a[1] + b[1]
+                for pin in b[1]:
+                    owner[pin] = a
+            k, l = a[1].index(p), a[1].index(q)
+            a[0] = _connect_pins(a[0], k, l)
+            a[1] = [pin for m, pin in enumerate(a[1]) if m not in (k, l)]
+
+        # external ports: the networks left are independent
+        s = np.zeros((len(wl), len(self.ports), len(self.ports)), dtype = complex)
+        for i, p in enumerate(self.ports.values()):
+            for j, q in enumerate(self.ports.values()):
+                if owner[p] is owner[q]:
+                    s[:, i, j] = owner[p][0][:, owner[p][1].index(p), owner[q][1].index(q)]
+        return s
+
+    def smatrix(self, wavelength):
+        return self._smatrix(np.atleast_1d(np.asarray(wavelength, dtype = float)))
+
+
+_SI = {'f': 1e-15, 'p': 1e-12, 'n': 1e-9, 'u': 1e-6, 'm': 1e-3, 'k': 1e3, 'meg': 1e6, 'g': 1e9}
+
+
+def spice_value(text):
+    '''Float of a SPICE parameter value ('5.300u', '2.6E-04'), or None if it is not a number.'''
+    m = re.match(r'^\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*([a-zA-Z]*)\s*$', str(text))
+    if not m:
+        return None
+    scale = _SI.get(m.group(2).lower(), 1.0) if m.group(2) else 1.0
+    return float(m.group(1)) * scale
+
+
+def _bend_model(spice, pcell):
+    from .length import arc_length
+    # the Bend label writes the angle with a 'u' suffix: prefer the PCell parameters
+    radius = pcell.get('radius', spice.get('radius', 0) * 1e6)
+    angle = pcell.get('angle', spice.get('theta', 0) * 1e6)
+    return waveguide(arc_length(radius, angle) * 1e-6)
+
+
+def _sbend_model(spice, pcell):
+    import pya
+    from SiEPIC.utils.geometry import bezier_parallel
+    pts = np.array([[p.x, p.y] for p in bezier_parallel(pya.DPoint(0, 0), pya.DPoint(pcell['length'], pcell['height']), 0)])
+    return waveguide(np.hypot(*np.diff(pts, axis = 0).T).sum() * 1e-6)
+
+
+def _ring_model(spice, pcell):
+    from .length import arc_length
+    from .ring_model import coupling
+    # the label is 'Spice_param: NA' without use_GCM: fall back to the PCell parameters
+    length = spice.get('length', arc_length(pcell.get('radius', 0), 360) * 1e-6)
+    # the label has no coupling: from the gaps of the PCell (ring_model.coupling) when known
+    kappa = [RING_KAPPA if pcell.get(key) is None else float(coupling(pcell[key] * 1e-6, length / (2 * np.pi)))
+             for key in ('gap', 'gap_drop')]
+    return ring(length, kappa = kappa[0], kappa_drop = kappa[1], drop = pcell.get('use_drop', True),
+                ne = spice.get('effective index', pcell.get('ne', WAVEGUIDE['ne'])),
+                ng = spice.get('group index', pcell.get('ng', WAVEGUIDE['ng'])),
+                loss = spice.get('loss', pcell.get('loss', WAVEGUIDE['loss'])),
+                dispersion = spice.get('dispersion', pcell.get('dn', WAVEGUIDE['dispersion'])))
+
+
+# PCell name -> factory(spice parameters (SI floats), PCell parameters) -> Component
+MODELS = {
+    'Waveguide': lambda spice, pcell: waveguide(spice['wg_length']),
+    'Spiral': lambda spice, pcell: waveguide(spice['wg_length']),
+    'Bend': _bend_model,
+    'SBend': _sbend_model,
+    'Taper': lambda spice, pcell: waveguide(pcell['length'] * 1e-6, pins = ('opt1', 'opt2')),
+    'Ring': _ring_model,
+    'MMI': lambda spice, pcell: mmi(pcell['num_inp'], pcell['num_out']),
+}
+
+
+def _pins(cell, layer, trans):
+    '''{pin name: position in the parent} of the pin texts of cell ('0opt1' -> 'opt1').'''
+    import pya
+    pins = {}
+    it = cell.begin_shapes_rec(layer)
+    it.shape_flags = pya.Shapes.STexts
+    while not it.at_end():
+        text = it.shape().text
+        pos = (trans * it.trans() * text.trans).disp
+        pins[re.sub(r'^\d+', '', text.string)] = (int(round(pos.x)), int(round(pos.y)))
+        it.next()
+    return pins
+
+
+def netlist(cell, models = None, technology_name = 'PRL_PDK'):
+    '''Circuit of the instances of a layout cell that have a model (see MODELS).
+
+    Instances are named <PCell name>_<n>; pins at the same position are connected, the other
+    pins are the external ports <instance>.<pin>. The instances without a model are listed in
+    the skipped attribute of the circuit.
+    '''
+    from . import spice
+    from .tech import technology, layer_index
+    models = MODELS if models is None else models
+    tech = technology(technology_name)
+    ly = cell.layout()
+    pinrec = layer_index(ly, tech['PinRec'])
+    devrec = layer_index(ly, tech['DevRec'])
+
+    c = Circuit(cell.name)
+    c.skipped = []
+    counts = {}
+    positions = OrderedDict()   # position -> [(instance, pin)]
+    for inst in cell.each_inst():
+        child = ly.cell(inst.cell_index)
+        kind = child.basic_name()
+        for trans in inst.cell_inst.each_cplx_trans():
+            counts[kind] = counts.get(kind, 0) + 1
+            name = '%s_%d' % (kind, counts[kind])
+            if kind not in models:
+                c.skipped.append(name)
+                continue
+            values = {key: spice_value(value) for key, value in spice.params(child, devrec).items()}
+            pcell = child.pcell_parameters_by_name() if child.is_pcell_variant() else {}
+            component = c.add(name, models[kind]({k: v for k, v in values.items() if v is not None}, pcell))
+            for pin, pos in _pins(child, pinrec, trans).items():
+                if pin in component.pins:
+                    positions.setdefault(pos, []).append((name, pin))
+    for pos, pins in positions.items():
+        if len(pins) == 2:
+            c.connect(pins[0][0], pins[0][1], pins[1][0], pins[1][1])
+        elif len(pins) == 1:
+            c.port('%s.%s' % pins[0], pins[0][0], pins[0][1])
+        else:
+            raise ValueError('%d pins at %s: %s' % (len(pins), pos, pins))
+    return c
@@ -0,0 +1,204 @@
+"""
+PRL PDK Tools - Persistent PCell cache
+Notice: Information in this file is confidential.
+
+Description:
+On-disk cache of produced PCell geometry, used behind the in-memory cache of pcell_cache.
+Each produced cell is stored as a small OASIS file named
+  <PCell class>-<source hash>-<parameter hash>-<FORMAT>.oas
+(the source hash covers the PCell module and the prl_tools geometry modules, see
+pcell_cache.GEOMETRY_MODULES) so entries written by older sources never match again, and
+purge_stale() removes them once a source changes. The directory is kept
+under a size cap by evicting the least recently used files.
+OASIS does not store the size, alignment, font and orientation of texts (pin and Spice_param
+labels) and cuts the holes of polygons open, so these are kept in shape properties and
+restored on load: a restored cell is identical to a produced one.
+The cache is off unless enabled, see pcell_cache.configure_disk_cache.
+
+Default location: $PRLPDK_PCELL_CACHE_DIR, or ~/.klayout/prl_pdk/pcell_cache
+
+(C) NYUAD 2023
+"""
+
+import os
+import tempfile
+
+import pya
+
+from .pcell_cache import copy_cell
+
+
+def default_cache_dir():
+    return os.environ.get('PRLPDK_PCELL_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.klayout', 'prl_pdk', 'pcell_cache'))
+
+
+FORMAT = 2   # entries of other formats are purged (1: texts and holes as written by OASIS)
+TEXT_PROPERTY = 'prl_text'   # 'size halign valign font rotation mirror' of a text
+POLYGON_PROPERTY = 'prl_polygon'   # a polygon with holes, which OASIS writes with cut lines
+
+
+def store_attributes(ly):
+    '''Keep what OASIS does not write in properties of the shapes of ly.'''
+    for cell in ly.each_cell():
+        for li in ly.layer_indexes():
+            shapes = cell.shapes(li)
+            for shape in list(shapes.each(pya.Shapes.STexts)):
+                trans = shape.text_trans
+                shape.set_property(TEXT_PROPERTY, '%d %d %d %d %d %d' % (shape.text_size, shape.text_halign,
+                                   shape.text_valign, shape.text_font, trans.rot, trans.is_mirror()))
+            for shape in list(shapes.each(pya.Shapes.SPolygons)):
+                if shape.holes():
+                    shape.set_property(POLYGON_PROPERTY, str(shape.polygon))
+
+
+def restore_attributes(ly):
+    '''Apply the attributes stored by store_attributes and remove the properties.'''
+    for cell in ly.each_cell():
+        for li in ly.layer_indexes():
+            shapes = cell.shapes(li)
+            for shape in list(shapes.each(pya.Shapes.STexts)):
+                value = shape.property(TEXT_PROPERTY)
+                if value is None:
+                    continue
+                size, halign, valign, font, rot, mirror = (int(v) for v in str(value).split())
+                shape.text_trans = pya.Trans(rot, bool(mirror), shape.text_trans.disp)
+                shape.text_size = size
+                shape.text_halign = halign
+                shape.text_valign = valign
+                shape.text_font = font
+                shape.delete_property(TEXT_PROPERTY)
+            for shape in list(shapes.each(pya.Shapes.SPolygons)):
+                value = shape.property(POLYGON_PROPERTY)
+                if value is not None:
+                    shape.polygon = pya.Polygon.from_s(str(value))
+                    shape.delete_property(POLYGON_PROPERTY)
+
+
+class DiskCache(object):
+    '''Directory of OASIS blobs, one per produced PCell variant.'''
+
+    suffix = '.oas'
+
+    def __init__(self, path = None, max_bytes = 512*1024*1024, compression_level = 2):
+        self.path = path or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.compression_level = compression_level
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        os.makedirs(self.path, exist_ok = True)
+        self._total_bytes = sum(size for name, size, atime in self._entries())
+
+    def _file(self, tag, key):
+        return os.path.join(self.path, '%s-%s-%d%s' % (tag, key, FORMAT, self.suffix))
+
+    def _entries(self):
+        '''(file name, size, last access) of every cache file.'''
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.is_file() and entry.name.endswith(self.suffix):
+                st = entry.stat()
+                entries.append((entry.name, st.st_size, st.st_mtime))
+        return entries
+
+    def load(self, tag, key, cell):
+        '''Copy the cached geometry into cell. Returns False on a miss.'''
+        fname = self._file(tag, key)
+        if not os.path.isfile(fname):
+            self.misses += 1
+            return False
+        ly = pya.Layout()
+        try:
+            ly.read(fname)
+        except RuntimeError:
+            # partially written or corrupted entry
+            self._remove(os.path.basename(fname))
+            self.misses += 1
+            return False
+        top = ly.top_cell()
+        if top is None:
+            self.misses += 1
+            return False
+        restore_attributes(ly)
+        copy_cell(top, cell)
+        try:
+            os.utime(fname)   # the modification time tracks the last use, for eviction
+        except OSError:
+            pass
+        self.hits += 1
+        return True
+
+    def save(self, tag, key, cell):
+        '''Write the geometry of cell as an OASIS blob.'''
+        fname = self._file(tag, key)
+        if os.path.isfile(fname):
+            return
+        ly = pya.Layout()
+        ly.dbu = cell.layout().dbu
+        copy_cell(cell, ly.create_cell(cell.name))
+        store_attributes(ly)
+        opt = pya.SaveLayoutOptions()
+        opt.format = 'OASIS'
+        opt.write_context_info = False
+        opt.oasis_compression_level = self.compression_level
+        fd, tmp = tempfile.mkstemp(suffix = self.suffix, dir = self.path)
+        os.close(fd)
+        try:
+            ly.write(tmp, opt)
+            os.replace(tmp, fname)   # atomic, other KLayout processes may share the directory
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.writes += 1
+        self._total_bytes += os.path.getsize(fname)
+        if self._total_bytes > self.max_bytes:
+            self.evict()
+
+    def _remove(self, name):
+        try:
+            size = os.path.getsize(os.path.join(self.path, name))
+            os.remove(os.path.join(self.path, name))
+            self._total_bytes -= size
+        except OSError:
+            pass
+
+    def evict(self, target_bytes = None):
+        '''Remove least recently used entries until the cache is below target_bytes (default: 80% of max_bytes).'''
+        if target_bytes is None:
+            target_bytes = int(self.max_bytes*0.8)
+        entries = sorted(self._entries(), key = lambda e: e[2])
+        total = sum(e[1] for e in entries)
+        for name, size, atime in entries:
+            if total <= target_bytes:
+                break
+            self._remove(name)
+            total -= size
+            self.evictions += 1
+        self._total_bytes = total
+
+    def purge_stale(self, current_tags):
+        '''Remove the entries of PCell classes whose source hash is not the current one,
+        and the entries of other formats.
+
+        Args:
+            current_tags: dict PCell class name -> current tag ('<class>-<source hash>')
+        '''
+        removed = 0
+        for name, size, atime in self._entries():
+            cls = name.split('-', 1)[0]
+            stale = cls in current_tags and not name.startswith(current_tags[cls] + '-')
+            if stale or not name.endswith('-%d%s' % (FORMAT, self.suffix)):
+                self._remove(name)
+                removed += 1
+        return removed
+
+    def clear(self):
+        for name, size, atime in self._entries():
+            self._remove(name)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'writes': self.writes, 'evictions': self.evictions,
+                'bytes': self._total_bytes, 'max_bytes': self.max_bytes, 'path': self.path}
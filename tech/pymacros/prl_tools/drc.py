@@ -0,0 +1,723 @@
+"""
+PRL PDK Tools - DRC driver
+Notice: Information in this file is confidential.
+
+Description:
+Runs the rule set of tech/drc/SiEPIC_EBeam_DRC.lydrc with the KLayout region engine, without
+the DRC script interpreter, so it also runs with the standalone klayout Python module:
+  - flat: whole layout, one thread (what the deck does),
+  - deep: hierarchical processing (DeepShapeStore), with a configurable number of threads,
+  - tiled: the layout is cut in tiles (bordered by the rule distance) that are checked by a
+    pool of threads (TilingProcessor).
+The three modes flag the same geometry (deep markers found in several cells are reported once;
+compare_modes checks it). A tile sees the layout exactly up to its border only, so in tiled mode
+the markers are cut at the tile box (clip_marker) and those crossing a tile border are split
+there; the whole-polygon selections (Boundary, SiEPIC-1a) are run hierarchically.
+The markers of all rules are merged in one report database (.lyrdb, one category per rule, named
+as in the deck) and the runtime of every rule is reported.
+Incremental mode (run_incremental) caches the markers per rule and per tile with a snapshot of
+the deck layers; the next run compares the layout with the snapshot (pya.LayoutDiff, cell by cell)
+and only re-checks the tiles within the largest rule distance of a changed cell (in all its
+instances), merging them with the cached markers.
+RULES mirrors the deck: keep both in sync when a rule changes.
+
+Usage:
+  PYTHONPATH=tech/pymacros python -m prl_tools.drc chip.gds -o chip.lyrdb --mode tiled --threads 8
+  PYTHONPATH=tech/pymacros python -m prl_tools.drc chip.oas --mode deep --threads 4 -k M2
+  PYTHONPATH=tech/pymacros python -m prl_tools.drc chip.gds --incremental   (re-run after each edit)
+  PYTHONPATH=tech/pymacros python -m prl_tools.drc chip.gds --compare       (flat vs deep markers)
+
+(C) NYUAD 2023
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+
+import pya
+
+
+# Deck layers: name -> (layer, datatype); datatype None means all datatypes
+LAYERS = OrderedDict([
+  ('Si', (1, 0)), ('Sip6nm', (31, 0)), ('Si_rib', (2, 0)), ('DevRec', (68, 0)), ('PinRec', (1, 10)),
+  ('FP', (99, None)), ('M1', (11, 0)), ('M2', (12, 0)), ('MLOpen', (13, 0)), ('VC', (40, 0)),
+  ('N', (20, 0)), ('Npp', (24, 0)),
+])
+
+TOLERANCE = 1e-3   # um, subtracted from the rule values as in the deck
+
+# (category, description, check, layer, other layer, value in um, angle limit in degrees)
+RULES = (
+  ('Devices', 'Devices cannot be overlapping', 'overlapping', 'DevRec', None, None, None),
+  ('Boundary', 'devices are out of boundary', 'outside', 'Si', 'FP', None, None),
+  ('Si_width', 'Si minimum feature size violation; min 60 nm', 'width', 'Si', None, 0.06, 80),
+  ('Sip6nm_width', 'Si minimum feature size violation; min 60 nm', 'width', 'Sip6nm', None, 0.06, 80),
+  ('Si_space', 'Si minimum space violation; min 60 nm', 'space', 'Si', None, 0.06, 80),
+  ('Sip6nm_space', 'Si minimum space violation; min 60 nm', 'space', 'Sip6nm', None, 0.06, 80),
+  ('Si_rib_width', 'Si_rib minimum feature size violation; min 100 nm', 'width', 'Si_rib', None, 0.1, 80),
+  ('M1_width', 'M1 minimum feature size violation; min 3 µm', 'width', 'M1', None, 3.0, 70),
+  ('M1_space', 'M1 minimum space violation; min 3 µm', 'space', 'M1', None, 3.0, None),
+  ('M2_width', 'M2 minimum feature size violation; min 5 µm', 'width', 'M2', None, 5.0, 70),
+  ('M2_space', 'M2 minimum space violation; min 8 µm', 'space', 'M2', None, 8.0, None),
+  ('MLOpen_width', 'MLOpen minimum feature size violation; min 10 µm', 'width', 'MLOpen', None, 10.0, None),
+  ('MLOpen_space', 'MLOpen minimum space violation; min 10 µm', 'space', 'MLOpen', None, 10.0, None),
+  ('VC_width', 'VC minimum feature size violation; min 5 µm', 'width', 'VC', None, 5.0, 70),
+  ('VC_space', 'VC minimum space violation; min 5 µm', 'space', 'VC', None, 5.0, None),
+  ('Npp_width', 'Npp Doping minimum feature size violation; min 2 µm', 'width', 'Npp', None, 2.0, 70),
+  ('Npp_space', 'Npp minimum space violation; min 2 µm', 'space', 'Npp', None, 2.0, None),
+  ('N_width', 'N Doping minimum feature size violation; min 2 µm', 'width', 'N', None, 2.0, 70),
+  ('N_space', 'N minimum space violation; min 2 µm', 'space', 'N', None, 2.0, None),
+  ('Npp_Si_separation', 'Npp-Si minimum separation violation; min 2 µm', 'separation', 'Npp', 'Si', 2.0, None),
+  ('VC_Si_separation', 'VC-Si minimum separation violation; min 3 µm', 'separation', 'VC', 'Si', 3.0, None),
+  ('M2_M1_overlap', 'M2 minimum overlap with M1 violation; min 3 µm', 'overlap', 'M2', 'M1', 3.0, None),
+  ('M2_VC_overlap', 'Metal2-VC minimum overlap violation; min 5 µm', 'overlap', 'M2', 'VC', 5.0, None),
+  ('N_Npp_overlap', 'N-Npp minimum overlap violation; min 3 µm', 'overlap', 'N', 'Npp', 3.0, None),
+  ('VC_Npp_overlap', 'VC-Npp minimum overlap violation; min 5 µm', 'overlap', 'VC', 'Npp', 5.0, None),
+  ('M2_VC_enclosure', 'M2-VC minimum enclosure violation; min 1 µm', 'enclosing', 'M2', 'VC', 1.0, None),
+  ('Si_rib_VC_enclosure', 'Si_rib-VC minimum enclosure violation; min 1 µm', 'enclosing', 'Si_rib', 'VC', 1.0, None),
+  ('SiEPIC-1a', 'Warning: Possible waveguide mismatch or waveguide disconnect: PinRec must enclose only one waveguide material.',
+   'not_inside', 'PinRec', 'Si', None, None),
+)
+
+MODES = ('flat', 'deep', 'tiled')
+
+# check -> (Region method, takes the other layer, distance check)
+_CHECKS = {
+  'width': ('width_check', False, True),
+  'space': ('space_check', False, True),
+  'separation': ('separation_check', True, True),
+  'overlap': ('overlap_check', True, True),
+  'enclosing': ('enclosing_check', True, True),
+  'outside': ('outside', True, False),
+  'not_inside': ('not_inside', True, False),
+  'overlapping': ('merged', False, False),
+}
+
+# whole-polygon selections: a tile only sees the part of a polygon within its border, so these
+# (cheap) rules are run hierarchically on the whole layout in the tiled modes
+_SELECTIONS = ('outside', 'not_inside')
+
+
+def rule_distance(rule):
+    '''Check distance of a rule in um (0 for the non-distance checks).'''
+    value = rule[5]
+    return value - TOLERANCE if value is not None else 0.0
+
+
+def max_rule_distance(rules = RULES):
+    '''Largest check distance of a rule set in um, i.e. its interaction range.'''
+    return max([rule_distance(r) for r in rules] + [0.0])
+
+
+def layer_indexes(ly, name):
+    '''Indexes of the layout layers of a deck layer (all datatypes when the deck gives none).'''
+    layer, datatype = LAYERS[name]
+    return [li for li in ly.layer_indexes()
+            if ly.get_info(li).layer == layer and (datatype is None or ly.get_info(li).datatype == datatype)]
+
+
+def shape_iterator(ly, cell, name):
+    '''Recursive shape iterator over the layers of a deck layer, or None if the layout does not have them.'''
+    indexes = layer_indexes(ly, name)
+    return pya.RecursiveShapeIterator(ly, cell, indexes) if indexes else None
+
+
+def _check_args(rule, dbu):
+    '''Positional arguments of the Region check method, after the other layer.'''
+    check, angle = rule[2], rule[6]
+    if check == 'overlapping':
+        return [False, 1]   # DRC merged(2): wrap count of at least 2
+    if not _CHECKS[check][2]:
+        return []
+    args = [int(round(rule_distance(rule)/dbu)), False, pya.Region.Euclidian]
+    if angle is not None:
+        args.append(angle)
+    return args
+
+
+def _expression(value):
+    '''Argument of _check_args in the expression language of the TilingProcessor.'''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return str(value)
+    return 'Region.Euclidian'
+
+
+def _run_region(rule, regions, dbu):
+    method, binary, _ = _CHECKS[rule[2]]
+    a = regions[rule[3]]
+    args = ([regions[rule[4]]] if binary else []) + _check_args(rule, dbu)
+    return getattr(a, method)(*args)
+
+
+def _tiled_expression(rule, dbu, clip = True):
+    '''TilingProcessor script of a rule: inputs a (and b), output o.'''
+    method, binary, _ = _CHECKS[rule[2]]
+    args = (['b'] if binary else []) + [_expression(a) for a in _check_args(rule, dbu)]
+    return '_output(o, a.%s(%s), %s)' % (method, ', '.join(args), _expression(clip))
+
+
+def _tiling_processor(rule, ly, iterators, threads, tile_size):
+    '''TilingProcessor of a rule, with its inputs and a tile border of the rule distance.'''
+    tp = pya.TilingProcessor()
+    tp.dbu = ly.dbu
+    tp.threads = threads
+    tp.tile_size(tile_size, tile_size)
+    border = rule_distance(rule) + 10*ly.dbu
+    tp.tile_border(border, border)
+    tp.input('a', iterators[rule[3]])
+    if _CHECKS[rule[2]][1]:
+        tp.input('b', iterators[rule[4]] or pya.Region())
+    return tp
+
+
+def _clipped_edge(edge, box):
+    '''Part of edge in box, or None (also when a non degenerated edge only touches the box).'''
+    clipped = edge.clipped(box)
+    if clipped is not None and clipped.is_degenerate() and not edge.is_degenerate():
+        return None
+    return clipped
+
+
+def clip_marker(marker, tile, reach):
+    '''Part of an edge pair marker of a tile check that lies in the tile (dbu), or None.
+
+    The tile input holds the shapes overlapping the tile and its border, but not their neighbours
+    beyond the border: past it, merged shapes may differ from the layout and the markers along their
+    edges are not reliable. Both edges are cut at the tile box; an edge that is outside the tile,
+    opposite an edge inside, is cut at the tile box enlarged by reach (the rule distance, within the
+    border). The same marker may then come out of two tiles: callers drop the duplicates (_unique).
+    '''
+    first = _clipped_edge(marker.first, tile)
+    second = _clipped_edge(marker.second, tile)
+    if first is None and second is None:
+        return None
+    near = tile.enlarged(reach, reach)
+    if first is None:
+        first = _clipped_edge(marker.first, near)
+    if second is None:
+        second = _clipped_edge(marker.second, near)
+    if first is None or second is None:
+        return None
+    return pya.EdgePair(first, second, marker.symmetric)
+
+
+def _tile_markers(rule, obj, tile, dbu):
+    '''Markers of a tile check output, cut at the tile box (dbu).'''
+    if isinstance(obj, pya.Region):
+        return [polygon.dup() for polygon in (obj & pya.Region(tile)).each()]
+    reach = int(round(rule_distance(rule)/dbu))
+    return [m for m in (clip_marker(marker, tile, reach) for marker in obj.each()) if m is not None]
+
+
+def _unique(markers):
+    '''EdgePairs of the markers, each once.'''
+    unique = pya.EdgePairs()
+    for marker in dict.fromkeys(markers):
+        unique.insert(marker)
+    return unique
+
+
+class _TiledResult(pya.TileOutputReceiver):
+    '''Markers of all the tiles, cut at the tile boxes (see clip_marker).'''
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.markers = []
+
+    def put(self, ix, iy, tile, obj, dbu, clip):
+        self.markers += _tile_markers(self.rule, obj, tile, dbu)
+
+    def result(self):
+        if _CHECKS[self.rule[2]][2]:
+            return _unique(self.markers)
+        return pya.Region(self.markers)
+
+
+def _run_tiled(rule, ly, cell, iterators, threads, tile_size):
+    tp = _tiling_processor(rule, ly, iterators, threads, tile_size)
+    receiver = _TiledResult(rule)
+    tp.output('o', receiver)
+    tp.queue(_tiled_expression(rule, ly.dbu, clip = False))
+    tp.execute(rule[0])
+    return receiver.result()
+
+
+def _flat_markers(result):
+    '''Flat copy of the markers of a hierarchical check.
+
+    An edge pair found in the context of several cells is found again at the same place once
+    flattened: duplicates are dropped, so the markers are those of the flat check.
+    '''
+    if isinstance(result, pya.Region):
+        flat = pya.Region()
+        flat.insert(result)
+        return flat
+    flat = pya.EdgePairs()
+    flat.insert(result)
+    return _unique(marker.dup() for marker in flat.each())
+
+
+def _run_deep(rule, iterators, threads, dbu):
+    '''Rule on the whole layout, hierarchically; the markers are returned flat (the shape store is released).'''
+    dss = pya.DeepShapeStore()
+    dss.threads = threads
+    regions = {name: pya.Region(iterators[name], dss) if iterators[name] is not None else pya.Region()
+               for name in rule[3:5]}
+    return _flat_markers(_run_region(rule, regions, dbu))
+
+
+def _skipped(rule, iterators):
+    '''True when a layer of the rule is not in the layout (nothing to check).'''
+    if iterators[rule[3]] is None:
+        return True
+    return rule[2] != 'outside' and _CHECKS[rule[2]][1] and iterators[rule[4]] is None
+
+
+def run(ly, cell = None, mode = 'deep', threads = 4, tile_size = 1000.0, rules = RULES, select = None, log = None):
+    '''Run the rules on a cell (default: the top cell) of a layout.
+
+    Args:
+        mode: 'flat', 'deep' or 'tiled'
+        threads: worker threads of the deep and tiled modes
+        tile_size: tile size in um (tiled mode)
+        select: list of substrings of the rule names to run (all by default)
+        log: optional print-like function, called once per rule
+    Returns:
+        (pya.ReportDatabase, OrderedDict rule -> {'seconds', 'markers'})
+    '''
+    if mode not in MODES:
+        raise ValueError('unknown DRC mode %s (expected one of %s)' % (mode, ', '.join(MODES)))
+    cell = cell or ly.top_cell()
+    rdb = pya.ReportDatabase('SiEPIC-EBeam-PDK DRC')
+    rdb.top_cell_name = cell.name
+    rdb.generator = 'prl_tools.drc (%s, %s threads)' % (mode, threads if mode != 'flat' else 1)
+    rdb_cell = rdb.create_cell(cell.name)
+    trans = pya.CplxTrans(ly.dbu)
+
+    iterators = {name: shape_iterator(ly, cell, name) for name in LAYERS}
+    if mode != 'tiled':
+        dss = None
+        if mode == 'deep':
+            dss = pya.DeepShapeStore()
+            dss.threads = threads
+        regions = {}
+        for name, it in iterators.items():
+            if it is None:
+                regions[name] = pya.Region()
+            else:
+                regions[name] = pya.Region(it, dss) if dss is not None else pya.Region(it)
+
+    timings = OrderedDict()
+    for rule in rules:
+        if select and not any(s in rule[0] for s in select):
+            continue
+        category = rdb.create_category(rule[0])
+        category.description = rule[1]
+        t0 = time.perf_counter()
+        if _skipped(rule, iterators):
+            result = None
+        elif mode == 'tiled' and rule[2] in _SELECTIONS:
+            result = _run_deep(rule, iterators, threads, ly.dbu)
+        elif mode == 'tiled':
+            result = _run_tiled(rule, ly, cell, iterators, threads, tile_size)
+        elif mode == 'deep':
+            result = _flat_markers(_run_region(rule, regions, ly.dbu))
+        else:
+            result = _run_region(rule, regions, ly.dbu)
+        markers = 0
+        if result is not None and not result.is_empty():
+            rdb.create_items(rdb_cell.rdb_id(), category.rdb_id(), trans, result)
+            markers = result.count()
+        timings[rule[0]] = {'seconds': time.perf_counter() - t0, 'markers': markers}
+        if log:
+            log('%-22s %9.3f s %7d markers' % (rule[0], timings[rule[0]]['seconds'], markers))
+    return rdb, timings
+
+
+def flagged_regions(rdb, dbu):
+    '''{rule: pya.Region} area (dbu) flagged by the markers of a report database, merged.'''
+    trans = pya.CplxTrans(dbu).inverted()
+    flagged = OrderedDict()
+    for category in rdb.each_category():
+        region = pya.Region()
+        for item in rdb.each_item_per_category(category.rdb_id()):
+            for value in item.each_value():
+                if value.is_edge_pair():
+                    # normalized: the enclosure markers would otherwise make self-intersecting quads
+                    region.insert(value.edge_pair().transformed(trans).normalized().polygon(1))
+                elif value.is_polygon():
+                    region.insert(value.polygon().transformed(trans))
+        flagged[category.name()] = region.merged()
+    return flagged
+
+
+def compare_modes(ly, cell = None, modes = ('flat', 'deep'), threads = 4, tile_size = 1000.0, rules = RULES,
+                  select = None, tolerance = 2):
+    '''Run the rules in several modes and return the rules that flag other geometry than in the first mode.
+
+    A rule differs when an area it flags in one mode is more than tolerance (dbu) away from the
+    areas it flags in the other. The areas are compared rather than the markers: the tiled checks
+    split the markers at the tile borders, and the hierarchical checks compute the markers of
+    non-Manhattan edges in other coordinates, which moves them by a database unit.
+    Returns:
+        OrderedDict rule -> {mode: markers}, empty when all the modes agree
+    '''
+    counts = OrderedDict()
+    flagged = {}
+    for mode in modes:
+        rdb, timings = run(ly, cell, mode, threads, tile_size, rules, select)
+        flagged[mode] = flagged_regions(rdb, ly.dbu)
+        for name, t in timings.items():
+            counts.setdefault(name, OrderedDict())[mode] = t['markers']
+    differences = OrderedDict()
+    for name, c in counts.items():
+        a = flagged[modes[0]][name]
+        for mode in modes[1:]:
+            b = flagged[mode][name]
+            if not ((a - b.sized(tolerance)).is_empty() and (b - a.sized(tolerance)).is_empty()):
+                differences[name] = c
+    return differences
+
+
+CACHE_VERSION = 3
+
+
+def _tile_key(x, y, tile):
+    return '%d,%d' % (x // tile, y // tile)
+
+
+def deck_layer_indexes(ly):
+    '''Indexes of the layout layers of all deck layers.'''
+    return sorted({li for name in LAYERS for li in layer_indexes(ly, name)})
+
+
+def _is_deck_layer(info):
+    return any(info.layer == layer and (datatype is None or info.datatype == datatype)
+               for layer, datatype in LAYERS.values())
+
+
+def snapshot_path(cache_path):
+    '''Deck layer snapshot of the previous incremental run, next to its cache.'''
+    return cache_path + '.gds'
+
+
+def write_snapshot(ly, path):
+    '''Write the deck layers of ly (all cells, no PCell context) to a GDS file.'''
+    opt = pya.SaveLayoutOptions()
+    opt.format = 'GDS2'
+    opt.write_context_info = False
+    opt.gds2_multi_xy_records = True   # large polygons are written as they are, not split
+    opt.deselect_all_layers()
+    for li in deck_layer_indexes(ly):
+        opt.add_layer(li, ly.get_info(li))
+    ly.write(path, opt)
+
+
+def changed_cells(old, new):
+    '''{cell name: [pya.Box]} areas (cell coordinates, dbu) whose own content on the deck layers differs
+    between two layouts (old is usually a snapshot, see write_snapshot).
+
+    The own content of a cell is its shapes and its instances (child name and placement, not the
+    child content). Cells are matched by name and compared with pya.LayoutDiff; the area of a shape
+    or an instance is its bbox and a deck layer that only one layout has marks the shapes of each cell
+    on it. A box and a polygon of the same geometry are equal (GDS reads rectangles back as boxes).
+    '''
+    changed = {}
+    only = ({}, {})   # per side: (cell name, layer, shape text) -> [bbox]
+    current = {}
+
+    def add(name, box):
+        # the diff passes temporaries: copy the box
+        changed.setdefault(name, []).append(pya.Box(box.left, box.bottom, box.right, box.top))
+
+    def begin_cell(cell_a, cell_b):
+        current['cell'] = cell_a.name
+
+    def begin_layer(info, index_a, index_b):
+        current['layer'] = str(info) if _is_deck_layer(info) else None
+
+    def layer_only(layout, li):
+        if not _is_deck_layer(layout.get_info(li)):
+            return
+        for cell in layout.each_cell():
+            if not cell.shapes(li).is_empty():
+                add(cell.name, pya.Region(cell.shapes(li)).bbox())
+
+    def shape_in(side, as_polygon = False):
+        def callback(shape, prop_id):
+            if current['layer'] is not None:
+                text = (pya.Polygon(shape) if as_polygon else shape).to_s()
+                box = shape.bbox()
+                only[side].setdefault((current['cell'], current['layer'], text), []).append(
+                    pya.Box(box.left, box.bottom, box.right, box.top))
+        return callback
+
+    diff = pya.LayoutDiff()
+    diff.on_begin_cell(begin_cell)
+    diff.on_begin_layer(begin_layer)
+    for side, suffix in enumerate(('a_only', 'b_only')):
+        getattr(diff, 'on_polygon_in_' + suffix)(shape_in(side))
+        getattr(diff, 'on_box_in_' + suffix)(shape_in(side, as_polygon = True))
+        for kind in ('path', 'edge', 'text'):
+            getattr(diff, 'on_%s_in_%s' % (kind, suffix))(shape_in(side))
+    diff.on_instance_in_a_only(lambda inst, prop_id: add(current['cell'], inst.bbox(old)))
+    diff.on_instance_in_b_only(lambda inst, prop_id: add(current['cell'], inst.bbox(new)))
+    diff.compare(old, new, pya.LayoutDiff.Verbose | pya.LayoutDiff.NoLayerNames | pya.LayoutDiff.NoProperties)
+    # the layers of one layout only (layer_index_a/b are not those of the layer in the
+    # on_layer_in_*_only callbacks, so they are looked up here)
+    for layout, other in ((old, new), (new, old)):
+        for li in layout.layer_indexes():
+            info = layout.get_info(li)
+            if other.find_layer(info.layer, info.datatype) is None:
+                layer_only(layout, li)
+
+    a_only, b_only = only
+    for key in set(a_only) | set(b_only):
+        boxes_a, boxes_b = a_only.get(key, []), b_only.get(key, [])
+        common = min(len(boxes_a), len(boxes_b))
+        for box in boxes_a[common:] + boxes_b[common:]:
+            add(key[0], box)
+    return changed
+
+
+def dirty_region(ly, cell, changed):
+    '''Region (cell coordinates, dbu) covered by the changed areas, in every instance of their cells under cell.'''
+    region = pya.Region()
+    for name, boxes in changed.items():
+        child = ly.cell(name)
+        if child is None:
+            continue
+        if child.cell_index() == cell.cell_index():
+            for box in boxes:
+                region.insert(box)
+            continue
+        it = cell.begin_instances_rec()
+        it.targets = [child.cell_index()]
+        while not it.at_end():
+            t = it.trans() * it.inst_trans()
+            for box in boxes:
+                region.insert(box.transformed(t))
+            it.next()
+    return region.merged()
+
+
+class _TileMarkers(pya.TileOutputReceiver):
+    '''Markers of each tile, cut at the tile box (see clip_marker), as strings.'''
+
+    def __init__(self, rule, tile):
+        self.rule = rule
+        self.tile = tile
+        self.markers = {}
+
+    def put(self, ix, iy, tile, obj, dbu, clip):
+        kept = [marker.to_s() for marker in _tile_markers(self.rule, obj, tile, dbu)]
+        c = tile.center()
+        self.markers[_tile_key(c.x, c.y, self.tile)] = '\n'.join(kept)
+
+
+def _cache_signature(ly, cell, rules, tile_size):
+    signature = {'version': CACHE_VERSION, 'cell': cell.name, 'dbu': ly.dbu, 'tile_size': tile_size,
+                 'layers': LAYERS, 'rules': rules}
+    return json.loads(json.dumps(signature))
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime]
+
+
+def _load_cache(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def run_incremental(ly, cache_path, cell = None, threads = 4, tile_size = 200.0, rules = RULES, select = None,
+                    log = None):
+    '''Tiled DRC that only re-checks the tiles around the cells changed since the previous run.
+
+    Markers are cached per rule and per tile of the checked cell in cache_path, and the deck layers
+    of the run are written to snapshot_path(cache_path) for the next one. The tiles re-checked are those within the largest rule distance of a
+    change, in any instance of the changed cells; the others reuse their cached markers. Without a
+    usable cache (first run, other rules, dbu or tile size, missing snapshot) every tile is checked.
+
+    Args:
+        select: list of substrings of the rule names to run (all by default); the cache holds the
+            selected rules, so another selection starts with a full check
+    Returns:
+        (pya.ReportDatabase, OrderedDict rule -> {'seconds', 'markers'}, stats dict)
+    '''
+    if select:
+        rules = tuple(rule for rule in rules if any(s in rule[0] for s in select))
+    cell = cell or ly.top_cell()
+    tile = int(round(tile_size/ly.dbu))
+    stats = OrderedDict()
+    snapshot = snapshot_path(cache_path)
+    signature = _cache_signature(ly, cell, rules, tile_size)
+    cache = _load_cache(cache_path)
+    full = (cache is None or cache.get('signature') != signature
+            or cache.get('snapshot') != _file_stamp(snapshot))
+    t0 = time.perf_counter()
+    if not full:
+        previous = pya.Layout()
+        previous.read(snapshot)
+        changed = changed_cells(previous, ly)
+    stats['diff_s'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    dirty_input = None
+    frame = None   # tiles to run, in tile units
+    if full:
+        cache = {'signature': signature, 'markers': {}}
+        changed = dict.fromkeys(c.name for c in ly.each_cell())
+    else:
+        halo = int(round(max_rule_distance(rules)/ly.dbu)) + 10
+        dirty_keys = set()
+        for polygon in dirty_region(ly, cell, changed).sized(halo).each():
+            box = polygon.bbox()
+            for ix in range(box.left // tile, box.right // tile + 1):
+                for iy in range(box.bottom // tile, box.top // tile + 1):
+                    dirty_keys.add('%d,%d' % (ix, iy))
+        # one point at the center of every dirty tile: the tile script only runs where it sees one
+        dirty_input = pya.Region()
+        for key in dirty_keys:
+            ix, iy = [int(v) for v in key.split(',')]
+            x, y = ix*tile + tile//2, iy*tile + tile//2
+            dirty_input.insert(pya.Box(x - 1, y - 1, x + 1, y + 1))
+        for markers in cache['markers'].values():
+            for key in dirty_keys:
+                markers.pop(key, None)
+        stats['dirty_tiles'] = len(dirty_keys)
+        if dirty_keys:
+            xs, ys = zip(*[[int(v) for v in key.split(',')] for key in dirty_keys])
+            frame = pya.Box(min(xs), min(ys), max(xs), max(ys))
+    stats['changed_cells'] = len(changed)
+    stats['full'] = full
+    stats['dirty_s'] = time.perf_counter() - t0
+
+    rdb = pya.ReportDatabase('SiEPIC-EBeam-PDK DRC')
+    rdb.top_cell_name = cell.name
+    rdb.generator = 'prl_tools.drc (incremental, %s threads)' % threads
+    rdb_cell = rdb.create_cell(cell.name)
+    trans = pya.CplxTrans(ly.dbu)
+    iterators = {name: shape_iterator(ly, cell, name) for name in LAYERS}
+    if full:
+        bbox = cell.bbox()
+        frame = pya.Box(bbox.left // tile, bbox.bottom // tile, bbox.right // tile, bbox.top // tile)
+    timings = OrderedDict()
+    for rule in rules:
+        category = rdb.create_category(rule[0])
+        category.description = rule[1]
+        t0 = time.perf_counter()
+        if _skipped(rule, iterators) or rule[2] in _SELECTIONS:
+            cache['markers'].pop(rule[0], None)
+            result = pya.Region()
+            if not _skipped(rule, iterators):
+                result = _run_deep(rule, iterators, threads, ly.dbu)
+        else:
+            markers = cache['markers'].setdefault(rule[0], {})
+            if frame is not None:
+                tp = _tiling_processor(rule, ly, iterators, threads, tile_size)
+                # fixed grid, aligned on multiples of the tile size, so the tile keys stay valid across runs
+                # (the frame is required: a single tile without frame covers everything)
+                tp.frame = pya.DBox(frame.left*tile_size, frame.bottom*tile_size,
+                                    (frame.right + 1)*tile_size, (frame.top + 1)*tile_size)
+                tp.tile_origin(frame.left*tile_size, frame.bottom*tile_size)
+                tp.tiles(frame.width() + 1, frame.height() + 1)
+                receiver = _TileMarkers(rule, tile)
+                tp.output('o', receiver)
+                script = _tiled_expression(rule, ly.dbu, clip = False)
+                if not full:
+                    tp.input('dirty', dirty_input)
+                    script = 'dirty.is_empty ? nil : ' + script
+                tp.queue(script)
+                tp.execute(rule[0])
+                markers.update((key, kept) for key, kept in receiver.markers.items() if kept)
+            texts = [text for kept in markers.values() for text in (kept.split('\n') if kept else ())]
+            if _CHECKS[rule[2]][2]:
+                # a marker across a tile border may be cached in both tiles
+                result = _unique(pya.EdgePair.from_s(text) for text in texts)
+            else:
+                result = pya.Region([pya.Polygon.from_s(text) for text in texts])
+        if not result.is_empty():
+            rdb.create_items(rdb_cell.rdb_id(), category.rdb_id(), trans, result)
+        timings[rule[0]] = {'seconds': time.perf_counter() - t0, 'markers': result.count()}
+        if log:
+            log('%-22s %9.3f s %7d markers' % (rule[0], timings[rule[0]]['seconds'], result.count()))
+
+    t0 = time.perf_counter()
+    write_snapshot(ly, snapshot)
+    cache['snapshot'] = _file_stamp(snapshot)
+    stats['snapshot_s'] = time.perf_counter() - t0
+    with open(cache_path, 'w') as f:
+        json.dump(cache, f)
+    return rdb, timings, stats
+
+
+def format_timings(timings):
+    '''Text table of the per-rule runtimes, slowest first.'''
+    lines = ['%-22s %9s %9s' % ('rule', 'seconds', 'markers')]
+    for name, t in sorted(timings.items(), key = lambda kv: -kv[1]['seconds']):
+        lines.append('%-22s %9.3f %9d' % (name, t['seconds'], t['markers']))
+    lines.append('%-22s %9.3f %9d' % ('total', sum(t['seconds'] for t in timings.values()),
+                                      sum(t['markers'] for t in timings.values())))
+    return '\n'.join(lines)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Run the SiEPIC_EBeam DRC rule set in flat, deep or tiled mode.')
+    parser.add_argument('layout', help = 'input layout (.gds, .oas)')
+    parser.add_argument('-o', '--output', help = 'report database (default: <layout>.lyrdb)')
+    parser.add_argument('--cell', help = 'cell to check (default: the top cell)')
+    parser.add_argument('--mode', choices = MODES, default = 'deep')
+    parser.add_argument('--threads', type = int, default = 4)
+    parser.add_argument('--tile', type = float, help = 'tile size in um (default: 1000 tiled, 200 incremental)')
+    parser.add_argument('--incremental', action = 'store_true',
+                        help = 'tiled check of the tiles around the cells changed since the previous run only')
+    parser.add_argument('--cache', help = 'incremental cache file (default: <report>.cache.json)')
+    parser.add_argument('--compare', action = 'store_true',
+                        help = 'run flat and --mode (deep by default) and report the rules that flag other geometry')
+    parser.add_argument('-k', dest = 'select', action = 'append', help = 'only run rules whose name contains this text')
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    ly = pya.Layout()
+    ly.read(args.layout)
+    cell = ly.cell(args.cell) if args.cell else ly.top_cell()
+    if cell is None:
+        raise ValueError('cell %s not found' % args.cell)
+    if args.compare:
+        modes = ('flat', args.mode if args.mode != 'flat' else 'deep')
+        differences = compare_modes(ly, cell, modes, args.threads, args.tile or 1000.0, select = args.select)
+        for name, counts in differences.items():
+            print('%-22s %s' % (name, ', '.join('%s %d' % mc for mc in counts.items())))
+        print('%s: %s' % (' vs '.join(modes), '%d rules differ' % len(differences) if differences else 'same geometry flagged'))
+        return 1 if differences else 0
+    output = args.output or args.layout.rsplit('.', 1)[0] + '.lyrdb'
+    if args.incremental:
+        rdb, timings, stats = run_incremental(ly, args.cache or output + '.cache.json', cell, args.threads,
+                                              args.tile or 200.0, select = args.select)
+    else:
+        rdb, timings = run(ly, cell, args.mode, args.threads, args.tile or 1000.0, select = args.select)
+    rdb.save(output)
+    print(format_timings(timings))
+    if args.incremental:
+        print('%s check: %s changed cells, %s tiles re-checked' %
+              ('full' if stats['full'] else 'incremental', stats['changed_cells'], stats.get('dirty_tiles', 'all')))
+    print('%s markers written to %s in %.2f s' % (sum(t['markers'] for t in timings.values()), output,
+                                                 time.perf_counter() - t0))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
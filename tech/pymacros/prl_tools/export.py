@@ -0,0 +1,214 @@
+"""
+PRL PDK Tools - Export for fabrication
+Notice: Information in this file is confidential.
+
+Description:
+Static (no PCell context) OASIS export of a layout for fabrication, usable from the GUI macro
+(export_for_fabrication.lym) and from the command line. The content hash of the layout file the
+layout was read from (the macro saves the layout first) is stored next to the output file, with a
+hash of the PDK the geometry of that file depends on: the PCell and prl_tools helper sources, the
+fixed-cell layout files and the technology files (pdk_hash). When neither changed since the last
+export and the output is still the file that was written then, the output is reused instead of
+being written again. Hashing the files costs a small fraction of the OASIS write, unlike hashing
+every shape. The time spent in each stage is reported.
+
+Forbidden characters ('=' and ',') are replaced in the cell names of the exported layout, as
+SiEPIC cell_character_replacement does, touching only the cells that contain them.
+
+Usage:
+  PYTHONPATH=tech/pymacros python -m prl_tools.export chip.gds                 writes chip_static.oas
+  PYTHONPATH=tech/pymacros python -m prl_tools.export chip.gds -o out.oas --compression 2 --force
+
+(C) NYUAD 2023
+"""
+
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+
+import pya
+
+
+FORBIDDEN_CELL_CHARACTERS = '=,'
+
+# tech folder of the PDK, and the parts of it the geometry of a layout depends on
+PDK_FOLDER = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..'))
+PCELL_FOLDERS = ('pymacros/pcells_beta',)
+FIXED_CELL_FOLDERS = ('gds/fixed',)
+TECHNOLOGY_FILES = ('*.lyt', '*.lyp', '*.xml')
+
+
+def output_path(layout_filename, extra = 'static', extension = 'oas'):
+    '''<layout name>_<extra>.<extension>, next to the layout file.'''
+    base = os.path.splitext(layout_filename)[0]
+    return '%s_%s.%s' % (base, extra, extension)
+
+
+def sanitize_cell_names(ly, forbidden = FORBIDDEN_CELL_CHARACTERS, replacement = '_'):
+    '''Replace the forbidden characters in cell names. Returns the number of renamed cells.'''
+    renamed = 0
+    for cell in ly.each_cell():
+        name = cell.name
+        if any(c in name for c in forbidden):
+            for c in forbidden:
+                name = name.replace(c, replacement)
+            cell.name = name
+            renamed += 1
+    return renamed
+
+
+def file_hash(path, block = 1 << 20):
+    '''SHA1 hex digest of the content of a file.'''
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(block), b''):
+            h.update(data)
+    return h.hexdigest()
+
+
+def pdk_hash(technology = None, folder = PDK_FOLDER):
+    '''SHA1 of the PDK files the geometry of a layout read with this PDK depends on.
+
+    Covers the PCell modules and the pcell_cache GEOMETRY_MODULES, the fixed-cell layout files,
+    the technology files of the tech folder and the declaration of technology (when it is declared).
+    The file hashes are cached until the files are modified (pcell_cache.source_hash).
+    '''
+    from .fixed_cells import find_layout_files
+    from .pcell_cache import helpers_hash, source_hash
+    files = []
+    for name in PCELL_FOLDERS:
+        path = os.path.join(folder, name)
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith('.py'))
+    for name in FIXED_CELL_FOLDERS:
+        files += find_layout_files(os.path.join(folder, name))
+    files += sorted(os.path.join(folder, f) for f in os.listdir(folder)
+                    if any(fnmatch.fnmatch(f, pattern) for pattern in TECHNOLOGY_FILES))
+    h = hashlib.sha1(helpers_hash().encode())
+    for path in files:
+        h.update(('\0%s=%s' % (os.path.relpath(path, folder), source_hash(path))).encode())
+    if technology and pya.Technology.has_technology(technology):
+        tech = pya.Technology.technology_by_name(technology)
+        h.update(('\0' + tech.to_xml()).encode())
+        lyp = tech.eff_layer_properties_file()
+        if lyp:
+            h.update(('\0' + source_hash(lyp)).encode())
+    return h.hexdigest()
+
+
+def _manifest_path(file_out):
+    return file_out + '.hashes.json'
+
+
+def _load_manifest(file_out):
+    try:
+        with open(_manifest_path(file_out)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime]
+
+
+def save_options(compression_level = 10):
+    '''OASIS options of the fabrication export: no PCell context, permissive.'''
+    opt = pya.SaveLayoutOptions()
+    opt.write_context_info = False  # remove $$$CONTEXT_INFO$$$
+    opt.format = 'OASIS'  # smaller file size
+    opt.oasis_compression_level = compression_level
+    opt.oasis_permissive = True
+    return opt
+
+
+def export_layout(ly, file_out, compression_level = 10, force = False, log = None, source = None):
+    '''Export ly (cell names are sanitized in place) to file_out, unless it is up to date.
+
+    Args:
+        compression_level: OASIS compression level (0..10; 10 is the smallest and slowest)
+        force: write even if the source and the PDK did not change
+        log: optional print-like function for the progress
+        source: layout file ly was read from, unmodified since; without it the output is always written
+    Returns:
+        report dict: stages (seconds), cells, changed flag of the source or the PDK, reused flag
+    '''
+    stages = OrderedDict()
+    t = time.perf_counter()
+    renamed = sanitize_cell_names(ly)
+    stages['rename'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    digest = file_hash(source) if source else None
+    pdk = pdk_hash(ly.technology_name)
+    stages['hash'] = time.perf_counter() - t
+
+    previous = _load_manifest(file_out)
+    changed = (digest is None or previous is None or previous.get('source') != digest
+               or previous.get('pdk') != pdk)
+    up_to_date = (not changed
+                  and previous.get('compression_level') == compression_level
+                  and previous.get('dbu') == ly.dbu
+                  and previous.get('output') == _file_stamp(file_out))
+
+    t = time.perf_counter()
+    reused = up_to_date and not force
+    if not reused:
+        if log:
+            log('saving output OASIS: %s' % file_out)
+        ly.write(file_out, save_options(compression_level))
+    stages['write'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    if not reused:
+        manifest = {'compression_level': compression_level, 'dbu': ly.dbu,
+                    'output': _file_stamp(file_out), 'source': digest, 'pdk': pdk}
+        with open(_manifest_path(file_out), 'w') as f:
+            json.dump(manifest, f, indent = 0)
+    stages['manifest'] = time.perf_counter() - t
+
+    return {'output': file_out, 'reused': reused, 'cells': ly.cells(), 'renamed': renamed,
+            'changed': changed, 'stages': stages, 'total_s': sum(stages.values())}
+
+
+def format_report(report):
+    '''Text summary of an export_layout() report.'''
+    lines = ['%s: %s' % ('reused (source and PDK unchanged)' if report['reused'] else 'written', report['output']),
+             '%s cells, %s renamed, source or PDK %s' %
+             (report['cells'], report['renamed'], 'changed' if report['changed'] else 'unchanged')]
+    lines += ['  %-9s %8.3f s' % (stage, seconds) for stage, seconds in report['stages'].items()]
+    lines.append('  %-9s %8.3f s' % ('total', report['total_s']))
+    return '\n'.join(lines)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Export a layout for fabrication (static OASIS), incrementally.')
+    parser.add_argument('layout', help = 'input layout (.gds, .oas)')
+    parser.add_argument('-o', '--output', help = 'output file (default: <layout>_static.oas)')
+    parser.add_argument('--compression', type = int, default = 10, help = 'OASIS compression level 0..10 (default 10)')
+    parser.add_argument('--force', action = 'store_true', help = 'write even if the layout file and the PDK did not change')
+    args = parser.parse_args(argv)
+
+    t = time.perf_counter()
+    ly = pya.Layout()
+    ly.read(args.layout)
+    load_s = time.perf_counter() - t
+    report = export_layout(ly, args.output or output_path(args.layout), args.compression, args.force, log = print,
+                           source = args.layout)
+    report['stages'] = OrderedDict([('load', load_s)] + list(report['stages'].items()))
+    report['total_s'] += load_s
+    print(format_report(report))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,277 @@
+"""
+PRL PDK Tools - Fixed-cell catalog
+Notice: Information in this file is confidential.
+
+Description:
+Catalog of the fixed (GDS/OASIS) cells of the PRL_PDK libraries.
+
+By default the files are read once each into the library layout (one directory walk, no
+manifest), so the fixed cells are static library cells named after their top cells, as the
+layouts made with the library reference them.
+
+With lazy=True, the files are described in a JSON manifest (cell names, bounding boxes, layers,
+and for GDS files the byte range of every structure), whose entry for a file is only rebuilt
+when its size or modification time changes, so starting KLayout does not read any layout data.
+Each top cell is registered through a FixedCellDeclaration, and its geometry is only read the
+first time the cell is placed: for GDS files only the byte ranges of the cell and of the cells
+it references are read, OASIS files are read completely. A static library cell cannot be filled
+on demand (KLayout has no hook when it is placed, and library proxies are refreshed from it), so
+these cells are PCells: layouts that place them can only be opened with a lazy library, and
+layouts placing the static cells show them as defunct in a lazy library.
+
+Default manifest: $PRLPDK_FIXED_MANIFEST, or ~/.klayout/prl_pdk/fixed_cells.json
+
+(C) NYUAD 2023
+"""
+
+import fnmatch
+import json
+import os
+import struct
+import tempfile
+import time
+
+import pya
+
+from .pcell_cache import copy_cell
+
+
+MANIFEST_VERSION = 1
+
+# GDSII record types
+_ENDLIB = 0x04
+_BGNSTR = 0x05
+_STRNAME = 0x06
+_ENDSTR = 0x07
+_SNAME = 0x12
+
+_layouts = {}   # OASIS file -> (mtime, pya.Layout)
+
+
+def default_manifest_file():
+    return os.environ.get('PRLPDK_FIXED_MANIFEST',
+                          os.path.join(os.path.expanduser('~'), '.klayout', 'prl_pdk', 'fixed_cells.json'))
+
+
+def find_layout_files(dir_path):
+    '''GDS and OASIS files below dir_path (one directory walk), sorted by path.'''
+    files = []
+    for root, dirnames, filenames in os.walk(dir_path, followlinks = True):
+        for filename in filenames:
+            if fnmatch.fnmatch(filename.lower(), '*.gds') or fnmatch.fnmatch(filename.lower(), '*.oas'):
+                files.append(os.path.join(root, filename))
+    return sorted(files)
+
+
+def _gds_name(data):
+    return data.rstrip(b'\0').decode('ascii', 'replace')
+
+
+def scan_gds(path):
+    '''Byte ranges of the structures of a GDS file, without reading the geometry.
+
+    Returns:
+        (header end offset, {structure name: (start offset, end offset, [referenced names])})
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    header_end = None
+    structures = {}
+    pos = 0
+    start = name = refs = None
+    while pos + 4 <= len(data):
+        length, rectype = struct.unpack_from('>HB', data, pos)
+        if length < 4:
+            break
+        if rectype == _BGNSTR:
+            start, refs = pos, []
+            if header_end is None:
+                header_end = pos
+        elif rectype == _STRNAME:
+            name = _gds_name(data[pos+4:pos+length])
+        elif rectype == _SNAME:
+            refs.append(_gds_name(data[pos+4:pos+length]))
+        elif rectype == _ENDSTR:
+            structures[name] = (start, pos + length, sorted(set(refs)))
+        elif rectype == _ENDLIB:
+            break
+        pos += length
+    return (header_end if header_end is not None else pos), structures
+
+
+def describe_file(path):
+    '''Manifest entry of one layout file.'''
+    st = os.stat(path)
+    ly = pya.Layout()
+    ly.read(path)
+    entry = {'mtime': st.st_mtime, 'size': st.st_size, 'dbu': ly.dbu, 'cells': {}}
+    is_gds = path.lower().endswith('.gds')
+    if is_gds:
+        entry['header'], structures = scan_gds(path)
+    for cell in ly.top_cells():
+        box = cell.dbbox()
+        layers = [str(ly.get_info(li)) for li in ly.layer_indexes() if not cell.bbox_per_layer(li).empty()]
+        info = {'bbox': [box.left, box.bottom, box.right, box.top], 'layers': layers}
+        if is_gds and cell.name in structures:
+            info['offset'] = list(structures[cell.name][:2])
+        entry['cells'][cell.name] = info
+    if is_gds:
+        entry['structures'] = {name: list(s) for name, s in structures.items()}
+    return entry
+
+
+class Catalog(object):
+    '''Manifest of the fixed cells of one or more folders, cached in a JSON file.'''
+
+    def __init__(self, manifest_file = None):
+        self.manifest_file = manifest_file or default_manifest_file()
+        self.files = {}
+        self.rebuilt = 0
+        try:
+            with open(self.manifest_file) as f:
+                manifest = json.load(f)
+            if manifest.get('version') == MANIFEST_VERSION:
+                self.files = manifest['files']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def update(self, dir_path):
+        '''Bring the entries of the files below dir_path up to date. Returns the list of files.'''
+        files = find_layout_files(dir_path)
+        for path in files:
+            st = os.stat(path)
+            entry = self.files.get(path)
+            if entry and entry['mtime'] == st.st_mtime and entry['size'] == st.st_size:
+                continue
+            try:
+                self.files[path] = describe_file(path)
+                self.rebuilt += 1
+            except RuntimeError as e:
+                print('   Error: Could not read %s: %s' % (path, e))
+        return files
+
+    def save(self):
+        '''Write the manifest (atomically), only if an entry was rebuilt.'''
+        if not self.rebuilt:
+            return
+        folder = os.path.dirname(self.manifest_file)
+        os.makedirs(folder, exist_ok = True)
+        fd, tmp = tempfile.mkstemp(suffix = '.json', dir = folder)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'files': self.files}, f)
+        os.replace(tmp, self.manifest_file)
+        self.rebuilt = 0
+
+    def cells(self, files):
+        '''(cell name, file, info) of the top cells of files, in file order.'''
+        return [(name, path, info) for path in files if path in self.files
+                for name, info in self.files[path]['cells'].items()]
+
+
+def _gds_closure(structures, name):
+    '''Names of a structure and of all the structures it references.'''
+    names, todo = [], [name]
+    while todo:
+        n = todo.pop()
+        if n in names or n not in structures:
+            continue
+        names.append(n)
+        todo.extend(structures[n][2])
+    return names
+
+
+def read_cell(path, name, entry):
+    '''Layout with the cell name (and its children) of a fixed-cell file.'''
+    if 'structures' in entry and name in entry['structures']:
+        # GDS: read the header and the byte ranges of the needed structures only
+        chunks = []
+        with open(path, 'rb') as f:
+            chunks.append(f.read(entry['header']))
+            for n in sorted(_gds_closure(entry['structures'], name), key = lambda n: entry['structures'][n][0]):
+                start, end = entry['structures'][n][:2]
+                f.seek(start)
+                chunks.append(f.read(end - start))
+        chunks.append(struct.pack('>HBB', 4, _ENDLIB, 0))
+        fd, tmp = tempfile.mkstemp(suffix = '.gds')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(b''.join(chunks))
+            ly = pya.Layout()
+            ly.read(tmp)
+        finally:
+            os.remove(tmp)
+        return ly
+    cached = _layouts.get(path)
+    if cached is None or cached[0] != entry['mtime']:
+        ly = pya.Layout()
+        ly.read(path)
+        cached = _layouts[path] = (entry['mtime'], ly)
+    return cached[1]
+
+
+class FixedCellDeclaration(pya.PCellDeclaration):
+    '''Library entry of a fixed cell, the geometry is read from its file when the cell is first placed.'''
+
+    def __init__(self, name, path, entry):
+        super(FixedCellDeclaration, self).__init__()
+        self.cell_name = name
+        self.path = path
+        self.entry = entry
+
+    def get_parameters(self):
+        return []
+
+    def get_layers(self, parameters):
+        return []
+
+    def display_text(self, parameters):
+        return self.cell_name
+
+    def produce(self, layout, layers, parameters, cell):
+        if os.path.getmtime(self.path) != self.entry['mtime']:
+            # the file was replaced after the library was registered, the byte ranges are stale
+            self.entry = describe_file(self.path)
+        ly = read_cell(self.path, self.cell_name, self.entry)
+        src = ly.cell(self.cell_name)
+        if src is None:
+            raise Exception('error: cell %s not found in %s' % (self.cell_name, self.path))
+        if abs(ly.dbu - layout.dbu) > 1e-9:
+            cell.copy_tree(src)   # converts the database unit
+        else:
+            copy_cell(src, cell)
+
+
+def register_fixed_cells(layout, dir_path, catalog = None, lazy = False):
+    '''Register the fixed cells of dir_path in a (library) layout.
+
+    Args:
+        layout: pya.Layout, usually pya.Library.layout()
+        dir_path: folder with GDS/OASIS files (searched recursively)
+        catalog: Catalog holding the manifest, a new one by default (lazy registration only)
+        lazy: if True, register FixedCellDeclaration PCells read when first placed instead of
+              reading every file into the layout now as static cells (see the module description)
+    Returns:
+        list of the registered cell names
+    '''
+    t0 = time.perf_counter()
+    if not lazy:
+        # static cells: the files are read once each, the manifest is not needed
+        files = find_layout_files(dir_path)
+        rebuilt = 0
+        existing = set(cell.name for cell in layout.each_cell())
+        for path in files:
+            print(" - reading %s" % path)
+            layout.read(path)
+        registered = [cell.name for cell in layout.top_cells() if cell.name not in existing]
+    else:
+        catalog = catalog or Catalog()
+        files = catalog.update(dir_path)
+        rebuilt = catalog.rebuilt
+        catalog.save()
+        registered = []
+        for name, path, info in catalog.cells(files):
+            layout.register_pcell(name, FixedCellDeclaration(name, path, catalog.files[path]))
+            registered.append(name)
+    print('  %s: %s cells in %s files (%s manifest entries rebuilt) in %.1f ms' %
+          (dir_path, len(registered), len(files), rebuilt, (time.perf_counter()-t0)*1e3))
+    return registered
@@ -0,0 +1,278 @@
+"""
+PRL PDK Tools - Geometry kernels
+Notice: Information in this file is confidential.
+Based on work of the SiEPIC project
+
+Description:
+Vectorized replacements for SiEPIC.utils.translate_from_normal, arc_to_waveguide, arc and the
+corner rounding of the Wireguide PCell. Arcs and circles are discretized within an arc tolerance,
+with their vertices slightly outside the circle (see arc_segments); full circles and rings are
+generated by KLayout (circle_polygon, annulus_region).
+A centerline is handled as a single (n, 2) NumPy array and every requested offset edge
+is computed in one batched call, instead of creating one pya.DPoint per vertex.
+
+(C) NYUAD 2023
+"""
+
+import numpy as np
+import pya
+
+
+def as_array(pts):
+    '''Return the points of a centerline as an (n, 2) float array.
+
+    Args:
+        pts: list of pya.Point / pya.DPoint, list of (x, y) pairs or an array.
+    '''
+    if isinstance(pts, np.ndarray):
+        return pts.astype(float, copy=False).reshape(-1, 2)
+    pts = list(pts)
+    if pts and hasattr(pts[0], 'x'):
+        return np.array([(pt.x, pt.y) for pt in pts], dtype=float).reshape(-1, 2)
+    return np.array(pts, dtype=float).reshape(-1, 2)
+
+
+def round_coords(arr):
+    '''Round float coordinates to integers the same way pya.DPoint.to_itype(1) does (half away from zero).'''
+    arr = np.asarray(arr, dtype=float)
+    return np.trunc(arr + np.copysign(0.5, arr)).astype(np.int64)
+
+
+def to_points(arr):
+    '''Convert an (n, 2) coordinate array into a list of pya.Point (coordinates rounded to integers).'''
+    return [pya.Point(x, y) for x, y in round_coords(arr).tolist()]
+
+
+def offset_curves(pts, offsets, manhattan=True, miter=False):
+    '''Translate each point of a centerline by its normal, for several distances at once.
+
+    This is the batched equivalent of SiEPIC.utils.translate_from_normal: the normal at
+    the ends follows the first/last segment and the interior normals follow the
+    central difference of the neighbouring points.
+
+    Args:
+        pts: centerline (see as_array), in any length unit.
+        offsets: scalar or sequence of normal distances (same unit as pts); positive is to the left.
+        manhattan: snap the first and last offset points to the axis of the end segments.
+        miter: use the bisector of the adjacent segments for the interior normals and scale
+            it so that the offset edge stays parallel to each segment (sharp corners keep their width).
+
+    Returns:
+        float array of shape (len(offsets), n, 2)
+    '''
+    p = as_array(pts)
+    offs = np.atleast_1d(np.asarray(offsets, dtype=float))
+    n = len(p)
+    if n < 2:
+        return np.repeat(p[None, :, :], len(offs), axis=0)
+
+    t = np.empty_like(p)
+    t[0] = p[1] - p[0]
+    t[-1] = p[-1] - p[-2]
+    if miter:
+        seg = np.diff(p, axis=0)
+        seg_len = np.hypot(seg[:, 0], seg[:, 1])
+        seg_len[seg_len == 0] = 1.0
+        seg /= seg_len[:, None]
+        t[1:-1] = seg[:-1] + seg[1:]
+    else:
+        t[1:-1] = p[2:] - p[:-2]
+
+    t_len = np.hypot(t[:, 0], t[:, 1])
+    t_len[t_len == 0] = 1.0
+    normals = np.column_stack((-t[:, 1], t[:, 0])) / t_len[:, None]
+
+    if miter and n > 2:
+        # 1/cos(half turn angle), limited to avoid spikes on (almost) reversing paths
+        cos_half = normals[1:-1, 0] * -seg[:-1, 1] + normals[1:-1, 1] * seg[:-1, 0]
+        normals[1:-1] /= np.clip(cos_half, 0.1, None)[:, None]
+
+    out = p[None, :, :] + offs[:, None, None] * normals[None, :, :]
+
+    # Make ends manhattan
+    if manhattan:
+        for i in (0, -1):
+            d = np.abs(out[:, i, :] - p[i])
+            horizontal = d[:, 0] > d[:, 1]
+            out[horizontal, i, 1] = p[i, 1]
+            out[~horizontal, i, 0] = p[i, 0]
+    return out
+
+
+def translate_from_normal(pts, trans, manhattan=True):
+    '''Drop-in replacement for SiEPIC.utils.translate_from_normal, returning a list of pya.Point.'''
+    return to_points(offset_curves(pts, trans, manhattan)[0])
+
+
+def waveguide_hulls(pts, widths, offsets=0, manhattan=True, miter=False):
+    '''Outline hulls of several waveguides sharing the same centerline.
+
+    All edges (two per width/offset pair) are generated in a single offset_curves call.
+
+    Returns:
+        list of integer arrays of shape (2n, 2), one per width.
+    '''
+    widths = np.atleast_1d(np.asarray(widths, dtype=float))
+    offsets = np.broadcast_to(np.asarray(offsets, dtype=float), widths.shape)
+    edges = offset_curves(pts, np.concatenate((offsets - widths / 2, offsets + widths / 2)), manhattan, miter)
+    k = len(widths)
+    return [round_coords(np.concatenate((edges[i], edges[k + i][::-1]))) for i in range(k)]
+
+
+def waveguide_polygons(pts, widths, offsets=0, manhattan=True, miter=False):
+    '''Waveguide polygons for several widths/offsets along the same centerline (see waveguide_hulls).'''
+    return [pya.Polygon([pya.Point(x, y) for x, y in hull.tolist()])
+            for hull in waveguide_hulls(pts, widths, offsets, manhattan, miter)]
+
+
+def arc_to_waveguide(pts, width, manhattan=True, offset=0, miter=False):
+    '''Take a list of points and create a polygon of width 'width', optionally with manhattan ends.'''
+    return waveguide_polygons(pts, width, offset, manhattan, miter)[0]
+
+
+def arc_segments(radius, angle, tolerance=0.5):
+    '''Number of chords needed for an arc that stays within tolerance of the circle.
+
+    The vertices are placed slightly outside the circle (see vertex_radius), so that the polygon
+    deviates by the same amount r*tan(h/2)**2 inside (chord middles) and outside (vertices), h being
+    half the angular step. This needs about 1/sqrt(2) of the chords of vertices on the circle.
+
+    Args:
+        radius: arc radius (same unit as tolerance, usually dbu).
+        angle: arc angle in radians.
+        tolerance: maximum deviation from the circle.
+    '''
+    angle = abs(angle)
+    if radius <= tolerance:
+        return max(1, int(np.ceil(angle / (np.pi / 2))))
+    step = 4 * np.arctan(np.sqrt(tolerance / radius))
+    return max(1, int(np.ceil(angle / step - 1e-9)))
+
+
+def vertex_radius(radius, step):
+    '''Radius of the vertices of chords of angular step (radians) that deviate equally inside and outside a circle.'''
+    return 2 * radius / (1 + np.cos(step / 2))
+
+
+def arc_points(radius, theta_start, theta_stop, tolerance=0.5):
+    '''Error-bounded replacement for SiEPIC.utils.arc: integer points of an arc, in dbu.
+
+    Both end points are on the circle (they meet straight waveguides), the others on vertex_radius.
+
+    Args:
+        radius: radius in dbu.
+        theta_start, theta_stop: angles in degrees (both end points are included).
+        tolerance: maximum deviation in dbu, see arc_segments.
+
+    Returns:
+        int64 array of shape (n + 1, 2)
+    '''
+    start, stop = np.radians(theta_start), np.radians(theta_stop)
+    n = arc_segments(radius, stop - start, tolerance)
+    t = np.linspace(start, stop, n + 1)
+    r = np.full(n + 1, vertex_radius(radius, (stop - start) / n))
+    r[0] = r[-1] = radius
+    return round_coords(np.column_stack((r * np.cos(t), r * np.sin(t))))
+
+
+def circle_polygon(radius, tolerance=0.5):
+    '''pya.Polygon of a circle of radius (dbu) around the origin, see arc_segments.
+
+    The points are generated by KLayout (DPolygon.ellipse), not as a Python list.
+    '''
+    n = max(3, arc_segments(radius, 2 * np.pi, tolerance))
+    r = vertex_radius(radius, 2 * np.pi / n)
+    return pya.Polygon(pya.DPolygon.ellipse(pya.DBox(-r, -r, r, r), n))
+
+
+def annulus_region(r_outer, r_inner, tolerance=0.5, theta_start=None, theta_stop=None):
+    '''pya.Region of the ring between two radii (dbu) around the origin, see circle_polygon.
+
+    With theta_start and theta_stop (degrees), only the sector between these angles, cut radially.
+    '''
+    region = pya.Region(circle_polygon(r_outer, tolerance))
+    if r_inner > 0:
+        region -= pya.Region(circle_polygon(r_inner, tolerance))
+    if theta_start is not None:
+        # fan with corners at most 90 degrees apart, so its edges stay outside the ring
+        t = np.radians(np.linspace(theta_start, theta_stop, int(np.ceil(abs(theta_stop - theta_start) / 90)) + 1))
+        fan = np.vstack(((0, 0), round_coords(2 * r_outer * np.column_stack((np.cos(t), np.sin(t))))))
+        region &= pya.Region(pya.Polygon(to_points(fan)))
+    return region
+
+
+def route_corners(pts, radius):
+    '''Corners of a route: direction of the incoming segment, signed turn and available radius.
+
+    The chamfer length (or bend radius) of a corner is limited by the space on its two segments:
+    all of a terminal segment, half of an inner one.
+
+    Args:
+        pts: path points (see as_array), at least 3.
+        radius: requested chamfer length or bend radius, same unit as pts.
+
+    Returns:
+        (start, turn, r) arrays with one entry per corner; angles in radians, left turns positive
+    '''
+    p = as_array(pts)
+    n = len(p)
+    seg = np.diff(p, axis=0)
+    length = np.hypot(seg[:, 0], seg[:, 1])
+    dis1, dis2 = length[:-1], length[1:]
+    start = np.arctan2(seg[:-1, 1], seg[:-1, 0])
+    turn = (np.arctan2(seg[1:, 1], seg[1:, 0]) - start + np.pi) % (2 * np.pi) - np.pi
+
+    r = np.full(n - 2, float(radius))
+    if n == 3:
+        r = np.minimum(np.minimum(dis1, dis2), r)
+    else:
+        first = np.arange(n - 2) == 0
+        last = np.arange(n - 2) == n - 3
+        r = np.where(first, np.where(dis1 <= r, dis1, r), np.where(dis1 < 2 * r, dis1 / 2, r))
+        r = np.where(last, np.where(dis2 <= r, dis2, r), np.where(dis2 < 2 * r, dis2 / 2, r))
+    return start, turn, r
+
+
+def corner_centerline(pts, radius, curved=False, devrec=False):
+    '''Centerline of a routed wire: the corners of a path replaced by 45 degree chamfers or arcs.
+
+    All the corners are handled at once, with the radius limits of route_corners.
+
+    Args:
+        pts: path points (see as_array), in dbu.
+        radius: chamfer length or bend radius, in dbu.
+        curved: circular corners (SiEPIC.utils.arc_xy) instead of chamfers.
+        devrec: coarser arcs, as drawn by SiEPIC on DevRec layers.
+
+    Returns:
+        int64 array of shape (m, 2), without consecutive duplicate points
+    '''
+    p = as_array(pts)
+    if len(p) < 3:
+        return round_coords(p)
+    start, turn, r = route_corners(p, radius)
+
+    if curved:
+        from SiEPIC.utils import arc_xy
+        local = []
+        for ri, ti in zip(r.tolist(), turn.tolist()):
+            arc = as_array(arc_xy(-ri, ri, ri, 270, 270 + np.degrees(abs(ti)), DevRec=devrec))
+            if ti < 0:
+                arc[:, 1] = -arc[:, 1]
+            local.append(arc)
+        counts = [len(a) for a in local]
+        local = np.concatenate(local)
+        corner, angle = np.repeat(p[1:-1], counts, axis=0), np.repeat(start, counts)
+    else:
+        a = turn / 2
+        zero = np.zeros_like(a)
+        local = round_coords(np.stack((np.column_stack((-r * np.cos(a), zero)),
+                                       np.column_stack((zero, r * np.sin(a)))), axis=1)).reshape(-1, 2)
+        corner, angle = np.repeat(p[1:-1], 2, axis=0), np.repeat(start, 2)
+
+    c, s = np.cos(angle), np.sin(angle)
+    rotated = np.column_stack((c * local[:, 0] - s * local[:, 1], s * local[:, 0] + c * local[:, 1]))
+    out = round_coords(np.concatenate((p[:1], corner + rotated, p[-1:])))
+    keep = np.ones(len(out), dtype=bool)
+    keep[1:] = np.any(out[1:] != out[:-1], axis=1)
+    return out[keep]
@@ -0,0 +1,150 @@
+"""
+PRL PDK Tools - Produce instrumentation
+Notice: Information in this file is confidential.
+
+Description:
+Opt-in instrumentation of the PRL_PDK PCells, replacing the print() calls of produce_impl:
+  - per-class produce timers, split by where the geometry came from (memory cache, disk cache, produced),
+  - number of shapes inserted per layer and class,
+  - traces of slow produce calls, one call in sample_every runs under cProfile,
+  - log(): the messages the PCells used to print.
+Disabled by default: log() returns immediately and cached_produce (see pcell_cache) and
+timed_produce (PCells without the geometry cache) only test the enabled flag. Enable it with PRLPDK_INSTRUMENT=1 or enable(), and export the data with
+export('profile.json').
+
+(C) NYUAD 2023
+"""
+
+import functools
+import io
+import json
+import os
+import time
+from collections import deque, OrderedDict
+
+
+enabled = os.environ.get('PRLPDK_INSTRUMENT', '0') == '1'
+verbose = os.environ.get('PRLPDK_INSTRUMENT_VERBOSE', '0') == '1'   # also print the log messages
+slow_threshold_s = 0.05
+sample_every = 20
+
+timers = OrderedDict()   # class -> counters
+shapes = OrderedDict()   # class -> {layer: shapes inserted}
+traces = deque(maxlen = 100)
+messages = deque(maxlen = 1000)
+_calls = 0
+
+
+def enable(on = True, slow_threshold = None, sample = None):
+    '''Switch the instrumentation on or off. slow_threshold: seconds, sample: profile one call in sample (0: never).'''
+    global enabled, slow_threshold_s, sample_every
+    enabled = on
+    if slow_threshold is not None:
+        slow_threshold_s = slow_threshold
+    if sample is not None:
+        sample_every = sample
+
+
+def reset():
+    global _calls
+    timers.clear()
+    shapes.clear()
+    traces.clear()
+    messages.clear()
+    _calls = 0
+
+
+def log(message, *args):
+    '''Record a message (printf style arguments are only formatted when enabled).'''
+    if not enabled:
+        return
+    text = message % args if args else message
+    messages.append((time.time(), text))
+    if verbose:
+        print(text)
+
+
+def _parameters(decl):
+    try:
+        names = [p.name for p in decl.get_parameters()]
+        return {n: str(v) for n, v in zip(names, decl._param_values or [])}
+    except Exception:
+        return {}
+
+
+def _profile_top(profiler, count = 15):
+    import pstats
+    out = io.StringIO()
+    pstats.Stats(profiler, stream = out).sort_stats('cumulative').print_stats(count)
+    return out.getvalue()
+
+
+def produce(decl, fn):
+    '''Run fn(decl), a produce returning 'memory', 'disk' or 'produced', and record it.'''
+    global _calls
+    _calls += 1
+    name = type(decl).__name__
+    profiler = None
+    if sample_every and _calls % sample_every == 0:
+        import cProfile
+        profiler = cProfile.Profile()
+    t0 = time.perf_counter()
+    if profiler is not None:
+        source = profiler.runcall(fn, decl)
+    else:
+        source = fn(decl)
+    dt = time.perf_counter() - t0
+
+    t = timers.get(name)
+    if t is None:
+        t = timers[name] = {'calls': 0, 'memory': 0, 'disk': 0, 'produced': 0, 'total_s': 0.0, 'max_s': 0.0}
+    t['calls'] += 1
+    t[source] += 1
+    t['total_s'] += dt
+    t['max_s'] = max(t['max_s'], dt)
+
+    layout, cell = decl.layout, decl.cell
+    counts = shapes.setdefault(name, {})
+    for li in layout.layer_indexes():
+        n = cell.shapes(li).size()
+        if n:
+            layer = str(layout.get_info(li))
+            counts[layer] = counts.get(layer, 0) + n
+
+    if dt >= slow_threshold_s:
+        trace = {'class': name, 'seconds': dt, 'source': source, 'parameters': _parameters(decl)}
+        if profiler is not None:
+            trace['profile'] = _profile_top(profiler)
+        traces.append(trace)
+    return source
+
+
+def report():
+    '''All the recorded data, as a JSON serializable dict.'''
+    classes = OrderedDict()
+    for name, t in timers.items():
+        classes[name] = dict(t, mean_ms = t['total_s']/t['calls']*1e3 if t['calls'] else 0.0,
+                             shapes = shapes.get(name, {}))
+    return {'enabled': enabled, 'slow_threshold_s': slow_threshold_s, 'sample_every': sample_every,
+            'classes': classes, 'slow_calls': list(traces), 'messages': [m for t, m in messages]}
+
+
+def export(path):
+    '''Write report() as JSON.'''
+    with open(path, 'w') as f:
+        json.dump(report(), f, indent = 1)
+
+
+def timed_produce(produce_impl):
+    '''Decorator for the produce_impl of PCells without the geometry cache: same timers as cached_produce.'''
+    def run(decl):
+        produce_impl(decl)
+        return 'produced'
+
+    @functools.wraps(produce_impl)
+    def wrapper(self):
+        if enabled:
+            produce(self, run)
+        else:
+            produce_impl(self)
+    return wrapper
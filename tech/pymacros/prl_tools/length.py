@@ -0,0 +1,122 @@
+"""
+PRL PDK Tools - Waveguide length engine
+Notice: Information in this file is confidential.
+
+Description:
+Analytic centerline lengths for the compact-model (Spice_param) length of the PCells:
+  - route_length: straight segments with chamfered, circular or bezier corners (Wireguide, Waveguide),
+    all the corners of a route handled in one vectorized pass,
+  - arc_length: circular arcs (Ring, Bend),
+  - archimedean_length / spiral_centerline_length: Archimedean spirals (Spiral).
+The lengths are those of the ideal curves, not of their discretization, and do not require
+drawing (or dividing the area of) any polygon.
+
+Usage:
+  from prl_tools.length import route_length
+  length = route_length(path.get_points(), to_itype(radius, dbu), 'arc')*dbu
+
+(C) NYUAD 2023
+"""
+
+from math import pi, sqrt, log
+
+import numpy as np
+
+from .geometry import as_array, route_corners
+
+
+# Gauss-Legendre nodes and weights on [0, 1], for the bezier corners
+_GL_NODES, _GL_WEIGHTS = np.polynomial.legendre.leggauss(32)
+_GL_NODES = (_GL_NODES + 1) / 2
+_GL_WEIGHTS = _GL_WEIGHTS / 2
+
+
+def arc_length(radius, angle):
+    '''Length of a circular arc, angle in degrees.'''
+    return abs(radius * angle) * pi / 180
+
+
+def _archimedean_primitive(a, rho):
+    s = sqrt(rho * rho + a * a)
+    return (rho * s + a * a * log(rho + s)) / (2 * a)
+
+
+def archimedean_length(a, r, t0, t1):
+    '''Length of the Archimedean spiral rho = a*t + r between the angles t0 and t1 (radians).'''
+    if a == 0:
+        return abs(r * (t1 - t0))
+    return abs(_archimedean_primitive(a, a * t1 + r) - _archimedean_primitive(a, a * t0 + r))
+
+
+def spiral_centerline_length(radius, spacing, N, spiral_ports = False):
+    '''Length of the spiral drawn by spiral.spiral_centerline (inner spiral, S-section, outer spiral).'''
+    a = spacing / pi
+    r = 2 * radius
+    inner = archimedean_length(a, r, 0, 2 * pi * N)
+    s_section = 2 * pi * radius
+    outer = archimedean_length(a, r + spacing, -pi, -pi + 2 * pi * N + (pi if spiral_ports else 0))
+    return inner + s_section + outer
+
+
+def bezier_corner_length(bezier):
+    '''Length of the 90 degree bezier corner of SiEPIC.utils.arc_bezier, for a unit radius.'''
+    b = float(bezier)
+    xp = np.array([0, 1 - b, 1, 1])
+    yp = np.array([0, 0, b, 1])
+    t = _GL_NODES
+    # derivative of the cubic bezier curve
+    basis = np.stack((3 * (1 - t) ** 2, 6 * (1 - t) * t, 3 * t ** 2))
+    dx = basis.T.dot(np.diff(xp))
+    dy = basis.T.dot(np.diff(yp))
+    return float(np.dot(_GL_WEIGHTS, np.hypot(dx, dy)))
+
+
+def route_length(pts, radius, corners = 'chamfer', bezier = 0.2, right_angles_only = False):
+    '''Centerline length of a route whose corners are rounded as in the Wireguide and Waveguide PCells.
+
+    Args:
+        pts: path points (see geometry.as_array).
+        radius: chamfer length or bend radius, same unit as pts (limited per corner, see geometry.route_corners).
+        corners: 'chamfer' (45 degree cut, Wireguide), 'arc' (SiEPIC.utils.arc_xy) or 'bezier'
+            (SiEPIC.utils.arc_bezier, 90 degree corners only).
+        bezier: bezier parameter of the 'bezier' corners.
+        right_angles_only: only 90 degree corners are rounded, others stay sharp (SiEPIC waveguides).
+
+    Returns:
+        length, in the unit of pts
+    '''
+    p = as_array(pts)
+    if len(p) < 3:
+        return float(np.hypot(*np.diff(p, axis=0).T).sum()) if len(p) == 2 else 0.0
+    start, turn, r = route_corners(p, radius)
+    theta = np.abs(turn)
+    if corners == 'bezier' or right_angles_only:
+        r = np.where(np.isclose(theta, pi / 2), r, 0.0)
+
+    # corner start and end points in the frame of the incoming segment (x along it, y to the left)
+    if corners == 'chamfer':
+        h = turn / 2
+        local_start = np.column_stack((-r * np.cos(h), np.zeros_like(r)))
+        local_end = np.column_stack((np.zeros_like(r), r * np.sin(h)))
+        curve = r.copy()
+    elif corners == 'arc':
+        local_start = np.column_stack((-r, np.zeros_like(r)))
+        local_end = np.column_stack((-r + r * np.sin(theta), np.sign(turn) * (r - r * np.cos(theta))))
+        curve = r * theta
+    elif corners == 'bezier':
+        local_start = np.column_stack((-r, np.zeros_like(r)))
+        local_end = np.column_stack((np.zeros_like(r), np.sign(turn) * r))
+        curve = r * bezier_corner_length(bezier)
+    else:
+        raise ValueError('unknown corner type %s' % corners)
+
+    c, s = np.cos(start), np.sin(start)
+    def to_global(local):
+        return p[1:-1] + np.column_stack((c * local[:, 0] - s * local[:, 1], s * local[:, 0] + c * local[:, 1]))
+    corner_start, corner_end = to_global(local_start), to_global(local_end)
+
+    # straight parts: from each end of a corner to the start of the next one
+    ends = np.concatenate((p[:1], corner_end))
+    starts = np.concatenate((corner_start, p[-1:]))
+    straight = np.hypot(*(starts - ends).T).sum()
+    return float(straight + curve.sum())
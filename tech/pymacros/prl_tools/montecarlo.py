@@ -0,0 +1,448 @@
+"""
+PRL PDK Tools - Monte Carlo variability
+Notice: Information in this file is confidential.
+
+Description:
+Fabrication variability of a layout, from the processes of MONTECARLO.xml:
+  - processes: width/height standard deviations (nm) and correlation lengths (m) within a wafer,
+    and the wafer-to-wafer standard deviations, per fabrication process,
+  - sites(cell): the PCell instances of a layout with a compact model and their positions,
+  - Sampler: width and height deviations at the sites, spatially correlated within the wafer
+    (Gaussian correlation, Cholesky factor of the covariance of the sites) plus a wafer offset,
+  - run: trials in chunks (bounded memory), on several threads; each block of BLOCK trials has its
+    own random stream, so that the samples do not depend on the chunking or the number of threads,
+  - Statistics: streamed mean, std, min, max, samples (optional) and yield against limits,
+  - ring_evaluator: perturbed effective/group index and gaps of the Rings through ring_model,
+  - waveguide_evaluator: phase and delay deviations of the Waveguide, Spiral, Bend, SBend and
+    Taper instances, from the perturbed indexes over their circuit.MODELS length.
+
+Usage:
+  from prl_tools import montecarlo
+  s = montecarlo.sites(cell)
+  stats = montecarlo.run(s, montecarlo.ring_evaluator(s), trials = 10000, seed = 1,
+                         limits = {'resonance_shift': (-1e-9, 1e-9)})
+  print(stats.yield_, stats.std['resonance_shift'])
+  python -m prl_tools.montecarlo layout.gds --trials 10000 --limit resonance_shift=-1e-9:1e-9
+  python -m prl_tools.montecarlo layout.gds --evaluator waveguide --limit phase_shift=-0.5:0.5
+
+(C) NYUAD 2023
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .circuit import C0, MODELS, WL0, WAVEGUIDE
+
+
+QUANTITIES = ('width', 'height')
+
+# effective and group index change per nm of waveguide width and height. Typical values of the
+# 1 um PDK waveguide; replace them with the derivatives of a mode solver for other cross-sections.
+SENSITIVITY = {'ne': {'width': 4.0e-4, 'height': 1.5e-3},
+               'ng': {'width': -2.0e-4, 'height': 5.0e-4}}
+
+RING_GAP = 0.3   # um, gap of the Ring PCell (default), for rings without PCell parameters
+
+# kinds of the sites whose circuit.MODELS model is a waveguide (waveguide_evaluator)
+WAVEGUIDE_KINDS = ('Waveguide', 'Spiral', 'Bend', 'SBend', 'Taper')
+
+_SAMPLES_PER_CHUNK = 1000000   # site x trial values of one chunk, by default
+
+BLOCK = 100   # trials per random stream; the chunks are whole blocks
+
+
+def montecarlo_file(technology_name = 'PRL_PDK'):
+    '''MONTECARLO.xml of the technology folder, or of the tech folder of this PDK when it has none.'''
+    try:
+        import pya
+        tech = pya.Technology.technology_by_name(technology_name) if pya.Technology.has_technology(technology_name) else None
+        if tech is not None and tech.base_path() and os.path.isfile(os.path.join(tech.base_path(), 'MONTECARLO.xml')):
+            return os.path.join(tech.base_path(), 'MONTECARLO.xml')
+    except ImportError:
+        pass
+    return os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'MONTECARLO.xml'))
+
+
+def processes(path = None):
+    '''OrderedDict process name -> {'width': (std_dev nm, corr_length m), 'height': (...),
+    'wafer_to_wafer': {'width': std_dev nm, 'height': std_dev nm}} of a MONTECARLO.xml file.
+
+    The wafer-to-wafer thickness of the file is the height.
+    '''
+    root = ET.parse(path or montecarlo_file()).getroot()
+    result = OrderedDict()
+    for tech in root.iter('technology'):
+        process = OrderedDict()
+        for key in QUANTITIES:
+            process[key] = (float(tech.findtext('wafer/%s/std_dev' % key)),
+                            float(tech.findtext('wafer/%s/corr_length' % key)))
+        process['wafer_to_wafer'] = {'width': float(tech.findtext('wafer_to_wafer/width/std_dev') or 0),
+                                     'height': float(tech.findtext('wafer_to_wafer/thickness/std_dev') or 0)}
+        result[tech.findtext('name').strip()] = process
+    return result
+
+
+def process_by_name(name = None, path = None):
+    '''One process of MONTECARLO.xml, by name or index (default: the first one), and its name.'''
+    table = processes(path)
+    names = list(table)
+    if name is None:
+        name = names[0]
+    elif name not in table:
+        try:
+            name = names[int(name)]
+        except (ValueError, IndexError):
+            raise ValueError('process %s not in %s' % (name, ', '.join(names)))
+    return name, table[name]
+
+
+def sites(cell, kinds = None, technology_name = 'PRL_PDK'):
+    '''Instances of the cells with a compact model below cell (hierarchically), in placement order.
+
+    List of dicts: name (<kind>_<n>), kind (PCell name), position (center, m), params (PCell
+    parameters, empty for static cells) and spice (Spice_param label values, SI).
+    '''
+    from .circuit import spice_value
+    kinds = set(MODELS if kinds is None else kinds)
+    ly = cell.layout()
+    devrec = []
+    labels = {}   # cell index -> label values
+    result = []
+    counts = {}
+
+    def label_values(child):
+        if child.cell_index() in labels:
+            return labels[child.cell_index()]
+        if not devrec:
+            from .tech import technology, layer_index
+            devrec.append(layer_index(ly, technology(technology_name)['DevRec']))
+        from . import spice
+        values = {key: spice_value(value) for key, value in spice.params(child, devrec[0]).items()}
+        labels[child.cell_index()] = {k: v for k, v in values.items() if v is not None}
+        return labels[child.cell_index()]
+
+    def visit(parent, trans):
+        for inst in parent.each_inst():
+            child = ly.cell(inst.cell_index)
+            kind = re.sub(r'\$\d+$', '', child.basic_name())
+            for t in inst.cell_inst.each_cplx_trans():
+                if kind not in kinds:
+                    visit(child, trans * t)
+                    continue
+                counts[kind] = counts.get(kind, 0) + 1
+                center = (trans * t * child.bbox()).center()
+                variant = child.is_pcell_variant()
+                result.append({'name': '%s_%d' % (kind, counts[kind]), 'kind': kind,
+                               'position': (center.x * ly.dbu * 1e-6, center.y * ly.dbu * 1e-6),
+                               'params': child.pcell_parameters_by_name() if variant else {},
+                               'spice': label_values(child)})
+
+    import pya
+    visit(cell, pya.ICplxTrans())
+    return result
+
+
+def correlation_factor(positions, std_dev, corr_length):
+    '''F (N, N) with F F^T = std_dev^2 exp(-d^2 / (2 corr_length^2)), d the distances of the positions.'''
+    p = np.asarray(positions, dtype = float).reshape(-1, 2)
+    d2 = np.maximum((p ** 2).sum(1)[:, None] + (p ** 2).sum(1)[None, :] - 2 * p.dot(p.T), 0)
+    k = std_dev ** 2 * np.exp(-d2 / (2 * corr_length ** 2))
+    try:
+        # sites much closer than the correlation length make k nearly singular
+        return np.linalg.cholesky(k + np.eye(len(p)) * std_dev ** 2 * 1e-10)
+    except np.linalg.LinAlgError:
+        w, v = np.linalg.eigh(k)
+        return v * np.sqrt(np.maximum(w, 0))
+
+
+class Sampler(object):
+    '''Width and height deviations (nm) at the positions (m) for a process of MONTECARLO.xml.'''
+
+    def __init__(self, positions, process, wafer_to_wafer = True):
+        p = np.round(np.asarray(positions, dtype = float).reshape(-1, 2) * 1e9)   # coincident sites (1 nm)
+        unique, self._index = np.unique(p, axis = 0, return_inverse = True)
+        self._index = self._index.ravel()
+        self.factors = OrderedDict((key, correlation_factor(unique * 1e-9, *process[key])) for key in QUANTITIES)
+        self.wafer_to_wafer = {key: process['wafer_to_wafer'][key] if wafer_to_wafer else 0.0 for key in QUANTITIES}
+
+    def sample(self, rng, trials):
+        '''OrderedDict width, height -> (sites, trials) deviations in nm.'''
+        fields = OrderedDict()
+        for key, factor in self.factors.items():
+            field = factor.dot(rng.standard_normal((factor.shape[1], trials)))
+            field += self.wafer_to_wafer[key] * rng.standard_normal(trials)
+            fields[key] = field[self._index]
+        return fields
+
+
+class Statistics(object):
+    '''Statistics of the figures of an evaluator, per site, streamed over chunks of trials.
+
+    limits: {figure: (low, high)}; a trial passes when all the limited figures of all the sites
+    are within their limits (NaN fails). With keep, the samples are kept for percentile().
+    '''
+
+    def __init__(self, limits = None, keep = False):
+        self.limits = dict(limits or {})
+        self.keep = keep
+        self.trials = 0
+        self.passed = 0
+        self.mean, self._m2, self.min, self.max = OrderedDict(), OrderedDict(), OrderedDict(), OrderedDict()
+        self.site_passed = OrderedDict()
+        self._samples = OrderedDict()
+
+    def add(self, figures):
+        '''Add a chunk: {figure: array (..., trials)}.'''
+        n = None
+        ok = None
+        for key, x in figures.items():
+            x = np.asarray(x, dtype = float)
+            n = x.shape[-1]
+            mean = x.mean(-1)
+            m2 = ((x - mean[..., None]) ** 2).sum(-1)
+            if key not in self.mean:
+                self.mean[key], self._m2[key], self.min[key], self.max[key] = mean, m2, x.min(-1), x.max(-1)
+            else:
+                # parallel update of the mean and the sum of squared deviations (Chan et al.)
+                total = self.trials + n
+                delta = mean - self.mean[key]
+                self.mean[key] = self.mean[key] + delta * n / total
+                self._m2[key] = self._m2[key] + m2 + delta ** 2 * self.trials * n / total
+                self.min[key] = np.minimum(self.min[key], x.min(-1))
+                self.max[key] = np.maximum(self.max[key], x.max(-1))
+            if key in self.limits:
+                low, high = self.limits[key]
+                within = (x >= low) & (x <= high)
+                self.site_passed[key] = self.site_passed.get(key, 0) + within.sum(-1)
+                within = within.reshape(-1, n).all(0)
+                ok = within if ok is None else ok & within
+            if self.keep:
+                self._samples.setdefault(key, []).append(x)
+        if n is None:
+            return
+        self.trials += n
+        self.passed += n if ok is None else int(ok.sum())
+
+    @property
+    def std(self):
+        return OrderedDict((key, np.sqrt(m2 / max(self.trials - 1, 1))) for key, m2 in self._m2.items())
+
+    @property
+    def yield_(self):
+        '''Fraction of the trials within all the limits.'''
+        return self.passed / float(self.trials) if self.trials else float('nan')
+
+    @property
+    def site_yield(self):
+        '''{figure: fraction of the trials within the limits, per site}.'''
+        return OrderedDict((key, passed / float(self.trials)) for key, passed in self.site_passed.items())
+
+    def samples(self, key):
+        if not self.keep:
+            raise ValueError('samples are kept with Statistics(keep = True)')
+        return np.concatenate(self._samples[key], axis = -1)
+
+    def percentile(self, key, q):
+        return np.percentile(self.samples(key), q, axis = -1)
+
+
+def run(sites, evaluate, trials = 1000, process = None, seed = None, chunk = None, threads = None,
+        limits = None, keep = False, wafer_to_wafer = True, path = None, log = None):
+    '''Monte Carlo trials of the figures of evaluate over the sites.
+
+    Args:
+        sites: list of dicts with a position (m), see sites()
+        evaluate: function(width, height) of the deviations (sites, n) in nm -> {figure: (..., n)}
+        process: name or index of the MONTECARLO.xml process (default: the first), or a process dict
+        chunk: trials per chunk, rounded up to whole BLOCKs (default: about 1M site-trial values)
+        threads: default os.cpu_count()
+        limits, keep: see Statistics
+    Returns:
+        Statistics
+    '''
+    if not isinstance(process, dict):
+        name, process = process_by_name(process, path)
+        if log:
+            log('process: %s' % name)
+    t = time.perf_counter()
+    sampler = Sampler([s['position'] for s in sites], process, wafer_to_wafer)
+    chunk = chunk or max(1, min(trials, _SAMPLES_PER_CHUNK // max(len(sites), 1)))
+    chunk = -(-chunk // BLOCK) * BLOCK
+    starts = list(range(0, trials, chunk))
+    streams = np.random.SeedSequence(seed).spawn(-(-trials // BLOCK))
+    if log:
+        log('%d sites, %d trials in %d chunks, correlation: %.2f s' % (len(sites), trials, len(starts), time.perf_counter() - t))
+
+    def work(start):
+        blocks = [sampler.sample(np.random.default_rng(streams[b // BLOCK]), min(BLOCK, trials - b))
+                  for b in range(start, min(start + chunk, trials), BLOCK)]
+        fields = {key: np.concatenate([f[key] for f in blocks], axis = 1) for key in QUANTITIES}
+        return evaluate(fields['width'], fields['height'])
+
+    stats = Statistics(limits, keep)
+    threads = threads or os.cpu_count() or 1
+    with ThreadPoolExecutor(threads) as pool:
+        # a window of chunks in flight bounds the memory, results are added in chunk order
+        pending = []
+        for start in starts:
+            pending.append(pool.submit(work, start))
+            if len(pending) >= 2 * threads:
+                stats.add(pending.pop(0).result())
+        for future in pending:
+            stats.add(future.result())
+    if log:
+        log('trials: %.2f s' % (time.perf_counter() - t))
+    return stats
+
+
+def ring_evaluator(sites, wavelength = WL0, sensitivity = None):
+    '''Evaluator (see run) of the Rings of the sites with ring_model.metrics.
+
+    The width deviation changes the effective and group indexes (see SENSITIVITY) and closes the
+    gaps (both waveguide edges move), the height deviation changes the indexes. Figures, per Ring
+    (names in the sites attribute): resonance, resonance_shift (from the nominal resonance closest
+    to wavelength), fsr, q, extinction and drop_max.
+    '''
+    from .ring_model import metrics
+    sensitivity = SENSITIVITY if sensitivity is None else sensitivity
+    index = [i for i, s in enumerate(sites) if s['kind'] == 'Ring']
+
+    def value(site, key, label, default):
+        if key in site['params']:
+            return site['params'][key]
+        return site['spice'].get(label, default)
+
+    rings = [sites[i] for i in index]
+
+    def column(values):
+        return np.array(values, dtype = float)[:, None]
+
+    radius = column([s['params']['radius'] * 1e-6 if 'radius' in s['params'] else
+                     s['spice'].get('length', 0) / (2 * np.pi) for s in rings])
+    gap = column([s['params'].get('gap', RING_GAP) * 1e-6 for s in rings])
+    # all-pass rings: no drop coupling
+    gap_drop = column([s['params'].get('gap_drop', RING_GAP) * 1e-6 if s['params'].get('use_drop', True) else np.inf
+                       for s in rings])
+    model = {'ne': column([value(s, 'ne', 'effective index', WAVEGUIDE['ne']) for s in rings]),
+             'ng': column([value(s, 'ng', 'group index', WAVEGUIDE['ng']) for s in rings]),
+             'loss': column([value(s, 'loss', 'loss', WAVEGUIDE['loss']) for s in rings]),
+             'dispersion': column([value(s, 'dn', 'dispersion', WAVEGUIDE['dispersion']) for s in rings])}
+    nominal = metrics(radius, gap, gap_drop, wavelength, **model)['resonance']
+
+    def evaluate(width, height):
+        w, h = width[index], height[index]
+        perturbed = dict(model)
+        for key in ('ne', 'ng'):
+            perturbed[key] = model[key] + sensitivity[key]['width'] * w + sensitivity[key]['height'] * h
+        m = metrics(radius, np.maximum(gap - w * 1e-9, 0), np.maximum(gap_drop - w * 1e-9, 0), nominal, **perturbed)
+        return OrderedDict([('resonance', m['resonance']), ('resonance_shift', m['resonance'] - nominal),
+                            ('fsr', m['fsr']), ('q', m['q']), ('extinction', m['extinction']),
+                            ('drop_max', m['drop_max'])])
+
+    evaluate.sites = [s['name'] for s in rings]
+    return evaluate
+
+
+def waveguide_evaluator(sites, wavelength = WL0, sensitivity = None):
+    '''Evaluator (see run) of the waveguide-type sites (WAVEGUIDE_KINDS) of the sites.
+
+    The width and height deviations change the effective and group indexes (see SENSITIVITY)
+    over the length of the circuit.MODELS waveguide of the site. Figures, per waveguide (names in
+    the sites attribute): phase_shift (rad, at wavelength) and delay_shift (s), from the nominal ones.
+    The sites whose length is unknown (static cells without the label or PCell parameter the model
+    needs) are listed in the skipped attribute.
+    '''
+    sensitivity = SENSITIVITY if sensitivity is None else sensitivity
+    index = []
+    lengths = []
+    skipped = []
+    for i, site in enumerate(sites):
+        if site['kind'] not in WAVEGUIDE_KINDS:
+            continue
+        try:
+            lengths.append(MODELS[site['kind']](site['spice'], site['params']).length)
+        except KeyError:
+            skipped.append(site['name'])
+            continue
+        index.append(i)
+    length = np.array(lengths, dtype = float).reshape(-1, 1)
+
+    def evaluate(width, height):
+        w, h = width[index], height[index]
+        dn = {key: sensitivity[key]['width'] * w + sensitivity[key]['height'] * h for key in ('ne', 'ng')}
+        return OrderedDict([('phase_shift', 2 * np.pi * dn['ne'] * length / wavelength),
+                            ('delay_shift', dn['ng'] * length / C0)])
+
+    evaluate.sites = [sites[i]['name'] for i in index]
+    evaluate.skipped = skipped
+    return evaluate
+
+
+# --evaluator: (function, what the sites are called in the report)
+EVALUATORS = OrderedDict([('ring', (ring_evaluator, 'rings')), ('waveguide', (waveguide_evaluator, 'waveguides'))])
+
+
+def _limit(text):
+    '''figure=low:high'''
+    key, values = text.split('=')
+    low, high = values.split(':')
+    return key, (float(low) if low else -np.inf, float(high) if high else np.inf)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Monte Carlo variability of the Rings, or of the waveguides '
+                                                   '(Waveguide, Spiral, Bend, SBend, Taper), of a layout (MONTECARLO.xml).')
+    parser.add_argument('layout', help = 'input layout (.gds, .oas)')
+    parser.add_argument('--cell', help = 'cell (default: the top cell)')
+    parser.add_argument('--process', help = 'process name or index in MONTECARLO.xml (default: the first)')
+    parser.add_argument('--xml', help = 'MONTECARLO.xml file (default: the one of the technology)')
+    parser.add_argument('--trials', type = int, default = 10000)
+    parser.add_argument('--chunk', type = int, help = 'trials per chunk')
+    parser.add_argument('--threads', type = int, default = os.cpu_count())
+    parser.add_argument('--seed', type = int)
+    parser.add_argument('--evaluator', choices = list(EVALUATORS), default = 'ring',
+                        help = 'ring: resonance, fsr, q... of the Rings; waveguide: phase and delay of the waveguides')
+    parser.add_argument('--wavelength', type = float, default = WL0 * 1e6, help = 'target wavelength (um)')
+    parser.add_argument('--no-wafer-to-wafer', action = 'store_true', help = 'within-wafer variations only')
+    parser.add_argument('--limit', action = 'append', type = _limit, default = [],
+                        help = 'figure=low:high (SI units), e.g. resonance_shift=-1e-9:1e-9')
+    args = parser.parse_args(argv)
+
+    import pya
+    from .tech import register_technology
+    register_technology()   # the DevRec layer of the Spice_param labels, outside KLayout
+    ly = pya.Layout()
+    ly.read(args.layout)
+    cell = ly.cell(args.cell) if args.cell else ly.top_cell()
+    if cell is None:
+        raise ValueError('cell %s not found' % args.cell)
+    found = sites(cell)
+    evaluator, what = EVALUATORS[args.evaluator]
+    evaluate = evaluator(found, args.wavelength * 1e-6)
+    if getattr(evaluate, 'skipped', None):
+        print('skipped (length unknown): %s' % ', '.join(evaluate.skipped))
+    if not evaluate.sites:
+        print('no %s in %s' % (what, cell.name))
+        return 1
+    stats = run(found, evaluate, args.trials, args.process, args.seed, args.chunk, args.threads,
+                dict(args.limit), wafer_to_wafer = not args.no_wafer_to_wafer, path = args.xml, log = print)
+    print('%d %s, %d trials' % (len(evaluate.sites), what, stats.trials))
+    print('%-16s %12s %12s %12s %12s' % ('figure', 'mean', 'std', 'min', 'max'))
+    for key in stats.mean:
+        print('%-16s %12.5g %12.5g %12.5g %12.5g' % (key, stats.mean[key].mean(), stats.std[key].mean(),
+                                                     stats.min[key].min(), stats.max[key].max()))
+    if args.limit:
+        print('yield: %.2f%%' % (100 * stats.yield_))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
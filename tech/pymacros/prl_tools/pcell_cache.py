@@ -0,0 +1,303 @@
+"""
+PRL PDK Tools - PCell geometry cache
+Notice: Information in this file is confidential.
+
+Description:
+Content-addressed, in-memory cache of produced PCell geometry shared by all pcells_beta cells.
+A produced cell is identified by a hash of (class, parameter values, dbu, technology, arc
+tolerance, module source hash, source hash of the prl_tools modules that build the geometry). On a hit the cached shapes (and child cell instances) are
+copied into the new cell instead of running produce_impl again. The cache is bounded and
+evicts the least recently used entry.
+An optional persistent second level (see disk_cache, off by default) keeps the results between sessions.
+shared_cell() builds sub-cells that several variants of a PCell instance instead of copying;
+the ones no variant uses any more are deleted after each produce (prune_shared_cells).
+
+Usage, in a PCell declaration:
+  from prl_tools.pcell_cache import cached_produce
+
+  @cached_produce
+  def produce_impl(self):
+    ...
+
+  from prl_tools.pcell_cache import geometry_cache, configure_disk_cache
+  configure_disk_cache()   # enable the persistent cache, see disk_cache.DiskCache
+  print(geometry_cache.stats())
+
+(C) NYUAD 2023
+"""
+
+import functools
+import hashlib
+import inspect
+import os
+from collections import OrderedDict
+
+import pya
+
+from . import instrument
+from .tech import arc_tolerance, layout_technology
+
+
+_source_hashes = {}
+
+# cell property marking the cells built by shared_cell
+SHARED_PROPERTY = 'prl_shared'
+
+# prl_tools modules the PCells build their geometry and labels with
+GEOMETRY_MODULES = ('geometry.py', 'spiral.py', 'length.py', 'spice.py', 'tech.py')
+
+def source_hash(path):
+    '''SHA1 of a source file, cached until its modification time changes.'''
+    try:
+        mtime = os.path.getmtime(path)
+    except (OSError, TypeError):
+        return ''
+    cached = _source_hashes.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    _source_hashes[path] = (mtime, digest)
+    return digest
+
+
+def _canonical(value):
+    '''Stable text representation of a PCell parameter value.'''
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        return '[' + ','.join(_canonical(v) for v in value) + ']'
+    return str(value)
+
+
+def helpers_hash():
+    '''Combined source hash of the GEOMETRY_MODULES.'''
+    folder = os.path.dirname(os.path.realpath(__file__))
+    digests = ''.join(source_hash(os.path.join(folder, name)) for name in GEOMETRY_MODULES)
+    return hashlib.sha1(digests.encode()).hexdigest()
+
+
+def _tag(name, digest):
+    return '%s-%s' % (name, hashlib.sha1((digest + helpers_hash()).encode()).hexdigest()[:12])
+
+
+def pcell_tag(cls):
+    '''Class name and hash of the sources of a PCell declaration class and of the GEOMETRY_MODULES,
+    e.g. 'Ring-3f2a9c01d2e4'.'''
+    try:
+        digest = source_hash(inspect.getsourcefile(cls))
+    except TypeError:
+        digest = ''
+    return _tag(cls.__name__, digest)
+
+
+def pcell_key(decl):
+    '''Content hash of the cell being produced by a PCellDeclarationHelper.
+
+    Must be called while the declaration is producing (layout and parameter values are set).
+    '''
+    cls = type(decl)
+    names = [p.name for p in decl.get_parameters()]
+    values = decl._param_values or []
+    h = hashlib.sha1()
+    h.update(('%s.%s' % (cls.__module__, cls.__name__)).encode())
+    for name, value in zip(names, values):
+        h.update(('\0%s=%s' % (name, _canonical(value))).encode())
+    tech = decl.layout.technology_name
+    h.update(('\0dbu=%r\0tech=%s\0arc=%r' % (decl.layout.dbu, tech, arc_tolerance(tech))).encode())
+    try:
+        h.update(source_hash(inspect.getsourcefile(cls)).encode())
+    except TypeError:
+        pass
+    h.update(helpers_hash().encode())
+    return h.hexdigest()
+
+
+def copy_cell(src, dst):
+    '''Copy shapes and instances of src into dst.
+
+    Child cells are looked up by name in the layout of dst and are only copied when they
+    do not exist there yet, so cells shared between PCell variants stay shared.
+    '''
+    dst.copy_shapes(src)
+    src_ly = src.layout()
+    dst_ly = dst.layout()
+    for inst in src.each_inst():
+        child = src_ly.cell(inst.cell_index)
+        target = dst_ly.cell(child.name)
+        if target is None:
+            target = dst_ly.create_cell(child.name)
+            if child.property(SHARED_PROPERTY) is not None:
+                target.set_property(SHARED_PROPERTY, child.property(SHARED_PROPERTY))
+            copy_cell(child, target)
+        cell_inst = inst.cell_inst.dup()
+        cell_inst.cell_index = target.cell_index()
+        dst.insert(cell_inst)
+
+
+def shared_cell(layout, name, key, build):
+    '''Child cell shared by all the PCell variants of a layout.
+
+    The cell is named name + a short hash of key, and only built (build(cell)) if the layout
+    does not hold it yet. key must cover everything the geometry depends on besides name,
+    e.g. layers, arc tolerance and pcell_tag of the calling class.
+    '''
+    digest = hashlib.sha1(_canonical([name] + list(key)).encode()).hexdigest()[:6]
+    full_name = '%s_%s' % (name.replace('.', 'p').replace('-', 'm'), digest)
+    cell = layout.cell(full_name)
+    if cell is None:
+        cell = layout.create_cell(full_name)
+        cell.set_property(SHARED_PROPERTY, name)
+        build(cell)
+    return cell
+
+
+def prune_shared_cells(layout):
+    '''Delete the cells built by shared_cell that are no longer instanced.
+
+    When KLayout drops a PCell variant (its parameters changed, or its last instance was
+    deleted) the shared cells it used stay behind as top cells. Returns the number of
+    deleted cells.
+    '''
+    deleted = 0
+    while True:
+        orphans = [index for index in layout.each_top_cell()
+                   if layout.cell(index).property(SHARED_PROPERTY) is not None]
+        if not orphans:
+            return deleted
+        layout.delete_cells(orphans)
+        deleted += len(orphans)
+
+
+class GeometryCache(object):
+    '''Bounded LRU cache of produced PCell geometry, keyed by pcell_key.'''
+
+    def __init__(self, max_entries = 512):
+        self.max_entries = max_entries
+        self.enabled = os.environ.get('PRLPDK_PCELL_CACHE', '1') != '0'
+        self.clear()
+
+    def clear(self):
+        '''Drop all cached geometry and reset the counters.'''
+        self._layouts = {}   # one storage layout per dbu
+        self._entries = OrderedDict()   # key -> (dbu, cell index)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _storage(self, dbu):
+        ly = self._layouts.get(dbu)
+        if ly is None:
+            ly = pya.Layout()
+            ly.dbu = dbu
+            self._layouts[dbu] = ly
+        return ly
+
+    def restore(self, key, cell):
+        '''Copy the cached geometry for key into cell. Returns False on a miss.'''
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return False
+        self._entries.move_to_end(key)
+        self.hits += 1
+        dbu, cell_index = entry
+        copy_cell(self._layouts[dbu].cell(cell_index), cell)
+        return True
+
+    def store(self, key, cell):
+        '''Store a copy of the geometry of cell under key.'''
+        if key in self._entries or self.max_entries <= 0:
+            return
+        dbu = cell.layout().dbu
+        ly = self._storage(dbu)
+        stored = ly.create_cell('%s_%s' % (cell.name, key[:12]))
+        copy_cell(cell, stored)
+        self._entries[key] = (dbu, stored.cell_index())
+        while len(self._entries) > self.max_entries:
+            old_key, (old_dbu, old_index) = self._entries.popitem(last = False)
+            self._layouts[old_dbu].prune_cell(old_index, -1)
+            self.evictions += 1
+
+    def stats(self):
+        '''Hit/miss counters of the cache.'''
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self._entries), 'max_entries': self.max_entries,
+                'hit_rate': (float(self.hits)/total) if total else 0.0}
+
+
+geometry_cache = GeometryCache()
+disk_cache = None
+
+
+def configure_disk_cache(path = None, max_bytes = 512*1024*1024, pcell_folder = None):
+    '''Enable the persistent cache (second level behind geometry_cache).
+
+    The cache is off until this is called; the PRLPDK_PCells library calls it when
+    $PRLPDK_PCELL_CACHE_DIR is set.
+
+    Args:
+        path: cache directory, see disk_cache.default_cache_dir
+        max_bytes: size cap of the directory
+        pcell_folder: folder with the PCell modules; entries written by other versions of
+            these modules or of the GEOMETRY_MODULES are removed (PCell class names match
+            their file names).
+    Returns:
+        the DiskCache, or None if it is disabled with PRLPDK_PCELL_CACHE_DIR=0
+    '''
+    global disk_cache
+    from .disk_cache import DiskCache, default_cache_dir
+    if (path or default_cache_dir()) == '0':
+        disk_cache = None
+        return None
+    disk_cache = DiskCache(path, max_bytes)
+    if pcell_folder:
+        tags = {}
+        for f in os.listdir(pcell_folder):
+            name, ext = os.path.splitext(f)
+            if ext == '.py' and name != '__init__':
+                tags[name] = _tag(name, source_hash(os.path.join(pcell_folder, f)))
+        disk_cache.purge_stale(tags)
+    return disk_cache
+
+
+def cached_produce(produce_impl):
+    '''Decorator for PCellDeclarationHelper.produce_impl that serves repeated parameter sets from geometry_cache.'''
+    def produce(self):
+        '''Fill self.cell, returns where the geometry came from: 'memory', 'disk' or 'produced'.'''
+        technology_name = getattr(self, 'technology_name', None)
+        if technology_name:
+            # a layout without technology gets its technology and dbu before the key is computed,
+            # on a cache hit as on a miss
+            layout_technology(self.layout, technology_name)
+        cache = geometry_cache
+        if not cache.enabled:
+            produce_impl(self)
+            return 'produced'
+        key = pcell_key(self)
+        if cache.restore(key, self.cell):
+            return 'memory'
+        disk = disk_cache
+        if disk is not None:
+            tag = pcell_tag(type(self))
+            if disk.load(tag, key, self.cell):
+                cache.store(key, self.cell)
+                return 'disk'
+        produce_impl(self)
+        cache.store(key, self.cell)
+        if disk is not None:
+            disk.save(tag, key, self.cell)
+        return 'produced'
+
+    @functools.wraps(produce_impl)
+    def wrapper(self):
+        try:
+            if instrument.enabled:
+                instrument.produce(self, produce)
+            else:
+                produce(self)
+        finally:
+            # shared cells of variants dropped since the last produce, or built before an error
+            prune_shared_cells(self.layout)
+    return wrapper
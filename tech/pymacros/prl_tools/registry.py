@@ -0,0 +1,121 @@
+"""
+PRL PDK Tools - PCell registration
+Notice: Information in this file is confidential.
+
+Description:
+Static manifest of the parametric cells in pcells_beta and lazy registration helpers.
+Each PCell is registered through a LazyPCellDeclaration proxy. The PCell module is only
+imported, and its declaration only instantiated, the first time KLayout asks the proxy for
+something (parameters, display text, produce, ...), i.e. when the cell is first used.
+Import and instantiation times are recorded for the start-up timing report.
+
+(C) NYUAD 2023
+"""
+
+import importlib
+import sys
+import time
+from collections import OrderedDict
+
+import pya
+
+
+# (PCell name, module, class name). Waveguide is the base cell used by the SiEPIC waveguide tools, it is not registered.
+PCELL_MANIFEST = (
+  ('Bend',      'pcells_beta.Bend',      'Bend'),
+  ('MMI',       'pcells_beta.MMI',       'MMI'),
+  ('Ring',      'pcells_beta.Ring',      'Ring'),
+  ('SBend',     'pcells_beta.SBend',     'SBend'),
+  ('Spiral',    'pcells_beta.Spiral',    'Spiral'),
+  ('Taper',     'pcells_beta.Taper',     'Taper'),
+  ('Wireguide', 'pcells_beta.Wireguide', 'Wireguide'),
+)
+
+# PCell name -> {'import': s, 'declaration': s, 'error': str}
+timings = OrderedDict()
+
+
+class LazyPCellDeclaration(pya.PCellDeclaration):
+    '''Proxy that loads the real PCellDeclarationHelper on first use and forwards every call to it.'''
+
+    def __init__(self, name, module, class_name):
+        super(LazyPCellDeclaration, self).__init__()
+        self.pcell_name = name
+        self.module_name = module
+        self.class_name = class_name
+        self._declaration = None
+
+    def declaration(self):
+        if self._declaration is None:
+            t0 = time.perf_counter()
+            module = importlib.import_module(self.module_name)
+            t1 = time.perf_counter()
+            self._declaration = getattr(module, self.class_name)()
+            t2 = time.perf_counter()
+            timings[self.pcell_name] = {'import': t1 - t0, 'declaration': t2 - t1}
+        return self._declaration
+
+    def get_parameters(self):
+        return self.declaration().get_parameters()
+
+    def get_layers(self, parameters):
+        return self.declaration().get_layers(parameters)
+
+    def display_text(self, parameters):
+        return self.declaration().display_text(parameters)
+
+    def coerce_parameters(self, layout, parameters):
+        return self.declaration().coerce_parameters(layout, parameters)
+
+    def callback(self, layout, name, states):
+        return self.declaration().callback(layout, name, states)
+
+    def produce(self, layout, layers, parameters, cell):
+        return self.declaration().produce(layout, layers, parameters, cell)
+
+    def can_create_from_shape(self, layout, shape, layer):
+        return self.declaration().can_create_from_shape(layout, shape, layer)
+
+    def parameters_from_shape(self, layout, shape, layer):
+        return self.declaration().parameters_from_shape(layout, shape, layer)
+
+    def transformation_from_shape(self, layout, shape, layer):
+        return self.declaration().transformation_from_shape(layout, shape, layer)
+
+
+def register_pcells(layout, manifest = PCELL_MANIFEST, lazy = True):
+    '''Register the PCells of the manifest in a (library) layout.
+
+    Args:
+        layout: pya.Layout, usually pya.Library.layout()
+        manifest: sequence of (PCell name, module, class name)
+        lazy: if False, import and instantiate every declaration now (to measure start-up costs)
+    Returns:
+        list of the registered PCell names
+    '''
+    registered = []
+    for name, module, class_name in manifest:
+        # Re-running the library macro picks up edited PCell modules, as the previous importlib.reload did
+        if module in sys.modules:
+            del sys.modules[module]
+        decl = LazyPCellDeclaration(name, module, class_name)
+        try:
+            if not lazy:
+                decl.declaration()
+            layout.register_pcell(name, decl)
+            registered.append(name)
+        except Exception as e:
+            timings[name] = {'error': str(e)}
+            print('   Error: Could not register %s: %s' % (name, e))
+    return registered
+
+
+def timing_report():
+    '''Text table with the import and instantiation time of the PCells loaded so far.'''
+    lines = ['%-12s %10s %14s' % ('PCell', 'import ms', 'declaration ms')]
+    for name, t in timings.items():
+        if 'error' in t:
+            lines.append('%-12s %s' % (name, 'error: ' + t['error']))
+        else:
+            lines.append('%-12s %10.1f %14.1f' % (name, t['import']*1e3, t['declaration']*1e3))
+    return '\n'.join(lines)
@@ -0,0 +1,240 @@
+"""
+PRL PDK Tools - Ring resonator model
+Notice: Information in this file is confidential.
+
+Description:
+Analytical model of the Ring PCell (all-pass or add-drop), evaluated for whole grids of designs
+at once: the radius, gap and gap_drop arguments are broadcast against each other (use
+np.meshgrid or [:, None] for a full sweep) and the result has one value per design, or one
+spectrum per design with the wavelength as the last axis.
+  - coupling: field cross-coupling of the bus-ring coupler from the gap and the radius,
+  - spectra: through and drop transmission,
+  - resonances: resonance wavelengths in a band (Newton on n(wl) L = m wl, no spectrum needed),
+  - metrics: resonance, FSR, FWHM, loaded and intrinsic Q, finesse, extinction and drop peak.
+The waveguide model is the one of the Ring label (see circuit.effective_index).
+Wavelengths, radii and gaps are in m, losses in dB/cm, dispersion in ps/(nm km).
+
+Usage:
+  from prl_tools import ring_model
+  r, g = np.meshgrid(np.linspace(5e-6, 50e-6, 200), np.linspace(0.1e-6, 0.5e-6, 100), indexing = 'ij')
+  m = ring_model.metrics(r, g, g)            # dict of (200, 100) arrays
+  t, d = ring_model.spectra(np.linspace(1.5e-6, 1.6e-6, 4000), r, g, g)   # (200, 100, 4000)
+  python -m prl_tools.ring_model --radius 5:50:0.5 --gap 0.1:0.5:0.01 --sort q -n 20
+
+(C) NYUAD 2023
+"""
+
+import argparse
+import csv
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+from .circuit import C0, WL0, WAVEGUIDE, effective_index
+
+
+CLADDING = 1.444   # oxide index at WL0
+
+# empirical coupling of the bus and the ring: kappa = sin(k0 * sqrt(2 pi R / gamma) * exp(-gamma gap)),
+# gamma the evanescent decay constant of the mode; k0 (1/m) is fitted so that the default Ring
+# (radius 50 um, gap 0.3 um) has the circuit.RING_KAPPA coupling. Refit k0 with measured rings.
+COUPLING = {'k0': 2.4644e5}
+
+
+def _model(model):
+    values = dict(WAVEGUIDE, wl0 = WL0)
+    unknown = set(model) - set(values)
+    if unknown:
+        raise TypeError('unknown waveguide parameter(s): %s' % ', '.join(sorted(unknown)))
+    values.update(model)
+    return values
+
+
+def _dn_dwl(wavelength, ne, ng, dispersion = 0.0, wl0 = WL0):
+    return (ne - ng) / wl0 - C0 * dispersion * 1e-6 / wl0 * (np.asarray(wavelength) - wl0)
+
+
+def group_index(wavelength, ne = WAVEGUIDE['ne'], ng = WAVEGUIDE['ng'], dispersion = WAVEGUIDE['dispersion'], wl0 = WL0):
+    '''Group index n - wl dn/dwl of the effective_index model.'''
+    return effective_index(wavelength, ne, ng, dispersion, wl0) - wavelength * _dn_dwl(wavelength, ne, ng, dispersion, wl0)
+
+
+def coupling(gap, radius, wavelength = WL0, ne = WAVEGUIDE['ne'], k0 = None, cladding = CLADDING):
+    '''Field cross-coupling kappa of a straight bus and a ring of the given radius, gap between the edges.'''
+    k0 = COUPLING['k0'] if k0 is None else k0
+    wavelength = np.asarray(wavelength, dtype = float)
+    gamma = 2 * np.pi / wavelength * np.sqrt(ne ** 2 - cladding ** 2)
+    # the gap grows as z^2/(2R) along the bus: the integrated coupling is that of a straight
+    # coupler of length sqrt(2 pi R / gamma)
+    return np.sin(np.minimum(k0 * np.sqrt(2 * np.pi * np.asarray(radius) / gamma) * np.exp(-gamma * np.asarray(gap)), np.pi / 2))
+
+
+def _couplings(radius, gap, gap_drop, wavelength, ne):
+    k1 = coupling(gap, radius, wavelength, ne)
+    k2 = 0.0 if gap_drop is None else coupling(gap_drop, radius, wavelength, ne)
+    return k1, k2
+
+
+def _round_trip_loss(radius, loss):
+    '''Field amplitude after one round trip.'''
+    return 10 ** (-loss * 2 * np.pi * np.asarray(radius) * 100 / 20)
+
+
+def spectra(wavelength, radius, gap, gap_drop = None, field = False, **model):
+    '''Through and drop transmission of the rings at the wavelengths (m).
+
+    The designs (radius, gap, gap_drop) are broadcast together and the wavelength is appended as
+    the last axis. gap_drop None is an all-pass ring (drop is 0). With field, the complex
+    transmissions (same phases as circuit.ring) instead of the powers.
+    model: ne, ng, loss, dispersion, wl0 of the waveguide (default circuit.WAVEGUIDE).
+    '''
+    m = _model(model)
+    wl = np.atleast_1d(np.asarray(wavelength, dtype = float))
+    radius, gap = np.asarray(radius, dtype = float)[..., None], np.asarray(gap, dtype = float)[..., None]
+    gap_drop = None if gap_drop is None else np.asarray(gap_drop, dtype = float)[..., None]
+    k1, k2 = _couplings(radius, gap, gap_drop, wl, m['ne'])
+    t1, t2 = np.sqrt(1 - k1 ** 2), np.sqrt(1 - k2 ** 2)
+    a = _round_trip_loss(radius, m['loss'])
+    n = effective_index(wl, m['ne'], m['ng'], m['dispersion'], m['wl0'])
+    half = np.exp(-2j * np.pi * n * np.pi * radius / wl)   # half round-trip phase
+    x = half ** 2
+    den = 1 - t1 * t2 * a * x
+    through = (t1 - t2 * a * x) / den
+    drop = -k1 * k2 * np.sqrt(a) * half / den
+    if field:
+        return through, drop
+    return np.abs(through) ** 2, np.abs(drop) ** 2
+
+
+def _solve_resonance(order, length, guess, m, iterations = 6):
+    '''Wavelengths with n(wl) length = order wl, by Newton from guess.'''
+    wl = guess
+    for i in range(iterations):
+        n = effective_index(wl, m['ne'], m['ng'], m['dispersion'], m['wl0'])
+        f = n * length - order * wl
+        wl = wl - f / (_dn_dwl(wl, m['ne'], m['ng'], m['dispersion'], m['wl0']) * length - order)
+    return wl
+
+
+def resonances(lo, hi, radius, **model):
+    '''Resonance wavelengths of the rings in [lo, hi] (m), shape radius.shape + (M,), ascending.
+
+    M is the largest number of resonances of a ring in the band; the missing ones are NaN.
+    '''
+    m = _model(model)
+    length = 2 * np.pi * np.asarray(radius, dtype = float)[..., None]
+    n_lo = effective_index(lo, m['ne'], m['ng'], m['dispersion'], m['wl0'])
+    n_hi = effective_index(hi, m['ne'], m['ng'], m['dispersion'], m['wl0'])
+    first = np.ceil(n_hi * length / hi)   # orders decrease with the wavelength
+    last = np.floor(n_lo * length / lo)
+    count = int(max(np.max(last - first + 1), 0))
+    order = last - np.arange(count)   # ascending wavelengths
+    guess = np.clip(length * effective_index((lo + hi) / 2, m['ne'], m['ng'], m['dispersion'], m['wl0']) / order,
+                    lo, hi) if count else np.zeros(order.shape)
+    wl = _solve_resonance(order, length, guess, m)
+    return np.where((order >= first) & (wl >= lo * (1 - 1e-12)) & (wl <= hi * (1 + 1e-12)), wl, np.nan)
+
+
+def nearest_resonance(radius, wavelength = WL0, **model):
+    '''Resonance wavelength of the rings closest to wavelength (m).'''
+    m = _model(model)
+    radius, wavelength = np.broadcast_arrays(np.asarray(radius, dtype = float), np.asarray(wavelength, dtype = float))
+    length = 2 * np.pi * radius
+    n = effective_index(wavelength, m['ne'], m['ng'], m['dispersion'], m['wl0'])
+    order = np.maximum(np.floor(n * length / wavelength), 1)
+    # the resonances of the orders on both sides of wavelength
+    below = _solve_resonance(order + 1, length, wavelength, m)
+    above = _solve_resonance(order, length, wavelength, m)
+    return np.where(wavelength - below < above - wavelength, below, above)
+
+
+def metrics(radius, gap, gap_drop = None, wavelength = WL0, **model):
+    '''Figures of merit of the rings at their resonance closest to wavelength (m).
+
+    OrderedDict of arrays (designs broadcast with wavelength): resonance (m), fsr (m), fwhm (m),
+    q (loaded), q_intrinsic, finesse, extinction (through notch depth, dB), through_min and
+    drop_max (power transmission at resonance), kappa and kappa_drop.
+    '''
+    m = _model(model)
+    wl = nearest_resonance(radius, wavelength, **m)
+    radius = np.asarray(radius, dtype = float)
+    gap_drop = None if gap_drop is None else np.asarray(gap_drop, dtype = float)
+    k1, k2 = _couplings(radius, np.asarray(gap, dtype = float), gap_drop, wl, m['ne'])
+    k1, k2 = np.broadcast_arrays(k1, k2)
+    t1, t2 = np.sqrt(1 - k1 ** 2), np.sqrt(1 - k2 ** 2)
+    a = _round_trip_loss(radius, m['loss'])
+    length = 2 * np.pi * radius
+    ng = group_index(wl, m['ne'], m['ng'], m['dispersion'], m['wl0'])
+    r = t1 * t2 * a
+    fsr = wl ** 2 / (ng * length)
+    q = np.pi * ng * length * np.sqrt(r) / (wl * (1 - r))
+    alpha = np.asarray(m['loss'], dtype = float) * 100 * np.log(10) / 10   # power loss, 1/m
+    through_min = (t1 - t2 * a) ** 2 / (1 - r) ** 2
+    through_max = (t1 + t2 * a) ** 2 / (1 + r) ** 2
+    with np.errstate(divide = 'ignore'):   # lossless rings: critical coupling, infinite intrinsic Q
+        extinction = 10 * np.log10(through_max / through_min)
+        q_intrinsic = 2 * np.pi * ng / (wl * alpha)
+    return OrderedDict([
+        ('resonance', wl), ('fsr', fsr), ('fwhm', wl / q), ('q', q),
+        ('q_intrinsic', np.broadcast_to(q_intrinsic, wl.shape)), ('finesse', fsr * q / wl),
+        ('extinction', extinction), ('through_min', through_min),
+        ('drop_max', k1 ** 2 * k2 ** 2 * a / (1 - r) ** 2), ('kappa', k1), ('kappa_drop', k2)])
+
+
+def _sweep(text):
+    '''start:stop:step (um, stop included) or a single value -> values in m.'''
+    values = [float(v) for v in text.split(':')]
+    if len(values) == 1:
+        return np.array(values) * 1e-6
+    start, stop, step = values
+    return np.arange(start, stop + step / 2, step) * 1e-6
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Sweep Ring designs: resonance, FSR, Q and extinction.')
+    parser.add_argument('--radius', default = '50', help = 'radius (um), value or start:stop:step')
+    parser.add_argument('--gap', default = '0.3', help = 'through gap (um), value or start:stop:step')
+    parser.add_argument('--gap-drop', default = 'same', help = "drop gap (um), 'same' as the gap or 'none' (all-pass)")
+    parser.add_argument('--wavelength', type = float, default = WL0 * 1e6, help = 'target wavelength (um)')
+    for key in ('ne', 'ng', 'loss', 'dispersion'):
+        parser.add_argument('--' + key, type = float, default = WAVEGUIDE[key])
+    parser.add_argument('--sort', default = 'q', help = 'metric to sort on (descending)')
+    parser.add_argument('-n', type = int, default = 20, help = 'number of designs to print')
+    parser.add_argument('-o', '--output', help = 'CSV file with all the designs')
+    args = parser.parse_args(argv)
+
+    radius, gap = _sweep(args.radius), _sweep(args.gap)
+    if args.gap_drop in ('same', 'none'):
+        r, g = np.meshgrid(radius, gap, indexing = 'ij')
+        gd = g if args.gap_drop == 'same' else None
+    else:
+        r, g, gd = np.meshgrid(radius, gap, _sweep(args.gap_drop), indexing = 'ij')
+    model = dict(ne = args.ne, ng = args.ng, loss = args.loss, dispersion = args.dispersion)
+    m = metrics(r, g, gd, args.wavelength * 1e-6, **model)
+    if args.sort not in m:
+        parser.error('unknown metric %s (%s)' % (args.sort, ', '.join(m)))
+
+    columns = OrderedDict([('radius', r), ('gap', g), ('gap_drop', np.nan if gd is None else gd)])
+    columns.update(m)
+    flat = OrderedDict((k, np.broadcast_to(v, r.shape).ravel()) for k, v in columns.items())
+    order = np.argsort(-np.nan_to_num(flat[args.sort], nan = -np.inf), kind = 'stable')
+    scale = {'radius': 1e6, 'gap': 1e6, 'gap_drop': 1e6, 'resonance': 1e9, 'fsr': 1e9, 'fwhm': 1e12}
+    units = {'radius': 'um', 'gap': 'um', 'gap_drop': 'um', 'resonance': 'nm', 'fsr': 'nm', 'fwhm': 'pm', 'extinction': 'dB'}
+    header = ['%s%s' % (k, ' (%s)' % units[k] if k in units else '') for k in flat]
+
+    if args.output:
+        with open(args.output, 'w', newline = '') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for i in order:
+                writer.writerow(['%.6g' % (flat[k][i] * scale.get(k, 1)) for k in flat])
+    print('%d designs' % r.size)
+    print('  '.join('%12s' % k for k in flat))
+    for i in order[:args.n]:
+        print('  '.join('%12.5g' % (flat[k][i] * scale.get(k, 1)) for k in flat))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,362 @@
+"""
+PRL PDK Tools - S-parameters
+Notice: Information in this file is confidential.
+
+Description:
+S-parameter files of the devices (e.g. CBand_TE0TE1_ysplitter_opt/) as complex NumPy arrays
+s[freq, out port, in port], with their port and mode list:
+  - Touchstone (.sNp) files written by Lumerical, with the optical port list of the
+    '! Port[i] = {"port 1","TE0",1,"LEFT"}' comments,
+  - Lumerical .dat exports (INTERCONNECT optical N-port format): port list, then one block per
+    matrix element, read one block at a time (iter_dat_blocks), so a large multimode file is
+    never held in memory as text or Python lists.
+A parsed file is stored once as a binary sidecar (two .npy arrays and a .json of the metadata),
+named after the hash of the source file; the next loads memory-map the arrays instead of parsing
+the text again, so a sweep or a circuit simulation loading the same file many times only pages
+in the data it uses.
+
+Default sidecar location: $PRLPDK_SPARAM_CACHE_DIR, or ~/.klayout/prl_pdk/sparams
+
+Usage:
+  from prl_tools import sparams
+  sp = sparams.load('CBand_TE0TE1_ysplitter_opt/CBand_TE0TE1_ysplitter_opt.s4p')
+  t = sp.s[:, sp.port_index('port 2', 'TE0'), sp.port_index('port 1', 'TE0')]
+  PYTHONPATH=tech/pymacros python -m prl_tools.sparams device.dat --check device.s4p
+
+(C) NYUAD 2023
+"""
+
+import argparse
+import ast
+import hashlib
+import itertools
+import json
+import os
+import re
+import sys
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+
+C0 = 299792458.0   # m/s
+
+_FREQ_UNITS = {'HZ': 1.0, 'KHZ': 1e3, 'MHZ': 1e6, 'GHZ': 1e9, 'THZ': 1e12}
+_PORT = re.compile(r'!\s*Port\[(\d+)\]\s*=\s*\{(.*)\}')
+_CACHE_VERSION = 1
+
+_keys = {}   # source path -> ((size, mtime), source hash)
+
+
+def default_cache_dir():
+    return os.environ.get('PRLPDK_SPARAM_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.klayout', 'prl_pdk', 'sparams'))
+
+
+class SParameters(object):
+    '''S-matrix of a device over frequency.
+
+    Attributes:
+        freq: frequencies in Hz, shape (F,)
+        s: complex S-matrix, shape (F, N, N); s[f, i, j] is the transmission from port j to port i
+        ports: one dict per port: name, mode, mode_id and side (Lumerical port list), or only name
+        source: file the data was read from
+    '''
+
+    def __init__(self, freq, s, ports = None, source = None):
+        self.freq = freq
+        self.s = s
+        self.ports = ports or [{'name': str(i + 1)} for i in range(s.shape[1])]
+        self.source = source
+
+    @property
+    def num_ports(self):
+        return self.s.shape[1]
+
+    @property
+    def wavelength(self):
+        '''Wavelengths in m, shape (F,).'''
+        return C0 / np.asarray(self.freq)
+
+    def port_index(self, name, mode = None):
+        '''Index of the port with this name (and mode, for multimode ports).'''
+        for i, port in enumerate(self.ports):
+            if port['name'] == name and (mode is None or port.get('mode') == mode):
+                return i
+        raise KeyError('port %s %s not found in %s' % (name, mode or '', self.source))
+
+    def __repr__(self):
+        return '<SParameters %d ports, %d frequencies, %s>' % (self.num_ports, len(self.freq), self.source)
+
+
+def _parse_port(text):
+    '''Fields of a Lumerical port comment: "port 1","TE0",1,"LEFT".'''
+    fields = [f.strip().strip('"') for f in text.split(',')]
+    port = {'name': fields[0]}
+    if len(fields) >= 4:
+        port.update(mode = fields[1], mode_id = int(fields[2]), side = fields[3])
+    return port
+
+
+def _to_complex(a, b, fmt):
+    if fmt == 'MA':
+        return a * np.exp(1j * np.deg2rad(b))
+    if fmt == 'DB':
+        return 10 ** (a / 20) * np.exp(1j * np.deg2rad(b))
+    if fmt == 'RI':
+        return a + 1j * b
+    raise ValueError('unknown Touchstone data format %s' % fmt)
+
+
+def parse_touchstone(path):
+    '''Parse a Touchstone version 1 file (any number of ports, HZ..GHZ, MA/DB/RI).'''
+    match = re.search(r'\.s(\d+)p$', path, re.IGNORECASE)
+    ports = {}
+    options = ['GHZ', 'S', 'MA', 'R', '50']   # Touchstone defaults
+    data = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('!'):
+                m = _PORT.match(line)
+                if m:
+                    ports[int(m.group(1))] = _parse_port(m.group(2))
+                continue
+            if line.startswith('#'):
+                options = line[1:].upper().split() + options[len(line[1:].split()):]
+                continue
+            data.append(line.split('!', 1)[0])
+    if options[1] != 'S':
+        raise ValueError('%s: only S-parameter files are supported (found %s)' % (path, options[1]))
+    values = np.array(' '.join(data).split(), dtype = float)
+    n = int(match.group(1)) if match else len(ports)
+    if not n:
+        raise ValueError('%s: number of ports unknown (file extension and port list missing)' % path)
+    values = values.reshape(-1, 1 + 2 * n * n)
+    s = _to_complex(values[:, 1::2], values[:, 2::2], options[2]).reshape(-1, n, n)
+    if n == 2:
+        s = s.transpose(0, 2, 1)   # two-port data order is S11 S21 S12 S22
+    freq = values[:, 0] * _FREQ_UNITS[options[0]]
+    port_list = [ports[i] for i in sorted(ports)] if len(ports) == n else None
+    return SParameters(freq, np.ascontiguousarray(s), port_list, path)
+
+
+def iter_dat_blocks(path, data = True):
+    '''Blocks of a Lumerical .dat file, one at a time.
+
+    Yields:
+        ('port', name, side) for the port list lines, then for every matrix element
+        ('block', (out port, out mode, out mode id, in port, in mode id, kind), array of shape (rows, cols))
+        with frequency (Hz), magnitude and phase (radians) columns. With data = False the array is
+        None and the rows are skipped without being parsed.
+    '''
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('['):
+                name, side = ast.literal_eval(line)[:2]
+                yield ('port', name, side)
+            elif line.startswith('('):
+                header = ast.literal_eval(line)
+                rows, cols = ast.literal_eval(next(f).strip())[:2]
+                lines = itertools.islice(f, rows)
+                if not data:
+                    for _ in lines:
+                        pass
+                    yield ('block', header, None)
+                    continue
+                values = np.array(' '.join(lines).split(), dtype = float)
+                if values.size != rows * cols:
+                    raise ValueError('%s: block %s is truncated' % (path, header))
+                yield ('block', header, values.reshape(rows, cols))
+            else:
+                raise ValueError('%s: unexpected line %s' % (path, line[:40]))
+
+
+def _dat_ports(path):
+    '''Port list of a .dat file (first pass: the data rows are skipped).'''
+    sides, modes = OrderedDict(), {}
+    for item in iter_dat_blocks(path, data = False):
+        if item[0] == 'port':
+            sides[item[1]] = item[2]
+            continue
+        out_port, out_mode, out_id, in_port, in_id = item[1][:5]
+        modes[(out_port, out_id)] = out_mode
+        modes.setdefault((in_port, in_id), None)
+    order = {name: i for i, name in enumerate(sides)}
+    keys = sorted(modes, key = lambda k: (order.get(k[0], len(order)), k[0], k[1]))   # port list order, then mode
+    return [{'name': name, 'mode': modes[(name, mode_id)] or 'mode %d' % mode_id, 'mode_id': mode_id,
+             'side': sides.get(name, '')} for name, mode_id in keys]
+
+
+def parse_dat(path, base = None):
+    '''Assemble the S-matrix of a Lumerical .dat file, streaming it twice (port list, then data).
+
+    With base, the matrix is written block by block into the binary sidecar <base> (see
+    save_binary) instead of memory, and the memory-mapped result is returned.
+    '''
+    ports = _dat_ports(path)
+    index = {(p['name'], p['mode_id']): i for i, p in enumerate(ports)}
+    n = len(ports)
+    freq = s = tmp = None
+    try:
+        for item in iter_dat_blocks(path):
+            if item[0] != 'block' or item[1][5] != 'transmission':
+                continue
+            header, values = item[1], item[2]
+            if freq is None:
+                freq = values[:, 0].copy()
+                shape = (len(freq), n, n)
+                if base is None:
+                    s = np.zeros(shape, dtype = complex)
+                else:
+                    os.makedirs(os.path.dirname(base) or '.', exist_ok = True)
+                    fd, tmp = tempfile.mkstemp(suffix = '.tmp', dir = os.path.dirname(base) or '.')
+                    os.close(fd)
+                    s = np.lib.format.open_memmap(tmp, mode = 'w+', dtype = complex, shape = shape)
+            elif len(values) != len(freq) or not np.allclose(values[:, 0], freq, rtol = 1e-12):
+                raise ValueError('%s: block %s has other frequencies' % (path, header))
+            s[:, index[(header[0], header[2])], index[(header[3], header[4])]] = values[:, 1] * np.exp(1j * values[:, 2])
+        if freq is None:
+            raise ValueError('%s: no transmission block' % path)
+        if base is None:
+            return SParameters(freq, s, ports, path)
+        s.flush()
+        del s
+        os.replace(tmp, base + '.s.npy')
+    except Exception:
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    _save_metadata(SParameters(freq, None, ports, path), base)
+    return load_binary(base)
+
+
+def source_hash(path):
+    '''Hash of the content of a file, recomputed only when its size or modification time changes.'''
+    st = os.stat(path)
+    stamp = (st.st_size, st.st_mtime)
+    cached = _keys.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+    _keys[path] = (stamp, digest)
+    return digest
+
+
+def _sidecar(cache_dir, path, key):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, '%s-%s' % (stem, key[:16]))
+
+
+def _write_atomic(fname, write, mode = 'wb'):
+    fd, tmp = tempfile.mkstemp(suffix = '.tmp', dir = os.path.dirname(fname) or '.')
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(tmp, fname)   # atomic, parallel sweeps may share the directory
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def save_binary(sp, base):
+    '''Write sp as <base>.freq.npy, <base>.s.npy and <base>.json (metadata, written last).'''
+    os.makedirs(os.path.dirname(base) or '.', exist_ok = True)
+    _write_atomic(base + '.s.npy', lambda f: np.save(f, np.asarray(sp.s, dtype = complex)))
+    _save_metadata(sp, base)
+
+
+def _save_metadata(sp, base):
+    '''Frequencies and metadata of a sidecar; the .json is written last and marks it as complete.'''
+    _write_atomic(base + '.freq.npy', lambda f: np.save(f, np.asarray(sp.freq, dtype = float)))
+    meta = {'version': _CACHE_VERSION, 'ports': sp.ports, 'source': sp.source}
+    _write_atomic(base + '.json', lambda f: json.dump(meta, f), 'w')
+
+
+def load_binary(base, mmap = True):
+    '''SParameters of a binary sidecar (memory-mapped by default), or None if it is missing or incomplete.'''
+    try:
+        with open(base + '.json') as f:
+            meta = json.load(f)
+        if meta.get('version') != _CACHE_VERSION:
+            return None
+        mode = 'r' if mmap else None
+        freq = np.load(base + '.freq.npy', mmap_mode = mode)
+        s = np.load(base + '.s.npy', mmap_mode = mode)
+    except (OSError, ValueError):
+        return None
+    return SParameters(freq, s, meta['ports'], meta.get('source'))
+
+
+def convert(path, base):
+    '''Write the binary sidecar <base> of a .sNp or .dat file. Returns the memory-mapped SParameters.'''
+    if path.lower().endswith('.dat'):
+        return parse_dat(path, base)
+    save_binary(parse_touchstone(path), base)
+    return load_binary(base)
+
+
+def load(path, cache = True, cache_dir = None):
+    '''S-parameters of a .sNp or .dat file, from its binary sidecar when there is one for the current content.
+
+    Args:
+        cache: use (and write) the sidecar; False always parses the file
+        cache_dir: sidecar folder (default: default_cache_dir())
+    '''
+    if not cache:
+        return parse_dat(path) if path.lower().endswith('.dat') else parse_touchstone(path)
+    base = _sidecar(cache_dir or default_cache_dir(), path, source_hash(path))
+    sp = load_binary(base) or convert(path, base)
+    sp.source = path
+    return sp
+
+
+def max_difference(a, b):
+    '''Largest |a.s - b.s| over the ports common to both (matched by name and mode) and the frequencies of a.
+
+    b is interpolated (real and imaginary parts) on the frequencies of a when they differ.
+    '''
+    pairs = [(i, b.port_index(p['name'], p.get('mode'))) for i, p in enumerate(a.ports)]
+    ia, ib = [i for i, j in pairs], [j for i, j in pairs]
+    sa = np.asarray(a.s)[:, ia][:, :, ia]
+    sb = np.asarray(b.s)[:, ib][:, :, ib]
+    if len(a.freq) != len(b.freq) or not np.allclose(a.freq, b.freq, rtol = 1e-12):
+        fb = np.asarray(b.freq)
+        flat = sb.reshape(len(fb), -1)
+        sb = np.stack([np.interp(a.freq, fb, c.real) + 1j * np.interp(a.freq, fb, c.imag) for c in flat.T], 1)
+        sb = sb.reshape(sa.shape)
+    return float(np.abs(sa - sb).max())
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Convert S-parameter files (.sNp, .dat) to binary sidecars.')
+    parser.add_argument('files', nargs = '+', help = 'S-parameter files')
+    parser.add_argument('--cache-dir', help = 'sidecar folder (default: $PRLPDK_SPARAM_CACHE_DIR)')
+    parser.add_argument('--check', help = 'reference file (e.g. the .s4p of a .dat) to compare with')
+    args = parser.parse_args(argv)
+
+    reference = load(args.check, cache_dir = args.cache_dir) if args.check else None
+    status = 0
+    for path in args.files:
+        sp = load(path, cache_dir = args.cache_dir)
+        print('%s: %d ports (%s), %d frequencies' % (path, sp.num_ports,
+              ', '.join('%s %s' % (p['name'], p.get('mode', '')) for p in sp.ports), len(sp.freq)))
+        if reference is not None:
+            error = max_difference(sp, reference)
+            print('  max |S - S(%s)| = %.3g' % (args.check, error))
+            if error > 1e-6:
+                status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
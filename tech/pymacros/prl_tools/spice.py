@@ -0,0 +1,153 @@
+"""
+PRL PDK Tools - SPICE parameter store
+Notice: Information in this file is confidential.
+
+Description:
+Compact-model parameters of the PCells, shown as the 'Spice_param:' text of the DevRec layer,
+kept in an indexed store per cell. Reading or updating a parameter is a dict operation; the label
+is only written by write(), once the parameters are complete. Cells without a store (e.g. read
+from a file) are parsed from their label on first use, so a netlist extraction reads every
+component label only once.
+
+Usage:
+  from prl_tools import spice
+  store = spice.params(cell, LayerDevRecN)
+  store['wg_length'] = '%2.6E' % length
+  store.write()
+
+(C) NYUAD 2023
+"""
+
+import shlex
+import weakref
+from collections import OrderedDict
+
+import pya
+
+
+PREFIX = 'Spice_param:'
+
+_stores = weakref.WeakKeyDictionary()   # layout -> {cell index: SpiceParams}
+
+
+def format_params(params):
+    '''Label text of a parameter dict (keys with spaces are quoted), without the prefix.'''
+    return ' '.join(('"%s"=%s' if ' ' in key else '%s=%s') % (key, value) for key, value in params.items())
+
+
+def parse_params(text):
+    '''Parameters of a label text (with or without the prefix), as an OrderedDict of strings.'''
+    if PREFIX in text:
+        text = text.split(PREFIX, 1)[1]
+    params = OrderedDict()
+    try:
+        tokens = shlex.split(text)
+    except ValueError:   # unbalanced quotes
+        tokens = text.split()
+    for i, token in enumerate(tokens):
+        key, sep, value = token.partition('=')
+        if sep and not value and i + 1 < len(tokens) and '=' not in tokens[i + 1]:
+            value = tokens[i + 1]   # '"length"= 5.3u' (Ring label)
+        if sep:
+            params[key] = value
+    return params
+
+
+def _label_shapes(cell, layer):
+    '''Text shapes of layer holding a label: the cell's own first, then those of its children.'''
+    for shape in cell.shapes(layer).each(pya.Shapes.STexts):
+        if PREFIX in shape.text_string:
+            yield shape
+    it = cell.begin_shapes_rec(layer)
+    it.shape_flags = pya.Shapes.STexts
+    it.min_depth = 1
+    while not it.at_end():
+        if PREFIX in it.shape().text_string:
+            yield it.shape()
+        it.next()
+
+
+class SpiceParams(object):
+    '''Ordered compact-model parameters of a cell, written as one label on the DevRec layer.'''
+
+    def __init__(self, cell, layer, params = None):
+        self.cell = cell
+        self.layer = layer
+        self.name = cell.name
+        self._params = OrderedDict(params or ())
+
+    def __getitem__(self, key):
+        return self._params[key]
+
+    def __setitem__(self, key, value):
+        self._params[key] = value
+
+    def __delitem__(self, key):
+        del self._params[key]
+
+    def __contains__(self, key):
+        return key in self._params
+
+    def __iter__(self):
+        return iter(self._params)
+
+    def __len__(self):
+        return len(self._params)
+
+    def get(self, key, default = None):
+        return self._params.get(key, default)
+
+    def items(self):
+        return self._params.items()
+
+    def update(self, params):
+        self._params.update(params)
+
+    def replace(self, params):
+        '''Replace all the parameters, keeping the order of params.'''
+        self._params = OrderedDict(params)
+
+    def text(self):
+        return PREFIX + format_params(self._params)
+
+    def write(self, trans = None, size = None):
+        '''Write the label: the existing one is updated in place, else a new text is inserted at trans
+        (default: cell origin) with size (default: 0.1 um).'''
+        text = self.text()
+        for shape in _label_shapes(self.cell, self.layer):
+            shape.text_string = text
+            return
+        dbu = self.cell.layout().dbu
+        self.cell.shapes(self.layer).insert(pya.Text(text, trans or pya.Trans(), size or 0.1/dbu, -1))
+
+
+def _layout_stores(layout):
+    stores = _stores.get(layout)
+    if stores is None:
+        stores = _stores[layout] = {}
+    return stores
+
+
+def params(cell, layer):
+    '''Parameter store of a cell, parsed from its label the first time.'''
+    stores = _layout_stores(cell.layout())
+    store = stores.get(cell.cell_index())
+    if store is None or store.name != cell.name:
+        label = next(_label_shapes(cell, layer), None)
+        store = stores[cell.cell_index()] = SpiceParams(cell, layer, parse_params(label.text_string) if label else None)
+    return store
+
+
+def set_params(cell, layer, values):
+    '''Replace the parameters of a cell and write its label. Returns the store.'''
+    store = _layout_stores(cell.layout())[cell.cell_index()] = SpiceParams(cell, layer, values)
+    store.write()
+    return store
+
+
+def forget(cell = None):
+    '''Drop the store of a cell (all stores when cell is None), e.g. after editing its label by hand.'''
+    if cell is None:
+        _stores.clear()
+    else:
+        _stores.get(cell.layout(), {}).pop(cell.cell_index(), None)
@@ -0,0 +1,202 @@
+"""
+PRL PDK Tools - Spiral geometry
+Notice: Information in this file is confidential.
+
+Description:
+Solver for the number of turns and the inner radius of the "Spiral" PCell.
+The length of the spiral (S-section plus inner and outer Archimedean spirals) is
+  L(r, N) = A(N) * r + spacing * B(N)
+so for a given number of turns the radius follows in closed form, and the largest
+number of turns that fits at the minimum radius is the root of a quadratic in N.
+Solutions are cached, since layouts reuse a handful of target lengths many times.
+The centerline itself is generated as one contiguous int32 coordinate buffer, with an angular
+step that follows the local radius (see spiral_points).
+
+(C) NYUAD 2023
+"""
+
+from collections import namedtuple
+from functools import lru_cache
+from math import pi, sqrt, floor, isfinite
+import numpy as np
+
+from .geometry import arc_segments, vertex_radius
+
+SpiralSolution = namedtuple('SpiralSolution', ['turns', 'radius', 'length'])
+
+
+def _coefficients(N, spiral_ports):
+    '''Coefficients A(N), B(N) of the length model L = A*r + spacing*B.'''
+    p = 1 if spiral_ports else 0
+    A = 2*pi + 8*pi*N + p*2*pi*N
+    B = 4*pi*N**2 + pi*N + p*(2*pi*N**2 + pi*N)
+    return A, B
+
+
+def spiral_length(r, spacing, N, spiral_ports = False):
+    '''Centerline length of a spiral with inner radius r, pitch spacing and N turns (microns).'''
+    A, B = _coefficients(N, spiral_ports)
+    return A*r + spacing*B
+
+
+def _max_turns(length, spacing, r, spiral_ports):
+    '''Largest integer N for which spiral_length(r, spacing, N) <= length.'''
+    p = 1 if spiral_ports else 0
+    a2 = spacing*(4*pi + p*2*pi)
+    a1 = r*(8*pi + p*2*pi) + spacing*(pi + p*pi)
+    a0 = 2*pi*r - length
+    if a2 > 0:
+        disc = a1**2 - 4*a2*a0
+        if disc < 0:
+            return 0
+        N = floor((-a1 + sqrt(disc))/(2*a2))
+    elif a1 > 0:
+        N = floor(-a0/a1)
+    else:
+        return 0
+    # guard against rounding at integer boundaries
+    while spiral_length(r, spacing, N + 1, spiral_ports) <= length:
+        N += 1
+    while N > 0 and spiral_length(r, spacing, N, spiral_ports) > length:
+        N -= 1
+    return N
+
+
+def _bracket_root(f, lo, hi, tol = 1e-9, maxiter = 200):
+    '''Bisection on a bracket [lo, hi], expanding hi until the sign changes.'''
+    f_lo = f(lo)
+    f_hi = f(hi)
+    i = 0
+    while f_lo*f_hi > 0 and i < 60:
+        hi = 2*hi if hi > 0 else 1.0
+        f_hi = f(hi)
+        i += 1
+    if f_lo*f_hi > 0:
+        raise ValueError('No root found in the spiral radius bracket [%s, %s]' % (lo, hi))
+    for i in range(maxiter):
+        mid = (lo + hi)/2
+        f_mid = f(mid)
+        if abs(f_mid) < tol or (hi - lo)/2 < tol:
+            return mid
+        if f_lo*f_mid < 0:
+            hi, f_hi = mid, f_mid
+        else:
+            lo, f_lo = mid, f_mid
+    return (lo + hi)/2
+
+
+@lru_cache(maxsize=1024)
+def solve_spiral(length, wg_spacing, wg_width, min_radius, spiral_ports = False, waveguide_type = ''):
+    '''Number of turns and inner radius of a spiral of a target length.
+
+    Args:
+        length: target waveguide length (microns)
+        wg_spacing: gap between neighbouring waveguides (microns)
+        wg_width: waveguide width (microns); the spiral pitch is wg_spacing + wg_width
+        min_radius: minimum bend radius of the waveguide type (microns)
+        spiral_ports: True if both ports are on the same side
+        waveguide_type: waveguide type name, only used as part of the cache key
+
+    Returns:
+        SpiralSolution(turns, radius, length)
+    '''
+    spacing = wg_spacing + wg_width
+    r = min_radius
+
+    # Upper bound used by the original turn search (it never returned more turns than this)
+    L_spiral = length - 2*(2*pi*r)
+    N_guess = floor(L_spiral/(pi*(4*r + 5*spacing))) + 1
+
+    N = min(N_guess - 1, _max_turns(length, spacing, r, spiral_ports))
+    N = 1 if N <= 0 else N
+
+    # Exact radius for N turns, bracketed search as a fallback
+    A, B = _coefficients(N, spiral_ports)
+    new_r = (length - spacing*B)/A if A > 0 else float('nan')
+    if not isfinite(new_r) or abs(spiral_length(new_r, spacing, N, spiral_ports) - length) > 1e-6*max(1.0, length):
+        new_r = _bracket_root(lambda x: spiral_length(x, spacing, N, spiral_ports) - length, -max(length, min_radius), max(length, min_radius))
+    radius = new_r if new_r >= min_radius else min_radius
+
+    return SpiralSolution(N, radius, spiral_length(new_r, spacing, N, spiral_ports))
+
+
+def _outward(rho, t):
+    '''Radii of the vertices of a polyline through (rho, t) moved out so its chords deviate equally
+    inside and outside the curve (see geometry.vertex_radius); the end points stay on the curve.'''
+    step = np.empty_like(t)
+    step[1:-1] = (t[2:] - t[:-2])/2
+    moved = vertex_radius(rho, np.abs(step))
+    moved[0], moved[-1] = rho[0], rho[-1]
+    return moved
+
+
+def spiral_points(a, r, angle, start_angle, dbu, tolerance = 0.5):
+    '''Points of the Archimedean spiral rho = a*t + r for t in [start_angle, start_angle + angle], in dbu.
+
+    The points are spaced uniformly in rho**1.5, so the angular step follows the local radius and
+    the chord deviation is the same along the spiral: at most tolerance (dbu, see
+    geometry.arc_segments), with no more points than an angular step bounded at the inner radius.
+    Beyond that count (wide spirals), the deviation of the outer turns exceeds tolerance but stays
+    below the one of that uniform step.
+    '''
+    tol = tolerance*dbu
+    rho0, rho1 = a*start_angle + r, a*(start_angle + angle) + r
+    npoints = arc_segments(min(rho0, rho1), angle, tol)
+    if a*angle > 1e-9*r:
+        # chords of step 4*sqrt(tol/rho), see arc_segments
+        bounded = int(np.ceil((rho1**1.5 - rho0**1.5)*2/(3*a)/(4*sqrt(tol)) - 1e-9))
+        npoints = max(1, min(npoints, bounded))
+        rho = np.linspace(rho0**1.5, rho1**1.5, npoints + 1)**(2.0/3.0)
+        t = (rho - r)/a
+        t[0], t[-1] = start_angle, start_angle + angle
+    else:
+        t = np.linspace(start_angle, start_angle + angle, npoints + 1)
+    rho = _outward(a*t + r, t)
+    return np.rint(np.column_stack((rho*np.cos(t), rho*np.sin(t)))/dbu).astype(np.int64)
+
+
+def s_points(r, angle, dbu, x_offset = 0, tolerance = 0.5):
+    '''Points of the central S-shaped section made of two half circles of radius r, in dbu.'''
+    npoints = 2*arc_segments(r/dbu, pi, tolerance) # same number of points on both half circles
+    dtetha = angle / npoints
+    t = np.arange(npoints + 1)*dtetha
+    # vertices outside the circles, except at the ends and where the two half circles meet
+    rv = np.full(npoints + 1, vertex_radius(r, abs(dtetha)))
+    rv[[0, npoints//2, -1]] = r
+    xa = np.where(np.abs(t) < pi, rv*np.cos(t), -rv*np.cos(t) - 2*r)
+    ya = rv*np.sin(t)
+    pts = np.rint(np.column_stack((xa, ya))/dbu).astype(np.int64)
+    pts[:, 0] += x_offset
+    return pts
+
+
+def unique_points(pts):
+    '''Remove consecutive duplicate points of an (n, 2) array.'''
+    if len(pts) < 2:
+        return pts
+    keep = np.ones(len(pts), dtype=bool)
+    keep[1:] = np.any(pts[1:] != pts[:-1], axis=1)
+    return pts[keep]
+
+
+def spiral_centerline(radius, spacing, N, spiral_ports, dbu, tolerance = 0.5):
+    '''Centerline of the full spiral (inner spiral, S-section, outer spiral) in dbu.
+
+    Args:
+        radius: radius of the S-section (microns)
+        spacing: pitch between neighbouring waveguides (microns)
+        N: number of turns
+        spiral_ports: True if both ports are on the same side
+        tolerance: arc tolerance (dbu), see spiral_points
+
+    Returns:
+        contiguous int32 array of shape (n, 2), starting at the end of the inner spiral
+    '''
+    b = radius
+    a = 2*spacing/(2*pi)
+    s_section = s_points(b, -2*pi, dbu, int(round(b/dbu)), tolerance)
+    r = 2*b
+    inner = spiral_points(a, r, 2*pi*N, 0, dbu, tolerance)
+    outer = spiral_points(a, r + spacing, 2*pi*N + (pi if spiral_ports else 0), -pi, dbu, tolerance)
+    pts = unique_points(np.concatenate((inner[::-1], s_section, outer)))
+    return np.ascontiguousarray(pts, dtype=np.int32)
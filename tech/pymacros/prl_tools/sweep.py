@@ -0,0 +1,214 @@
+"""
+PRL PDK Tools - Parameter sweep builder
+Notice: Information in this file is confidential.
+
+Description:
+Builds test-chip sweeps (Ring gaps/radii, Spiral lengths, MMI sizes, ...) with a pool of
+worker processes. The parameter grid is split in chunks; each worker produces its chunk of
+PRL_PDK cells (see batch) into a temporary OASIS file, with one static cell per distinct
+parameter set named <PCell>_<parameter hash>. The text attributes and polygon holes OASIS does
+not write are kept in shape properties, as in disk_cache. The chunks are then merged into one
+hierarchical layout: identical cells are kept once, and every placement is labelled with its
+parameters. A failing job is reported with its index, as in batch.build.
+Wall time and the throughput of every worker are reported.
+
+Sweep file (JSON), one sweep or a list of sweeps:
+  {"pcell": "Ring",
+   "params": {"use_drop": true},                 fixed parameters
+   "sweep": {"radius": [10, 20], "gap": [0.2, 0.3]},   grid, all combinations
+   "origin": [0, 0], "pitch": [150, 150], "columns": 10}
+
+Usage:
+  PYTHONPATH=tech/pymacros python -m prl_tools.sweep sweep.json -o sweep.oas -j 8
+  PYTHONPATH=tech/pymacros python -m prl_tools.sweep tapers.json -o tapers.oas --layer X1P=3/0
+
+(C) NYUAD 2023
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import pya
+
+from .disk_cache import restore_attributes, store_attributes
+from .pcell_cache import copy_cell
+
+
+def expand(sweeps):
+    '''Placements (batch job dicts) of one or more sweep specs, in grid order.'''
+    if isinstance(sweeps, dict):
+        sweeps = [sweeps]
+    jobs = []
+    for spec in sweeps:
+        names = list(spec.get('sweep', {}))
+        values = [spec['sweep'][n] for n in names]
+        x0, y0 = spec.get('origin', (0, 0))
+        px, py = spec.get('pitch', (100, 100))
+        columns = spec.get('columns') or max(1, len(values[-1]) if values else 1)
+        for i, combination in enumerate(itertools.product(*values)):
+            params = dict(spec.get('params', {}))
+            params.update(zip(names, combination))
+            jobs.append({'pcell': spec['pcell'], 'params': params,
+                         'x': x0 + (i % columns)*px, 'y': y0 - (i // columns)*py,
+                         'rot': spec.get('rot', 0), 'mirror': spec.get('mirror', False)})
+    return jobs
+
+
+def cell_name(job):
+    '''Deterministic name of the cell produced for a job, equal for equal parameters.'''
+    text = json.dumps([job['pcell'], job.get('params', {})], sort_keys = True, default = str)
+    return '%s_%s' % (job['pcell'], hashlib.sha1(text.encode()).hexdigest()[:10])
+
+
+def label(job):
+    return '%s %s' % (job['pcell'], ' '.join('%s=%s' % kv for kv in sorted(job.get('params', {}).items())))
+
+
+def _init_worker(pymacros):
+    if pymacros not in sys.path:
+        sys.path.insert(0, pymacros)
+
+
+def _produce_chunk(args):
+    '''Worker: produce the distinct cells of a chunk of jobs into an OASIS file.
+
+    start is the index of the first job of the chunk in the sweep, for the error messages.
+    '''
+    chunk, start, technology, dbu, layers, folder = args
+    from prl_tools import batch
+    t0 = time.perf_counter()
+    ly = batch.new_layout(technology, dbu, layers = layers)
+    out = pya.Layout()
+    out.dbu = dbu
+    scratch = ly.create_cell('SCRATCH')
+    for i, job in enumerate(chunk):
+        name = cell_name(job)
+        if out.cell(name) is None:
+            try:
+                variant = batch.place(ly, scratch, dict(job, x = 0, y = 0, rot = 0, mirror = False))
+            except Exception as e:
+                raise RuntimeError('job %s (%s): %s' % (start + i, job.get('pcell'), e)) from e
+            copy_cell(variant, out.create_cell(name))
+    store_attributes(out)
+    fd, path = tempfile.mkstemp(suffix = '.oas', dir = folder)
+    os.close(fd)
+    opt = pya.SaveLayoutOptions()
+    opt.format = 'OASIS'
+    opt.write_context_info = False
+    out.write(path, opt)
+    return {'pid': os.getpid(), 'path': path, 'jobs': len(chunk), 'cells': out.cells(),
+            'seconds': time.perf_counter() - t0}
+
+
+def build(jobs, technology = 'PRL_PDK', dbu = 0.001, processes = None, chunk_size = None,
+          top_name = 'SWEEP', label_layer = pya.LayerInfo(10, 0), label_size = 2.0, layers = ()):
+    '''Produce the jobs with a process pool and merge them in one layout.
+
+    Args:
+        jobs: placements, see expand() and batch.load_jobs
+        processes: pool size, default: number of CPUs
+        chunk_size: jobs per task, default: about four tasks per process
+        label_layer: layer of the parameter labels (None for no labels)
+        layers: layers missing from the technology, see batch.new_layout
+    Returns:
+        (pya.Layout, top cell, report dict)
+    '''
+    t0 = time.perf_counter()
+    processes = processes or multiprocessing.cpu_count()
+    chunk_size = chunk_size or max(1, -(-len(jobs) // (4*processes)))
+    starts = range(0, len(jobs), chunk_size)
+    chunks = [jobs[i:i + chunk_size] for i in starts]
+    folder = tempfile.mkdtemp(prefix = 'prl_sweep_')
+    pymacros = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    try:
+        # spawn: KLayout objects are not fork safe
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Pool(processes, initializer = _init_worker, initargs = (pymacros,)) as pool:
+            results = pool.map(_produce_chunk, [(c, i, technology, dbu, tuple(layers), folder) for c, i in zip(chunks, starts)])
+        t1 = time.perf_counter()
+
+        ly = pya.Layout()
+        ly.dbu = dbu
+        ly.technology_name = technology
+        top = ly.create_cell(top_name)
+        for result in results:
+            part = pya.Layout()
+            part.read(result['path'])
+            restore_attributes(part)
+            for cell in part.each_cell():
+                if ly.cell(cell.name) is None:
+                    copy_cell(cell, ly.create_cell(cell.name))
+    finally:
+        shutil.rmtree(folder, ignore_errors = True)
+
+    label_index = ly.layer(label_layer) if label_layer is not None else None
+    for job in jobs:
+        cell = ly.cell(cell_name(job))
+        trans = pya.DCplxTrans(1, float(job.get('rot', 0)), bool(job.get('mirror', False)),
+                               float(job.get('x', 0)), float(job.get('y', 0)))
+        top.insert(pya.DCellInstArray(cell.cell_index(), trans))
+        if label_index is not None:
+            box = cell.dbbox().transformed(trans)
+            text = pya.DText(label(job), pya.DTrans(box.left, box.bottom - 2*label_size))
+            text.size = label_size
+            top.shapes(label_index).insert(text)
+    t2 = time.perf_counter()
+
+    workers = {}
+    for r in results:
+        w = workers.setdefault(r['pid'], {'tasks': 0, 'jobs': 0, 'seconds': 0.0})
+        w['tasks'] += 1
+        w['jobs'] += r['jobs']
+        w['seconds'] += r['seconds']
+    report = {'jobs': len(jobs), 'cells': len(set(cell_name(j) for j in jobs)), 'processes': processes,
+              'tasks': len(chunks), 'produce_s': t1 - t0, 'merge_s': t2 - t1, 'wall_s': t2 - t0,
+              'workers': workers}
+    return ly, top, report
+
+
+def format_report(report):
+    '''Text summary of a build() report.'''
+    lines = ['%s placements, %s distinct cells, %s processes, %s tasks' %
+             (report['jobs'], report['cells'], report['processes'], report['tasks']),
+             'wall %.2f s (produce %.2f s, merge %.2f s), %.1f placements/s' %
+             (report['wall_s'], report['produce_s'], report['merge_s'], report['jobs']/max(report['wall_s'], 1e-9)),
+             '%-8s %6s %6s %10s %10s' % ('worker', 'tasks', 'jobs', 'busy s', 'jobs/s')]
+    for pid, w in sorted(report['workers'].items()):
+        lines.append('%-8s %6s %6s %10.2f %10.1f' % (pid, w['tasks'], w['jobs'], w['seconds'], w['jobs']/max(w['seconds'], 1e-9)))
+    return '\n'.join(lines)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Build a PRL_PDK parameter sweep layout with a process pool.')
+    parser.add_argument('sweep', help = 'JSON sweep file')
+    parser.add_argument('-o', '--output', required = True, help = 'output layout (.gds, .oas)')
+    parser.add_argument('-j', '--processes', type = int, default = None)
+    parser.add_argument('--chunk-size', type = int, default = None)
+    parser.add_argument('--technology', default = 'PRL_PDK')
+    parser.add_argument('--dbu', type = float, default = 0.001)
+    parser.add_argument('--no-labels', action = 'store_true')
+    parser.add_argument('--layer', action = 'append', metavar = 'NAME=L/D',
+                        help = 'define a layer missing from the technology, see prl_tools.batch')
+    args = parser.parse_args(argv)
+
+    from .batch import parse_layers
+    with open(args.sweep) as f:
+        jobs = expand(json.load(f))
+    ly, top, report = build(jobs, args.technology, args.dbu, args.processes, args.chunk_size,
+                            label_layer = None if args.no_labels else pya.LayerInfo(10, 0),
+                            layers = parse_layers(args.layer))
+    ly.write(args.output)
+    print(format_report(report))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
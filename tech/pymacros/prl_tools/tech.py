@@ -0,0 +1,253 @@
+"""
+PRL PDK Tools - Technology resolver
+Notice: Information in this file is confidential.
+
+Description:
+Cached access to the technology data used by the PCells:
+  - technology(name): layer table of SiEPIC get_technology_by_name, as a read-only mapping.
+  - waveguide_types(name): WAVEGUIDES.xml / WAVEGUIDES_*.xml specs, as read-only mappings
+    (waveguide_params: modifiable copy of one, for the SiEPIC layout functions).
+  - layer_index(layout, layer): ly.layer(...) index, cached per layout.
+  - arc_tolerance(name): maximum deviation of the arcs drawn by the PCells from the circle, in dbu.
+  - layout_technology / register_technology: technology setup that also works without the GUI.
+The technology is parsed again only when the layer properties file (or the technology folder)
+changes, and the waveguide specs only when one of the WAVEGUIDES XML files changes, so producing
+many cells does not parse the XML files for each one.
+
+Usage:
+  from prl_tools.tech import technology, waveguide_type, layer_index
+  TECHNOLOGY = technology('PRL_PDK')
+  LayerWg = layer_index(ly, TECHNOLOGY['Waveguide'])
+
+(C) NYUAD 2023
+"""
+
+import atexit
+import fnmatch
+import os
+import shutil
+import tempfile
+import weakref
+from types import MappingProxyType
+
+import pya
+
+
+_technologies = {}   # name -> (stamp, frozen layer table)
+_waveguides = {}   # name -> (xml paths, stamp, frozen specs)
+_layer_indexes = weakref.WeakKeyDictionary()   # layout -> {(layer, datatype, name): index}
+_arc_tolerances = {}   # name -> tolerance in dbu
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except (OSError, TypeError):
+        return None
+
+
+def _freeze(value):
+    '''Read-only copy of nested dicts and lists.'''
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _technology_stamp(name):
+    tech = pya.Technology.technology_by_name(name)
+    if tech is None:
+        return None
+    return (_mtime(tech.eff_layer_properties_file()), _mtime(tech.base_path()))
+
+
+def technology(name = 'PRL_PDK'):
+    '''Layer table of a technology (see SiEPIC.utils.get_technology_by_name), parsed once per lyp file version.'''
+    stamp = _technology_stamp(name)
+    cached = _technologies.get(name)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    import SiEPIC.utils
+    get_technology_by_name = SiEPIC.utils.get_technology_by_name
+    if hasattr(get_technology_by_name, 'cache_clear'):
+        # recent SiEPIC versions memoize the layer table forever
+        get_technology_by_name.cache_clear()
+    table = _freeze(dict(get_technology_by_name(name)))
+    _technologies[name] = (stamp, table)
+    return table
+
+
+def _waveguide_files(name):
+    '''WAVEGUIDES.xml and WAVEGUIDES_*.xml files of the technology folder, as searched by SiEPIC.
+
+    SiEPIC only searches folders holding a <name>.lyt file. When there is none (the PRL_PDK
+    technology file is PRLPDK_EBeam.lyt) the files at the top of the technology folder are used.
+    '''
+    tech = pya.Technology.technology_by_name(name)
+    if tech is None or not tech.base_path():
+        return ()
+    paths = []
+    for root, dirnames, filenames in os.walk(tech.base_path(), followlinks = True):
+        if fnmatch.filter(filenames, name + '.lyt'):
+            paths += [os.path.join(root, f) for f in fnmatch.filter(filenames, 'WAVEGUIDES.xml')]
+            paths += [os.path.join(root, f) for f in fnmatch.filter(filenames, 'WAVEGUIDES_*.xml')]
+    if not paths:
+        filenames = os.listdir(tech.base_path())
+        paths = [os.path.join(tech.base_path(), f) for f in
+                 fnmatch.filter(filenames, 'WAVEGUIDES.xml') + fnmatch.filter(filenames, 'WAVEGUIDES_*.xml')]
+    return tuple(paths)
+
+
+def _load_waveguides(paths):
+    '''Waveguide specs of XML files, normalized as in SiEPIC.utils.load_Waveguides_by_Tech.'''
+    from SiEPIC.utils import xml_to_dict
+    waveguides = []
+    for path in paths:
+        with open(path, 'r') as f:
+            wgs = xml_to_dict(f.read()).get('waveguides', {}).get('waveguide', [])
+        waveguides += wgs if isinstance(wgs, list) else [wgs]
+    for waveguide in waveguides:
+        if 'component' in waveguide and not isinstance(waveguide['component'], list):
+            waveguide['component'] = [waveguide['component']]
+        waveguide['adiabatic'] = 'bezier' in waveguide
+        waveguide.setdefault('bezier', '')
+        waveguide.setdefault('CML', '')
+        waveguide.setdefault('model', '')
+    return waveguides
+
+
+def waveguide_types(name = 'PRL_PDK'):
+    '''Waveguide specs of a technology (see SiEPIC.utils.load_Waveguides_by_Tech), parsed once per XML file version.'''
+    cached = _waveguides.get(name)
+    paths = cached[0] if cached else _waveguide_files(name)
+    stamp = tuple(_mtime(p) for p in paths)
+    if cached and cached[1] == stamp:
+        return cached[2]
+    from SiEPIC.utils import load_Waveguides_by_Tech
+    specs = _freeze(load_Waveguides_by_Tech(name) or _load_waveguides(paths))
+    _waveguides[name] = (paths, stamp, specs)
+    return specs
+
+
+def waveguide_type(wg_type, name = 'PRL_PDK'):
+    '''Spec of one waveguide type, by name.'''
+    for spec in waveguide_types(name):
+        if spec['name'] == wg_type:
+            return spec
+    raise Exception('error: waveguide type (%s) not found in PDK waveguides' % wg_type)
+
+
+def _thaw(value):
+    '''Modifiable copy of a value frozen by _freeze.'''
+    if isinstance(value, MappingProxyType):
+        return {k: _thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(v) for v in value]
+    return value
+
+
+def waveguide_params(wg_type, name = 'PRL_PDK'):
+    '''Modifiable copy of the spec of a waveguide type, as SiEPIC.utils.layout.layout_waveguide3
+    expects it (it adds keys to the dict).'''
+    params = _thaw(waveguide_type(wg_type, name))
+    if 'width' not in params and 'compound_waveguide' not in params:
+        params['width'] = params['wg_width']
+    params['waveguide_type'] = wg_type
+    return params
+
+
+def arc_tolerance(name = None):
+    '''Maximum deviation of discretized arcs and circles from the exact curve, in dbu, for a technology.
+
+    Default: 0.5 dbu, or $PRLPDK_ARC_TOLERANCE; set_arc_tolerance overrides it per technology.
+    '''
+    tolerance = _arc_tolerances.get(name)
+    if tolerance is None:
+        tolerance = float(os.environ.get('PRLPDK_ARC_TOLERANCE', 0.5))
+    return tolerance
+
+
+def set_arc_tolerance(tolerance, name = 'PRL_PDK'):
+    '''Set the arc tolerance (dbu) of a technology, None restores the default.'''
+    if tolerance is None:
+        _arc_tolerances.pop(name, None)
+    else:
+        _arc_tolerances[name] = float(tolerance)
+
+
+def current_view():
+    '''The current layout view of the KLayout application, or None when running without a main window.'''
+    app = getattr(pya, 'Application', None)   # not available in the standalone klayout module
+    mw = app.instance().main_window() if app is not None and app.instance() else None
+    return mw.current_view() if mw is not None else None
+
+
+def layout_technology(layout, technology_name, dbu = 0.005):
+    '''Give a layout without technology the technology and dbu of the current view.
+
+    Without a view (batch mode, standalone module) technology_name and dbu are used.
+    '''
+    if layout.technology_name != '':
+        return
+    lv = current_view()
+    if lv is None:
+        layout.technology_name = technology_name
+        layout.dbu = dbu
+    else:
+        layout.technology_name = lv.active_cellview().layout().technology_name
+        layout.dbu = lv.active_cellview().layout().dbu
+
+
+def register_technology(name = 'PRL_PDK', base_path = None, dbu = 0.001, lyp = 'PRLPDK_EBeam.lyp', layers = ()):
+    '''Declare a technology outside the KLayout application (which loads it from the .lyt file).
+
+    Args:
+        name: technology name
+        base_path: technology folder, by default the tech folder of this PDK
+        dbu: database unit
+        lyp: layer properties file, relative to base_path
+        layers: (name, 'layer/datatype') of layers to add to those of lyp, e.g. the X1P, M1P and
+            P1P layers some PCells use but PRLPDK_EBeam.lyp does not define. The technology then
+            uses a copy of lyp with these layers, in a temporary folder removed at exit.
+    Returns:
+        the pya.Technology (the existing one if name is already declared)
+    '''
+    if pya.Technology.has_technology(name):
+        return pya.Technology.technology_by_name(name)
+    base_path = base_path or os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..'))
+    if layers:
+        with open(os.path.join(base_path, lyp)) as f:
+            text = f.read()
+        extra = ''.join(' <properties>\n  <name>%s</name>\n  <source>%s@1</source>\n </properties>\n' % (layer, source)
+                        for layer, source in layers)
+        end = text.rindex('</layer-properties>')
+        folder = tempfile.mkdtemp(prefix = 'prl_tech_')
+        atexit.register(shutil.rmtree, folder, True)
+        lyp = os.path.join(folder, os.path.basename(lyp))
+        with open(lyp, 'w') as f:
+            f.write(text[:end] + extra + text[end:])
+    tech = pya.Technology.create_technology(name)
+    tech.dbu = dbu
+    tech.default_base_path = base_path
+    tech.layer_properties_file = lyp
+    return tech
+
+
+def layer_index(layout, layer):
+    '''Index of a layer (pya.LayerInfo) in layout, created if needed. Same as layout.layer(layer).'''
+    indexes = _layer_indexes.get(layout)
+    if indexes is None:
+        indexes = _layer_indexes[layout] = {}
+    key = (layer.layer, layer.datatype, layer.name)
+    index = indexes.get(key)
+    if index is None or not layout.is_valid_layer(index):
+        index = indexes[key] = layout.layer(layer)
+    return index
+
+
+def invalidate():
+    '''Forget all cached technology data, e.g. after adding a new WAVEGUIDES_*.xml file.'''
+    _technologies.clear()
+    _waveguides.clear()
+    _layer_indexes.clear()